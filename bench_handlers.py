@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+BirdTag HTTP 函数压测脚本
+
+Drives query-files, query-by-count, manage-tags, delete-files, search-by-file and register-user
+with a configurable number of concurrent clients and reports, per handler:
+    - throughput (requests/sec) and p50 / p95 / p99 latency
+    - Tablestore calls and read CU per request (in-process mode only)
+    - response bytes per request and the status code mix
+
+Two modes:
+    - inprocess : handlers run through local_emulator.py against a synthetic media_metadata table
+                  of --rows rows whose species follow a Zipf-like distribution
+    - http      : requests go to the deployed API Gateway (--base-url); the data already in
+                  Tablestore is used, and register-user creates one throwaway account per request
+
+Results can be written as JSON (--json) and compared with an earlier run (--baseline), so a
+regression between commits shows up as a diff of two files.
+
+运行方式：
+    python bench_handlers.py --rows 5000 --concurrency 8 --requests 200
+    python bench_handlers.py --handlers query-files query-by-count --json bench_results.json
+    python bench_handlers.py --baseline bench_results.json
+    python bench_handlers.py --handlers query-files --ots-latency-ms 2 --scan-workers 1   # vs --scan-workers 8
+    python bench_handlers.py --mode http --base-url https://<api-gateway-domain> --email a@b.c --password ...
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import local_emulator
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+HANDLERS = ["query-files", "query-by-count", "manage-tags", "delete-files", "search-by-file", "register-user"]
+# Species seen in test_images first, so the most common synthetic tags are ones the model can produce.
+SPECIES = ["crow", "pigeon", "sparrow", "myna", "kingfisher", "owl", "peacock",
+           "magpie", "egret", "heron", "duck", "eagle", "parrot", "swallow", "woodpecker"]
+ZIPF_EXPONENT = 1.1
+SEED_DAYS = 30
+TIMEOUT_SECONDS = 60
+
+
+# ========== 合成数据 ==========
+def species_weights(exponent: float = ZIPF_EXPONENT):
+    return [1 / (rank ** exponent) for rank in range(1, len(SPECIES) + 1)]
+
+
+def synthetic_tags(rng: random.Random) -> dict:
+    """One to three species per image, common species far more often than rare ones."""
+    n_species = rng.choices([1, 2, 3], weights=[70, 22, 8])[0]
+    tags = {}
+    while len(tags) < n_species:
+        tags[rng.choices(SPECIES, weights=species_weights())[0]] = rng.choices([1, 2, 3, 4, 6], [55, 25, 10, 7, 3])[0]
+    return tags
+
+
+def seed_dataset(emu: local_emulator.LocalEmulator, rows: int, seed: int):
+    """
+    Writes `rows` media_metadata rows keyed like get-upload-url keys (uploads/<uuid hex>-<name>),
+    uploaded at random times over the last SEED_DAYS days.
+    """
+    rng = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    distribution = Counter()
+    file_urls = []
+    for i in range(rows):
+        tags = synthetic_tags(rng)
+        distribution.update(tags.keys())
+        base = f"{rng.getrandbits(128):032x}-synthetic_{i}"
+        file_urls.append(emu.file_url(f"uploads/{base}.jpg"))
+        emu.seed_media(file_urls[-1], tags, uploader=f"user{i % 50}@example.com",
+                       thumbnail_url=emu.file_url(f"thumbnails/{base}-thumb-200.webp"),
+                       uploaded_at=now_ms - rng.randrange(SEED_DAYS * 24 * 3600 * 1000))
+    return distribution, file_urls
+
+
+def load_images(limit: int = 8):
+    image_dir = os.path.join(ROOT, "test_images")
+    names = sorted(n for n in os.listdir(image_dir) if n.lower().endswith((".jpg", ".jpeg", ".png")))[:limit]
+    images = []
+    for name in names:
+        with open(os.path.join(image_dir, name), "rb") as f:
+            images.append((name, f.read()))
+    return images
+
+
+# ========== 请求生成 ==========
+class Workload:
+    """Produces the request for the i-th call of each handler, in either mode."""
+
+    def __init__(self, rng: random.Random, file_urls, delete_urls, images):
+        self.rng = rng
+        self.file_urls = file_urls
+        self.delete_urls = delete_urls
+        self.images = images
+        self._lock = threading.Lock()
+
+    def _species(self):
+        with self._lock:
+            return self.rng.choices(SPECIES, weights=species_weights())[0]
+
+    def _url(self):
+        with self._lock:
+            return self.rng.choice(self.file_urls)
+
+    def request(self, handler: str, i: int):
+        """Returns (method, path, query, json_body, file) for one request."""
+        if handler == "query-files":
+            return "GET", "/search", {"species": self._species()}, None, None
+        if handler == "query-by-count":
+            return "POST", "/query-by-count", None, {self._species(): self.rng.choice([1, 2])}, None
+        if handler == "manage-tags":
+            return "POST", "/tags/manage", None, {"url": [self._url()], "operation": 1,
+                                                  "tags": [f"{self._species()},1"]}, None
+        if handler == "delete-files":
+            return "POST", "/files/delete", None, {"urls": [self.delete_urls[i % len(self.delete_urls)]]}, None
+        if handler == "search-by-file":
+            return "POST", "/search-by-file", None, None, self.images[i % len(self.images)]
+        if handler == "register-user":
+            return "POST", "/register", None, {"email": f"bench-{uuid.uuid4().hex[:12]}@example.com",
+                                               "password": "BenchPassword123"}, None
+        raise ValueError(f"Unknown handler: {handler}")
+
+
+# ========== 两种调用方式 ==========
+class InProcessClient:
+    def __init__(self, emu: local_emulator.LocalEmulator, token: str):
+        self.emu = emu
+        self.token = token
+
+    def call(self, handler, method, path, query, body, file):
+        if file is not None:
+            event = self.emu.multipart_event(path, self.token, file[1], filename=file[0])
+        else:
+            event = self.emu.http_event(method, path, token=self.token, query=query, body=body)
+        resp = self.emu.invoke(handler, event)
+        return resp.get("statusCode", 200), len((resp.get("body") or "").encode("utf-8"))
+
+    def ots_stats(self):
+        return Counter(self.emu.stats)
+
+
+class HttpClient:
+    def __init__(self, base_url: str, token: str):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.session = requests.Session()
+
+    def call(self, handler, method, path, query, body, file):
+        headers = {"Authorization": self.token}
+        url = f"{self.base_url}{path}"
+        if file is not None:
+            resp = self.session.post(url, files={"file": (file[0], file[1], "image/jpeg")}, headers=headers,
+                                     timeout=TIMEOUT_SECONDS)
+        else:
+            resp = self.session.request(method, url, params=query, json=body, headers=headers,
+                                        timeout=TIMEOUT_SECONDS)
+        return resp.status_code, len(resp.content)
+
+    def ots_stats(self):
+        return None
+
+
+def http_login(base_url: str, email: str, password: str) -> str:
+    import requests
+    resp = requests.post(f"{base_url.rstrip('/')}/login", json={"email": email, "password": password},
+                         timeout=TIMEOUT_SECONDS)
+    resp.raise_for_status()
+    return resp.json()["token"]
+
+
+# ========== 压测 ==========
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_handler(client, workload: Workload, handler: str, n_requests: int, concurrency: int, warmup: int):
+    for i in range(warmup):
+        client.call(handler, *workload.request(handler, n_requests + i))
+
+    before = client.ots_stats()
+    latencies, statuses, sizes = [], Counter(), []
+
+    def one(i):
+        request = workload.request(handler, i)
+        t0 = time.perf_counter()
+        try:
+            status, size = client.call(handler, *request)
+        except Exception as e:  # noqa: BLE001 - counted as an error, the run continues
+            status, size = type(e).__name__, 0
+        return (time.perf_counter() - t0) * 1000, status, size
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency_ms, status, size in pool.map(one, range(n_requests)):
+            latencies.append(latency_ms)
+            statuses[str(status)] += 1
+            sizes.append(size)
+    elapsed = time.perf_counter() - t_start
+
+    latencies.sort()
+    result = {
+        "requests": n_requests,
+        "errors": sum(c for s, c in statuses.items() if not s.startswith("2")),
+        "status": dict(statuses),
+        "throughput_rps": round(n_requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+        "bytes_per_request": round(statistics.fmean(sizes), 1),
+        "ots_calls_per_request": None,
+        "ots_read_cu_per_request": None,
+        "ots_rows_read_per_request": None,
+    }
+    after = client.ots_stats()
+    if before is not None:
+        result["ots_calls_per_request"] = round((after["calls"] - before["calls"]) / n_requests, 2)
+        result["ots_read_cu_per_request"] = round((after["cu.read"] - before["cu.read"]) / n_requests, 2)
+        result["ots_rows_read_per_request"] = round((after["rows.read"] - before["rows.read"]) / n_requests, 1)
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def print_results(results: dict, baseline: dict = None):
+    columns = ["throughput_rps", "p50_ms", "p95_ms", "p99_ms", "ots_calls_per_request", "bytes_per_request"]
+    print(f"\n{'handler':>15} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ots/req':>8} {'bytes/req':>10} {'errors':>7}")
+    for handler, r in results["handlers"].items():
+        cells = ["-" if r[c] is None else f"{r[c]:g}" for c in columns]
+        print(f"{handler:>15} {cells[0]:>9} {cells[1]:>9} {cells[2]:>9} {cells[3]:>9} {cells[4]:>8} {cells[5]:>10} "
+              f"{r['errors']:>7}")
+        old = (baseline or {}).get("handlers", {}).get(handler)
+        if old:
+            deltas = []
+            for c in columns:
+                if r[c] is not None and old.get(c):
+                    deltas.append(f"{(r[c] - old[c]) / old[c] * 100:+.0f}%")
+                else:
+                    deltas.append("-")
+            print(f"{'vs ' + baseline.get('commit', 'baseline'):>15} " + " ".join(f"{d:>9}" for d in deltas[:4])
+                  + f" {deltas[4]:>8} {deltas[5]:>10}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Load-generation benchmark for the BirdTag HTTP handlers")
+    p.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    p.add_argument("--handlers", nargs="+", choices=HANDLERS,
+                   default=["query-files", "query-by-count", "manage-tags", "delete-files", "register-user"],
+                   help="search-by-file needs model.pt (in-process) and is therefore not run by default")
+    p.add_argument("--rows", type=int, default=2000, help="Synthetic media_metadata rows (in-process mode)")
+    p.add_argument("--requests", type=int, default=100, help="Measured requests per handler")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--warmup", type=int, default=2)
+    p.add_argument("--seed", type=int, default=5225)
+    p.add_argument("--sqlite", help="Back the in-process Tablestore with this SQLite file")
+    p.add_argument("--ots-latency-ms", type=float, default=0.0,
+                   help="Simulated round trip per Tablestore call (in-process), e.g. 2 for a VPC endpoint")
+    p.add_argument("--scan-workers", type=int, default=None, help="SCAN_WORKERS for the scanning handlers")
+    p.add_argument("--base-url", default="", help="API Gateway domain (http mode)")
+    p.add_argument("--email", default="", help="Existing account used to log in (http mode)")
+    p.add_argument("--password", default="")
+    p.add_argument("--delete-urls", nargs="*", default=[],
+                   help="File URLs that delete-files may remove (http mode; delete-files is skipped without them)")
+    p.add_argument("--json", help="Write machine-readable results to this file")
+    p.add_argument("--baseline", help="Earlier --json output to compare against")
+    p.add_argument("--verbose", action="store_true", help="Keep the handlers' own print output (in-process)")
+    args = p.parse_args()
+
+    rng = random.Random(args.seed)
+    images = load_images() if "search-by-file" in args.handlers else []
+    handlers = list(args.handlers)
+
+    if args.mode == "inprocess":
+        if args.scan_workers is not None:
+            # Read by parallel_scan when the handlers are first imported.
+            os.environ["SCAN_WORKERS"] = str(args.scan_workers)
+        # One bench user sends every request; measure search-by-file itself, not its rate limit (admission.py).
+        os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+        # seed_dataset() fills species_index too, so measure query-files as deployed after build_indexes.py.
+        os.environ.setdefault("SPECIES_INDEX_ENABLED", "1")
+        os.environ.setdefault("UPLOADER_INDEX_ENABLED", "1")
+        emu = local_emulator.LocalEmulator(sqlite_path=args.sqlite, ots_latency_ms=args.ots_latency_ms)
+        print(f"Seeding {args.rows} synthetic rows ...")
+        distribution, file_urls = seed_dataset(emu, args.rows, args.seed)
+        print("Species distribution (top 5): " + ", ".join(f"{s}={c}" for s, c in distribution.most_common(5)))
+        # delete-files gets its own rows so the other handlers always see --rows rows.
+        delete_urls = []
+        for i in range(args.requests + args.warmup):
+            key = f"uploads/delete_me_{i:07d}.jpg"
+            emu.bucket().put_object(key, b"x")
+            emu.seed_media(emu.file_url(key), {"crow": 1})
+            delete_urls.append(emu.file_url(key))
+        token = emu.create_session("bench@example.com", ttl_seconds=24 * 3600)
+        client = InProcessClient(emu, token)
+    else:
+        if not (args.base_url and args.email and args.password):
+            p.error("--mode http needs --base-url, --email and --password")
+        token = http_login(args.base_url, args.email, args.password)
+        client = HttpClient(args.base_url, token)
+        file_urls = args.delete_urls or ["https://birdtag-media-5225.oss-cn-hangzhou.aliyuncs.com/uploads/crows_1.jpg"]
+        delete_urls = args.delete_urls
+        if "delete-files" in handlers and not delete_urls:
+            print("[提示] 未提供 --delete-urls，跳过 delete-files")
+            handlers.remove("delete-files")
+
+    workload = Workload(rng, file_urls, delete_urls, images)
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "mode": args.mode,
+        "rows": args.rows if args.mode == "inprocess" else None,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "ots_latency_ms": args.ots_latency_ms if args.mode == "inprocess" else None,
+        "scan_workers": args.scan_workers,
+        "handlers": {},
+    }
+    for handler in handlers:
+        print(f"Running {handler} ({args.requests} requests, concurrency {args.concurrency}) ...")
+        quiet = args.mode == "inprocess" and not args.verbose
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            results["handlers"][handler] = run_handler(client, workload, handler, args.requests,
+                                                       args.concurrency, args.warmup)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
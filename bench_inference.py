@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+bird_detector 推理吞吐基准（分阶段计时 + 物种准确率）
+
+Runs every image in a directory through bird_detector and reports, per backend:
+    - images/sec for the end-to-end detect_birds_in_image() call and for batched prediction
+    - p50 / p95 / p99 latency of each stage: decode, preprocess, forward, postprocess, count
+    - peak RSS of the process
+    - species accuracy against the label in the file name (crows_1.jpg -> crow)
+
+The stage timings re-run the same steps detect_birds_in_image() performs, so they add up to the
+end-to-end latency. For the PyTorch backend the preprocess / forward / postprocess split comes
+from ultralytics' own per-result timings. The staged run is always a single full-view pass, so with
+TILED_INFERENCE=1 large images are expected to differ from the end-to-end result.
+
+运行方式：
+    python bench_inference.py
+    python bench_inference.py --backends pytorch onnx openvino --repeat 5 --batch-size 4
+    python bench_inference.py --json inference_results.json --min-accuracy 0.9
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+from detector_loader import load_detector
+from test_backend_parity import hr
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STAGES = ["decode", "preprocess", "forward", "postprocess", "count"]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, or None where it cannot be read."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+    except ImportError:
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return getattr(info, "peak_wset", info.rss) / 1024 / 1024
+        except ImportError:
+            return None
+
+
+def normalize_species(name: str) -> str:
+    """'Crows' / 'crow' / 'Peacocks' -> 'crow' / 'crow' / 'peacock'."""
+    name = name.strip().lower().replace("_", " ")
+    return name[:-1] if len(name) > 3 and name.endswith("s") else name
+
+
+def label_from_filename(path: str) -> str:
+    """crows_1.jpg -> crow; the label is everything before the trailing _<n>."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return normalize_species(re.sub(r"[_-]?\d+$", "", stem))
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordered = sorted(values)
+
+    def at(q):
+        k = (len(ordered) - 1) * q
+        lo = int(k)
+        hi = min(lo + 1, len(ordered) - 1)
+        return round(ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo), 2)
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99)}
+
+
+# ========== 分阶段推理 ==========
+def staged_predict(detector, imgs, stage_ms):
+    """
+    Runs one batch of decoded BGR images the way detect_birds_in_image() does and adds the
+    preprocess / forward / postprocess time per image to stage_ms. Returns one class_id array per image.
+    """
+    import numpy as np
+    conf = detector.CONFIDENCE_THRESHOLD
+    if detector.DETECTOR_BACKEND == "pytorch":
+        import supervision as sv
+        outputs = []
+        for result in detector.model(imgs, verbose=False, conf=conf):
+            t0 = time.perf_counter()
+            detections = sv.Detections.from_ultralytics(result)
+            detections = detections[(detections.confidence > conf)]
+            convert_ms = (time.perf_counter() - t0) * 1000
+            stage_ms["preprocess"].append(result.speed["preprocess"])
+            stage_ms["forward"].append(result.speed["inference"])
+            stage_ms["postprocess"].append(result.speed["postprocess"] + convert_ms)
+            outputs.append(detections.class_id)
+        return outputs
+
+    model = detector.model
+    t0 = time.perf_counter()
+    letterboxed = [detector._letterbox(img, model.input_size) for img in imgs]
+    t1 = time.perf_counter()
+    step = model.batch_size or len(imgs)
+    forward_s, post_s, outputs = 0.0, 0.0, []
+    for i in range(0, len(imgs), step):
+        chunk = letterboxed[i:i + step]
+        blob = np.concatenate([b for b, _, _ in chunk])
+        if len(chunk) < step:
+            blob = np.concatenate([blob, np.zeros((step - len(chunk),) + blob.shape[1:], blob.dtype)])
+        f0 = time.perf_counter()
+        output = model._run(blob)
+        f1 = time.perf_counter()
+        for j, (_, gain, pad) in enumerate(chunk):
+            outputs.append(detector._postprocess(output[j:j + 1], gain, pad, imgs[i + j].shape, conf)[2])
+        post_s += time.perf_counter() - f1
+        forward_s += f1 - f0
+    n = len(imgs)
+    stage_ms["preprocess"].extend([(t1 - t0) * 1000 / n] * n)
+    stage_ms["forward"].extend([forward_s * 1000 / n] * n)
+    stage_ms["postprocess"].extend([post_s * 1000 / n] * n)
+    return outputs
+
+
+def run_staged(detector, images, repeat, batch_size):
+    """Decode -> predict (in batches of batch_size) -> count, timing each stage per image."""
+    import cv2 as cv
+    import numpy as np
+    stage_ms = {stage: [] for stage in STAGES}
+    predictions = {}
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for i in range(0, len(images), batch_size):
+            batch = images[i:i + batch_size]
+            decoded = []
+            for _, data in batch:
+                t0 = time.perf_counter()
+                decoded.append(cv.imdecode(np.frombuffer(data, np.uint8), cv.IMREAD_COLOR))
+                stage_ms["decode"].append((time.perf_counter() - t0) * 1000)
+            for (name, _), class_id in zip(batch, staged_predict(detector, decoded, stage_ms)):
+                t0 = time.perf_counter()
+                predictions[name] = dict(Counter(detector.class_dict[int(c)] for c in class_id))
+                stage_ms["count"].append((time.perf_counter() - t0) * 1000)
+    wall = time.perf_counter() - started
+    return predictions, stage_ms, wall
+
+
+def run_end_to_end(detector, images, repeat):
+    latencies_ms, predictions = [], {}
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for name, data in images:
+            t0 = time.perf_counter()
+            predictions[name] = detector.detect_birds_in_image(data)
+            latencies_ms.append((time.perf_counter() - t0) * 1000)
+    return predictions, latencies_ms, time.perf_counter() - started
+
+
+def score_accuracy(predictions):
+    """An image is correct when its labelled species is the most frequent detection."""
+    rows, correct, present = [], 0, 0
+    for name, counts in sorted(predictions.items()):
+        label = label_from_filename(name)
+        normalized = Counter()
+        for species, count in counts.items():
+            normalized[normalize_species(species)] += count
+        top = normalized.most_common(1)[0][0] if normalized else None
+        correct += top == label
+        present += label in normalized
+        rows.append((name, label, dict(counts), top == label))
+    n = max(1, len(predictions))
+    return {"top1": round(correct / n, 3), "present": round(present / n, 3)}, rows
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark bird_detector throughput and per-stage latency")
+    p.add_argument("--model-dir", default=os.path.join(ROOT, "search-by-file"), help="Directory holding model.pt / model.onnx")
+    p.add_argument("--images", default=os.path.join(ROOT, "test_images"), help="Directory of labelled test images")
+    p.add_argument("--backends", nargs="+", default=["pytorch"], choices=["pytorch", "onnx", "openvino"])
+    p.add_argument("--repeat", type=int, default=3, help="Timed passes over the image set")
+    p.add_argument("--batch-size", type=int, default=1, help="Images per model call in the staged run")
+    p.add_argument("--min-accuracy", type=float, default=None,
+                   help="Exit with status 1 if top-1 species accuracy of any backend falls below this")
+    p.add_argument("--json", help="Write machine-readable results to this file")
+    args = p.parse_args()
+
+    detector = load_detector(args.model_dir)
+    paths = sorted(glob.glob(os.path.join(args.images, "*.jpg")) + glob.glob(os.path.join(args.images, "*.png")))
+    if not paths:
+        print(f"[错误] No images found in {args.images}")
+        sys.exit(1)
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), f.read()))
+
+    results = {"images": len(images), "repeat": args.repeat, "batch_size": args.batch_size, "backends": {}}
+    accuracy_ok = True
+    for backend in args.backends:
+        hr(f"Backend: {backend}")
+        detector.set_backend(backend)
+        detector.warm_up()
+
+        e2e_predictions, e2e_ms, e2e_wall = run_end_to_end(detector, images, args.repeat)
+        predictions, stage_ms, staged_wall = run_staged(detector, images, args.repeat, args.batch_size)
+        accuracy, rows = score_accuracy(e2e_predictions)
+        n = len(images) * args.repeat
+
+        summary = {
+            "cold_start": dict(detector.timings),
+            "images_per_sec": round(n / e2e_wall, 2),
+            "images_per_sec_staged": round(n / staged_wall, 2),
+            "end_to_end_ms": percentiles(e2e_ms),
+            "stages_ms": {stage: percentiles(stage_ms[stage]) for stage in STAGES},
+            "peak_rss_mb": None if peak_rss_mb() is None else round(peak_rss_mb(), 1),
+            "accuracy": accuracy,
+            "staged_matches_end_to_end": predictions == e2e_predictions,
+        }
+        results["backends"][backend] = summary
+
+        print(f"cold start       : {summary['cold_start']}")
+        print(f"images/sec       : {summary['images_per_sec']:.2f} (end-to-end), "
+              f"{summary['images_per_sec_staged']:.2f} (staged, batch {args.batch_size})")
+        print(f"peak RSS         : {summary['peak_rss_mb']} MB")
+        print(f"\n{'stage':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for stage in STAGES + ["end_to_end"]:
+            pct = summary["stages_ms"].get(stage) or summary["end_to_end_ms"]
+            print(f"{stage:>12} {pct['p50']:>9.2f} {pct['p95']:>9.2f} {pct['p99']:>9.2f}")
+
+        print(f"\n准确率 top-1 {accuracy['top1']:.0%}，检测到标注物种 {accuracy['present']:.0%}")
+        for name, label, counts, ok in rows:
+            if not ok:
+                print(f"{name:>20}: FAIL ❌  label={label} detected={counts}")
+        if not summary["staged_matches_end_to_end"]:
+            print("[警告] 分阶段运行与 detect_birds_in_image() 结果不一致")
+        if args.min_accuracy is not None and accuracy["top1"] < args.min_accuracy:
+            accuracy_ok = False
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+    sys.exit(0 if accuracy_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
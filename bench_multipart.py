@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+search-by-file multipart 解析基准
+
+Builds base64-encoded multipart/form-data bodies like the ones API Gateway passes to
+search-by-file, then measures parse time and peak Python memory for:
+    - zero-copy : binascii.a2b_base64 + multipart.find_part (memoryview slice)
+    - toolbelt  : base64 decode + requests_toolbelt MultipartDecoder (if installed)
+
+运行方式：
+    python bench_multipart.py
+    python bench_multipart.py --sizes-mb 1 4 12 24 --repeat 5
+"""
+
+import argparse
+import base64
+import binascii
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "search-by-file"))
+import multipart  # noqa: E402
+
+BOUNDARY = "----BirdTagBenchBoundary7MA4YWxkTrZu0gW"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def build_event_body(size_bytes: int) -> str:
+    payload = os.urandom(size_bytes)
+    body = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="note"\r\n\r\n'
+        "benchmark\r\n"
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="bird.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + payload + f"\r\n--{BOUNDARY}--\r\n".encode()
+    return base64.b64encode(body).decode("ascii")
+
+
+def parse_zero_copy(event_body: str) -> int:
+    body = binascii.a2b_base64(event_body)
+    part = multipart.find_part(body, CONTENT_TYPE, "file")
+    return len(part)
+
+
+def parse_toolbelt(event_body: str) -> int:
+    from requests_toolbelt.multipart import decoder
+    body = base64.b64decode(event_body)
+    for part in decoder.MultipartDecoder(body, CONTENT_TYPE).parts:
+        if part.headers[b"Content-Disposition"].decode("utf-8").startswith('form-data; name="file"'):
+            return len(part.content)
+    return 0
+
+
+def measure(fn, event_body: str, repeat: int):
+    times_ms = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(event_body)
+        times_ms.append((time.perf_counter() - t0) * 1000)
+    tracemalloc.start()
+    fn(event_body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times_ms), peak / 1024 / 1024
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark multipart parsing for search-by-file")
+    p.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 4, 12, 24])
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    parsers = [("zero-copy", parse_zero_copy)]
+    try:
+        import requests_toolbelt  # noqa: F401
+        parsers.append(("toolbelt", parse_toolbelt))
+    except ImportError:
+        print("[提示] requests_toolbelt 未安装，只测试 zero-copy 解析器")
+
+    print(f"{'size':>8} {'parser':>10} {'parse ms':>10} {'peak MB':>9} {'peak/size':>10}")
+    for size_mb in args.sizes_mb:
+        size_bytes = int(size_mb * 1024 * 1024)
+        event_body = build_event_body(size_bytes)
+        for name, fn in parsers:
+            assert fn(event_body) == size_bytes, f"{name} returned the wrong part"
+            parse_ms, peak_mb = measure(fn, event_body, args.repeat)
+            print(f"{size_mb:>6g}MB {name:>10} {parse_ms:>10.1f} {peak_mb:>9.1f} {peak_mb / size_mb:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+import { createApp } from 'vue'
+import GalleryBenchmark from './components/GalleryBenchmark.vue'
+
+createApp(GalleryBenchmark).mount('#app')
@@ -0,0 +1,49 @@
+// v-lazy-src: sets an <img>'s src only once the image scrolls into view.
+// One IntersectionObserver is shared by every image. Clearing src on unmount cancels the download of a
+// thumbnail that was scrolled past before it finished.
+const pending = new WeakMap();
+let observer = null;
+
+function getObserver() {
+  if (!observer) {
+    observer = new IntersectionObserver((entries) => {
+      for (const entry of entries) {
+        if (entry.isIntersecting) load(entry.target);
+      }
+    }, { rootMargin: '100px' });
+  }
+  return observer;
+}
+
+function load(el) {
+  const src = pending.get(el);
+  pending.delete(el);
+  observer.unobserve(el);
+  if (src) el.src = src;
+}
+
+function observe(el, src) {
+  el.removeAttribute('src');
+  if (typeof IntersectionObserver === 'undefined') {
+    el.src = src;
+    return;
+  }
+  pending.set(el, src);
+  getObserver().observe(el);
+}
+
+export default {
+  mounted(el, binding) {
+    observe(el, binding.value);
+  },
+  updated(el, binding) {
+    if (binding.value !== binding.oldValue) observe(el, binding.value);
+  },
+  beforeUnmount(el) {
+    if (pending.has(el)) {
+      pending.delete(el);
+      observer.unobserve(el);
+    }
+    el.removeAttribute('src');
+  }
+};
@@ -1,4 +1,14 @@
 const { defineConfig } = require('@vue/cli-service')
 module.exports = defineConfig({
-  transpileDependencies: true
+  transpileDependencies: true,
+  pages: {
+    index: 'src/main.js',
+    // Synthetic 50k-result gallery benchmark: npm run serve, then open /benchmark.html
+    benchmark: {
+      entry: 'src/benchmark.js',
+      template: 'public/index.html',
+      filename: 'benchmark.html',
+      title: 'BirdTag gallery benchmark'
+    }
+  }
 })
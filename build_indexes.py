@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+species_index / uploader_index / time_index 索引表构建脚本
+
+Scans media_metadata once and writes the secondary index rows the query functions read:
+    species   —— species_index (PK species STRING, file_url STRING), for species queries in query-files
+    uploader  —— uploader_index (PK uploader STRING, uploaded_at INTEGER, file_url STRING), for my-files
+                 and the uploader filter; rows without uploaded_at are indexed at 0 and list last
+    time      —— time_index (PK day STRING, species STRING, uploaded_at INTEGER, file_url STRING), for
+                 since/until queries; rows without uploaded_at are skipped
+process-upload, manage-tags and delete-files keep all three up to date from then on, so this only has to
+run once after a table is created, or to repair it. Re-running is safe: entries are overwritten in place.
+
+Credentials come from ALIBABA_CLOUD_ACCESS_KEY_ID / ALIBABA_CLOUD_ACCESS_KEY_SECRET. Use the public
+endpoint when running outside the VPC. query-files scans media_metadata until it is deployed with
+SPECIES_INDEX_ENABLED=1, and the uploader filter of query-by-count and export-catalog does until they are
+deployed with UPLOADER_INDEX_ENABLED=1; set each once the matching build has finished.
+
+运行方式：
+    python build_indexes.py --endpoint https://n01xiizqc116.cn-hangzhou.ots.aliyuncs.com
+    python build_indexes.py --index uploader --sqlite emulator.db      # local_emulator store
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "query-files"))
+
+from tablestore import OTSClient, Direction, INF_MIN, INF_MAX  # noqa: E402
+import species_names  # noqa: E402
+import species_index  # noqa: E402
+import uploader_index  # noqa: E402
+import time_index  # noqa: E402
+
+# Same vocabulary as the deployed functions (the defaults are relative to the function directory).
+species_names.MODEL_NAMES_PATH = os.path.join(ROOT, "query-files", "model.names.json")
+species_names.SPECIES_SYNONYMS_PATH = os.path.join(ROOT, "query-files", "species_synonyms.json")
+
+MEDIA_TABLE = "media_metadata"
+PAGE_LIMIT = 1000
+
+
+def build(ots_client, indexes, dry_run=False) -> dict:
+    stats = {"rows": 0, "species": 0, "uploader": 0, "time": 0}
+    start = [("file_url", INF_MIN)]
+    end = [("file_url", INF_MAX)]
+    started = time.perf_counter()
+    while start is not None:
+        _, start, rows, _ = ots_client.get_range(MEDIA_TABLE, Direction.FORWARD, start, end, limit=PAGE_LIMIT,
+                                                 columns_to_get=["tags", "thumbnail_url", "uploader", "uploaded_at"])
+        for row in rows:
+            file_url = row.primary_key[0][1]
+            columns = {col[0]: col[1] for col in row.attribute_columns}
+            tags = columns.get("tags") or {}
+            stats["rows"] += 1
+            if "species" in indexes:
+                if dry_run:
+                    stats["species"] += len(species_index.species_counts(tags))
+                else:
+                    stats["species"] += species_index.sync(ots_client, file_url, None, tags,
+                                                           columns.get("thumbnail_url"))[0]
+            if "uploader" in indexes and columns.get("uploader"):
+                if not dry_run:
+                    uploader_index.put(ots_client, file_url, columns["uploader"], columns.get("uploaded_at"),
+                                       tags, columns.get("thumbnail_url"))
+                stats["uploader"] += 1
+            if "time" in indexes and columns.get("uploaded_at"):
+                species = species_index.species_counts(tags)
+                if not dry_run:
+                    time_index.sync(ots_client, file_url, columns["uploaded_at"], None, species, tags=tags,
+                                    thumbnail_url=columns.get("thumbnail_url"))
+                stats["time"] += len(species) + 1
+        print(f"  {stats['rows']} rows, {stats['species']} species postings, {stats['uploader']} uploader entries, "
+              f"{stats['time']} time rows ({time.perf_counter() - started:.1f}s)")
+    return stats
+
+
+def main():
+    p = argparse.ArgumentParser(description="Build the species / uploader / time index tables from media_metadata")
+    p.add_argument("--index", nargs="+", default=["species", "uploader", "time"],
+                   choices=["species", "uploader", "time"])
+    p.add_argument("--endpoint", default="https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com")
+    p.add_argument("--instance", default="n01xiizqc116")
+    p.add_argument("--sqlite", help="Build inside a local_emulator SQLite store instead of Tablestore")
+    p.add_argument("--dry-run", action="store_true", help="Count the index rows without writing them")
+    args = p.parse_args()
+
+    if args.sqlite:
+        import local_emulator
+        ots_client = local_emulator.FakeOTSClient(local_emulator.SqliteStore(args.sqlite))
+    else:
+        ots_client = OTSClient(args.endpoint, os.environ["ALIBABA_CLOUD_ACCESS_KEY_ID"],
+                               os.environ["ALIBABA_CLOUD_ACCESS_KEY_SECRET"], args.instance)
+    stats = build(ots_client, args.index, dry_run=args.dry_run)
+    print(f"[完成] {stats['rows']} media rows -> {stats['species']} species postings, "
+          f"{stats['uploader']} uploader entries, {stats['time']} time rows"
+          f"{' (dry run, nothing written)' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    main()
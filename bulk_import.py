@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+照片归档批量导入脚本（可断点续传）
+
+Walks a local directory and uploads every image to uploads/ in the OSS bucket, where process-upload
+picks it up exactly as it does for uploads from the UI:
+    - every object carries x-oss-meta-token, so process-upload accepts it and records the token's user
+      as the uploader
+    - uploads run on a bounded thread pool (--workers); files above --multipart-mb go through
+      oss2.resumable_upload, which uploads parts in parallel and records finished parts so an
+      interrupted large file continues where it stopped
+    - every finished file is appended to a JSON-lines manifest (path, size, mtime, sha256, key). On the
+      next run files whose size and mtime match the manifest are skipped without reading them, and
+      files whose sha256 was already uploaded (under any path) are skipped as duplicates; duplicates
+      are recorded too (duplicate_of: the key of the copy that was uploaded), so they are not hashed again
+    - progress and the final summary report files/sec and MB/sec
+
+Object keys follow the directory layout: <dir>/a/IMG_1.JPG -> uploads/<--prefix>/a/IMG_1.JPG, so
+re-importing a changed file replaces its object and process-upload replaces its tags. Characters outside
+[A-Za-z0-9._-] become '_', and such a name also gets a short hash of the original path
+(<dir>/a b/IMG 1.JPG -> .../a_b/IMG_1-<8 hex>.JPG), so "a b" and "a_b" do not share a key. A file whose
+key is already taken by another path is reported as a collision and not uploaded.
+
+The token comes from --token, or from POST /login with --email / --password. OSS credentials come from
+ALIBABA_CLOUD_ACCESS_KEY_ID / ALIBABA_CLOUD_ACCESS_KEY_SECRET. Keep in mind that the token expires
+(see login-user); log in again and re-run to continue a long import.
+
+运行方式：
+    python bulk_import.py /data/archive --email alice@example.com --password ...
+    python bulk_import.py /data/archive --token <token> --workers 16 --prefix customer-a
+    python bulk_import.py /data/archive --token <token> --dry-run
+"""
+
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+API_GATEWAY_DOMAIN = "https://9b618e52ff3d4250a85f65db6a017f03-cn-hangzhou.alicloudapi.com"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+HASH_CHUNK = 1024 * 1024
+
+
+def safe_key(prefix, relative_path):
+    """
+    uploads/<prefix>/<path> with every path component reduced to [A-Za-z0-9._-] (as get-upload-url does).
+
+    When that changes the path, the file name also gets the first 8 hex digits of the original path's
+    SHA-1, so paths that only differ in replaced characters still get different keys.
+    """
+    def clean(part):
+        return re.sub(r'[^A-Za-z0-9._-]', '_', part).strip('._') or 'file'
+
+    original = relative_path.replace(os.sep, '/').split('/')
+    parts = [clean(part) for part in original]
+    if parts != original:
+        # Cleaned separately so the extension survives names like "é.jpg".
+        stem, ext = os.path.splitext(original[-1])
+        digest = hashlib.sha1('/'.join(original).encode('utf-8')).hexdigest()[:8]
+        parts[-1] = f"{clean(stem)}-{digest}{re.sub(r'[^A-Za-z0-9.]', '_', ext)}"
+    return '/'.join(['uploads'] + ([prefix.strip('/')] if prefix else []) + parts)
+
+
+def sha256_of(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def walk_images(root, extensions=IMAGE_EXTENSIONS):
+    """Yields (absolute path, relative path) of every image under `root`, in a stable order."""
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in extensions:
+                path = os.path.join(directory, name)
+                yield path, os.path.relpath(path, root)
+
+
+class Manifest:
+    """
+    Append-only JSON-lines record of finished uploads and skipped duplicates; safe to share between
+    upload threads.
+
+    A crash can lose at most the line being written, and that file is simply uploaded again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.by_path = {}
+        self.hashes = set()
+        self.uploaded = {}  # sha256 -> key of a finished upload with that content
+        self.keys = {}  # object key -> relative path that uploads to it
+        self._lock = threading.Lock()
+        self._file = None
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line
+                    self._index(entry)
+
+    def _index(self, entry):
+        previous = self.by_path.get(entry['path'])
+        if previous is not None and previous['sha256'] != entry['sha256']:
+            self._drop(previous)
+        self.by_path[entry['path']] = entry
+        if 'duplicate_of' not in entry:
+            self.hashes.add(entry['sha256'])
+            self.uploaded[entry['sha256']] = entry['key']
+            self.keys[entry['key']] = entry['path']
+
+    def _drop(self, entry):
+        # The object at entry['key'] no longer holds this content, so it must not be used as a duplicate.
+        if 'duplicate_of' not in entry and self.uploaded.get(entry['sha256']) == entry['key']:
+            del self.uploaded[entry['sha256']]
+            self.hashes.discard(entry['sha256'])
+
+    def forget(self, entry):
+        """Called before `entry`'s key is overwritten with different content."""
+        with self._lock:
+            self._drop(entry)
+
+    def covers(self, entry):
+        """False for a duplicate whose uploaded copy has since been overwritten with other content."""
+        with self._lock:
+            return 'duplicate_of' not in entry or self.uploaded.get(entry['sha256']) == entry['duplicate_of']
+
+    def unchanged(self, relative_path, stat):
+        entry = self.by_path.get(relative_path)
+        return (entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+                and self.covers(entry))
+
+    def claim_hash(self, sha256):
+        """True if no other finished or in-flight file has this content; the caller then uploads it."""
+        with self._lock:
+            if sha256 in self.hashes:
+                return False
+            self.hashes.add(sha256)
+            return True
+
+    def release_hash(self, sha256):
+        with self._lock:
+            self.hashes.discard(sha256)
+
+    def uploaded_key(self, sha256):
+        """Key of a finished upload with this content, or None (no upload, or one still in flight)."""
+        with self._lock:
+            return self.uploaded.get(sha256)
+
+    def claim_key(self, key, relative_path):
+        """
+        Path that owns `key`: `relative_path` if the key was free or already its own. Any other path means
+        uploading would overwrite the object (and the tags) of a different file.
+        """
+        with self._lock:
+            return self.keys.setdefault(key, relative_path)
+
+    def record(self, entry):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._index(entry)
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class Progress:
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.counts = {'uploaded': 0, 'unchanged': 0, 'duplicate': 0, 'collision': 0, 'failed': 0}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._last = self.started
+
+    def add(self, outcome, size=0):
+        with self._lock:
+            self.counts[outcome] += 1
+            self.bytes += size
+            now = time.perf_counter()
+            if now - self._last >= self.interval:
+                self._last = now
+                print(f"  {self.summary()}")
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        counts = ', '.join(f"{n} {name}" for name, n in self.counts.items())
+        return (f"{counts} | {self.counts['uploaded'] / elapsed:.1f} files/s, "
+                f"{self.bytes / elapsed / 1e6:.2f} MB/s ({elapsed:.1f}s)")
+
+
+def upload_file(bucket, path, key, token, multipart_bytes, part_size, part_threads, store_root):
+    import oss2
+    headers = {'x-oss-meta-token': token,
+               'Content-Type': mimetypes.guess_type(path)[0] or 'application/octet-stream'}
+    if os.path.getsize(path) >= multipart_bytes:
+        oss2.resumable_upload(bucket, key, path, headers=headers, multipart_threshold=multipart_bytes,
+                              part_size=part_size, num_threads=part_threads,
+                              store=oss2.ResumableStore(root=store_root))
+    else:
+        bucket.put_object_from_file(key, path, headers=headers)
+
+
+def run_import(bucket, root, token, manifest_path, prefix='', workers=8, multipart_mb=20, part_mb=8,
+               part_threads=2, dedupe=True, dry_run=False, progress_interval=5.0):
+    """
+    Uploads every image under `root` that the manifest does not already cover.
+
+    Returns:
+        Progress: counts of uploaded / unchanged / duplicate / collision / failed files and bytes uploaded.
+    """
+    manifest = Manifest(manifest_path)
+    progress = Progress(progress_interval)
+    store_root = os.path.abspath(manifest_path) + '.parts'
+    multipart_bytes = multipart_mb * 1024 * 1024
+
+    def process(path, relative_path, stat):
+        sha256 = sha256_of(path)
+        entry = {'path': relative_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256,
+                 'key': safe_key(prefix, relative_path)}
+        previous = manifest.by_path.get(relative_path)
+        if previous and previous['sha256'] == sha256 and previous['key'] == entry['key'] and manifest.covers(previous):
+            # Touched but not modified: remember the new mtime so the next run skips it without hashing.
+            if not dry_run:
+                manifest.record(dict(previous, mtime_ns=stat.st_mtime_ns, size=stat.st_size))
+            progress.add('unchanged')
+            return
+        if dedupe and not manifest.claim_hash(sha256):
+            uploaded_key = manifest.uploaded_key(sha256)
+            # A copy still in flight is not recorded: if that upload fails, this file must be retried.
+            if uploaded_key is not None and not dry_run:
+                manifest.record(dict(entry, duplicate_of=uploaded_key))
+            progress.add('duplicate')
+            return
+        key = entry['key']
+        owner = manifest.claim_key(key, relative_path)
+        if owner != relative_path:
+            if dedupe:
+                manifest.release_hash(sha256)
+            print(f"  [collision] {relative_path}: {key} is already used by {owner}, not uploaded")
+            progress.add('collision')
+            return
+        if dry_run:
+            print(f"  [dry-run] {relative_path} -> {key}")
+            progress.add('uploaded', stat.st_size)
+            return
+        if previous and previous['sha256'] != sha256:
+            # The old content is about to be replaced; files with that content must be uploaded themselves.
+            manifest.forget(previous)
+        try:
+            upload_file(bucket, path, key, token, multipart_bytes, part_mb * 1024 * 1024, part_threads, store_root)
+        except Exception as e:
+            if dedupe:
+                manifest.release_hash(sha256)
+            print(f"  [failed] {relative_path}: {e}")
+            progress.add('failed')
+            return
+        manifest.record(dict(entry, uploaded_at=int(time.time())))
+        progress.add('uploaded', stat.st_size)
+
+    # At most 2 x workers files are queued, so memory stays flat however large the archive is.
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import') as pool:
+        in_flight = set()
+        for path, relative_path in walk_images(root):
+            stat = os.stat(path)
+            if manifest.unchanged(relative_path, stat):
+                progress.add('unchanged')
+                continue
+            if len(in_flight) >= 2 * workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            in_flight.add(pool.submit(process, path, relative_path, stat))
+        for future in in_flight:
+            future.result()
+    manifest.close()
+    return progress
+
+
+def login(api, email, password):
+    import requests
+    resp = requests.post(f"{api}/login", json={"email": email, "password": password}, timeout=40)
+    resp.raise_for_status()
+    return resp.json()["token"]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Upload a local photo archive to BirdTag, resumably and in parallel")
+    p.add_argument("root", help="Directory to import")
+    p.add_argument("--token", help="Session token (x-oss-meta-token); or use --email / --password")
+    p.add_argument("--email")
+    p.add_argument("--password")
+    p.add_argument("--api", default=API_GATEWAY_DOMAIN, help="API gateway domain used for --email / --password")
+    p.add_argument("--prefix", default="import", help="Key prefix under uploads/")
+    p.add_argument("--manifest", help="Manifest file (default: <root>/.birdtag-import.jsonl)")
+    p.add_argument("--workers", type=int, default=8, help="Files uploaded concurrently")
+    p.add_argument("--multipart-mb", type=int, default=20, help="Files at least this large use resumable multipart upload")
+    p.add_argument("--part-mb", type=int, default=8)
+    p.add_argument("--part-threads", type=int, default=2, help="Parallel parts per multipart file")
+    p.add_argument("--no-dedupe", action="store_true", help="Upload files even if the same content was uploaded before")
+    p.add_argument("--dry-run", action="store_true", help="List what would be uploaded; nothing is uploaded or recorded")
+    p.add_argument("--bucket", default="birdtag-media-5225")
+    p.add_argument("--oss-endpoint", default="https://oss-cn-hangzhou.aliyuncs.com")
+    args = p.parse_args()
+
+    if not os.path.isdir(args.root):
+        p.error(f"{args.root} is not a directory")
+    token = args.token
+    if not token:
+        if not (args.email and args.password):
+            p.error("give --token, or --email and --password")
+        token = login(args.api, args.email, args.password)
+    manifest_path = args.manifest or os.path.join(args.root, ".birdtag-import.jsonl")
+
+    import oss2
+    bucket = oss2.Bucket(oss2.Auth(os.environ["ALIBABA_CLOUD_ACCESS_KEY_ID"],
+                                   os.environ["ALIBABA_CLOUD_ACCESS_KEY_SECRET"]), args.oss_endpoint, args.bucket)
+    print(f"Importing {args.root} -> oss://{args.bucket}/uploads/{args.prefix}/ "
+          f"(manifest {manifest_path}, {args.workers} workers)")
+    progress = run_import(bucket, args.root, token, manifest_path, prefix=args.prefix, workers=args.workers,
+                          multipart_mb=args.multipart_mb, part_mb=args.part_mb, part_threads=args.part_threads,
+                          dedupe=not args.no_dedupe, dry_run=args.dry_run)
+    print(f"[完成] {progress.summary()}")
+    sys.exit(1 if progress.counts['failed'] or progress.counts['collision'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# species_names.py
+# Canonical species names: the normalizer applied wherever a species is written or queried, and
+# the prefix trie behind /species/suggest.
+#
+# process-upload, manage-tags, delete-files, query-files, query-by-count, species-suggest and
+# export-catalog carry identical copies of this file and of species_synonyms.json. The vocabulary is
+# the model's class names (model.names.json, written by export_model.py, if present next to the
+# function) plus the canonical names and synonyms in species_synonyms.json:
+#   {"crow": ["crows", "house crow", ...], ...}
+# Both are read once per warm instance. normalize() maps "Crows", " crow " and "House_Crow" to the
+# same key, so index rows and tags are stored and looked up under one name.
+import json
+import os
+import re
+import threading
+
+MODEL_NAMES_PATH = os.environ.get('MODEL_NAMES_PATH', './model.names.json')
+SPECIES_SYNONYMS_PATH = os.environ.get('SPECIES_SYNONYMS_PATH', './species_synonyms.json')
+# Suggestions kept per trie node; a lookup never returns more than this.
+MAX_SUGGESTIONS = 10
+
+_SEPARATORS = re.compile(r'[\s_\-]+')
+_vocabulary = None
+_vocabulary_lock = threading.Lock()
+
+
+def _clean(name):
+    if isinstance(name, bytes):
+        name = name.decode('utf-8', errors='ignore')
+    return _SEPARATORS.sub(' ', str(name).strip().lower()).strip()
+
+
+class _Trie:
+    """Prefix trie in which every node holds its best MAX_SUGGESTIONS completions, precomputed."""
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, term, canonical):
+        node = self.root
+        entry = (len(term), term, canonical)
+        for char in term:
+            node = node.setdefault(char, {})
+            best = node.setdefault('', [])
+            # One entry per canonical name: its shortest matching term.
+            for i, existing in enumerate(best):
+                if existing[2] == canonical:
+                    best[i] = min(existing, entry)
+                    break
+            else:
+                best.append(entry)
+            best.sort()
+            del best[MAX_SUGGESTIONS:]
+
+    def lookup(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        return node.get('', [])
+
+
+class _Vocabulary:
+    def __init__(self, names, synonyms):
+        self.canonical = set()
+        self.aliases = {}
+        for name in names:
+            self.canonical.add(_clean(name))
+        for canonical, alternatives in synonyms.items():
+            canonical = _clean(canonical)
+            self.canonical.add(canonical)
+            for alternative in alternatives:
+                self.aliases[_clean(alternative)] = canonical
+        self.canonical.discard('')
+        self.trie = _Trie()
+        for term in self.canonical:
+            self._insert_words(term, term)
+        for term, canonical in self.aliases.items():
+            self._insert_words(term, canonical)
+
+    def _insert_words(self, term, canonical):
+        # Also reachable from each later word: "crow" suggests "house crow".
+        words = term.split(' ')
+        for i in range(len(words)):
+            self.trie.insert(' '.join(words[i:]), canonical)
+
+    def normalize(self, name):
+        key = _clean(name)
+        if key in self.canonical:
+            return key
+        if key in self.aliases:
+            return self.aliases[key]
+        for suffix in ('es', 's'):  # plurals of known names and synonyms
+            singular = key[:-len(suffix)]
+            if key.endswith(suffix) and singular in self.canonical:
+                return singular
+            if key.endswith(suffix) and singular in self.aliases:
+                return self.aliases[singular]
+        return key
+
+
+def _load_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def vocabulary():
+    global _vocabulary
+    if _vocabulary is None:
+        with _vocabulary_lock:
+            if _vocabulary is None:
+                names = _load_json(MODEL_NAMES_PATH, {})
+                _vocabulary = _Vocabulary(names.values() if isinstance(names, dict) else names,
+                                          _load_json(SPECIES_SYNONYMS_PATH, {}))
+    return _vocabulary
+
+
+def normalize(name):
+    """Canonical key of a species name; unknown names are lower-cased with separators collapsed."""
+    return vocabulary().normalize(name)
+
+
+def normalize_tags(tags):
+    """{species: count} with every name normalized; counts of names that collapse together are summed."""
+    out = {}
+    for species, count in (tags or {}).items():
+        key = normalize(species)
+        if key:
+            out[key] = out.get(key, 0) + count
+    return out
+
+
+def suggest(prefix, limit=MAX_SUGGESTIONS):
+    """
+    Canonical names that have a name or synonym (or a later word of one) starting with `prefix`.
+
+    Returns:
+        list: {'name': canonical, 'matched': term} dicts, shortest matches first, one per canonical name.
+    """
+    return [{'name': canonical, 'matched': term}
+            for _, term, canonical in vocabulary().trie.lookup(_clean(prefix))[:limit]]
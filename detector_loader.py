@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Loads bird_detector from a function directory for the scripts that run the model outside Function
+Compute (retag_backfill.py, bench_inference.py, test_backend_parity.py).
+
+Each function directory carries its own copy of bird_detector.py and resolves its model files
+relative to the working directory; load_detector() imports the copy in `model_dir` and points it at
+that directory's files instead. Paths set in the environment (ONNX_MODEL_PATH=./model.int8.onnx, as the
+function is deployed to serve the INT8 variant) are kept and resolved against `model_dir` too, so the
+scripts run the same artifact as the function.
+"""
+
+import os
+import sys
+
+
+def load_detector(model_dir: str):
+    """Imports bird_detector from a function directory and points it at that directory's model files."""
+    model_dir = os.path.abspath(model_dir)
+    sys.path.insert(0, model_dir)
+    import bird_detector
+
+    def path(env, default):
+        # An absolute path in the environment is used as is (os.path.join drops model_dir).
+        return os.path.normpath(os.path.join(model_dir, os.environ.get(env) or default))
+
+    bird_detector.MODEL_PATH = os.path.join(model_dir, "model.pt")
+    bird_detector.ONNX_MODEL_PATH = path("ONNX_MODEL_PATH", "model.onnx")
+    bird_detector.OPENVINO_MODEL_PATH = path("OPENVINO_MODEL_PATH", os.path.join("model_openvino_model", "model.xml"))
+    bird_detector.MODEL_NAMES_PATH = path("MODEL_NAMES_PATH", "model.names.json")
+    return bird_detector
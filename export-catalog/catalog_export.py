@@ -0,0 +1,273 @@
+# catalog_export.py
+# Streams the media_metadata catalog out as NDJSON, CSV or Parquet, one page at a time.
+#
+# Used by the export-catalog function and by export_catalog.py (which imports it from this directory).
+# Rows are read PAGE_LIMIT at a time with get_range (or from uploader_index when the export is for one
+# uploader and UPLOADER_INDEX_ENABLED=1), filtered with the species_query language of query-files, and each page is handed to the
+# format writer and on to the sink before the next page is read. Nothing holds more than one page of
+# rows, plus one multipart part when the sink is an OSS object.
+#
+# Output columns: file_url, thumbnail_url, uploader, uploaded_at, then one count column per species and
+# other_tags (JSON of any tags without a column). The species columns are the species named in the query
+# when one is given, otherwise every canonical name in the species_names vocabulary. NDJSON keeps the tags
+# as one object instead.
+import csv
+import io
+import json
+import os
+import oss2
+from tablestore import *
+import species_index
+import species_names
+import species_query
+import uploader_index
+
+TABLE_NAME = 'media_metadata'
+PAGE_LIMIT = 1000
+# Same switch as query-by-count: until build_indexes.py has filled uploader_index, an uploader export scans
+# media_metadata, so rows that are not indexed yet are still exported.
+UPLOADER_INDEX_ENABLED = os.environ.get('UPLOADER_INDEX_ENABLED', '0') == '1'
+# OSS parts must be at least 100 KB (except the last); a part is uploaded whenever this much is buffered.
+PART_SIZE = 8 * 1024 * 1024
+BASE_COLUMNS = ['file_url', 'thumbnail_url', 'uploader', 'uploaded_at']
+# format -> (file extension, Content-Type)
+FORMATS = {
+    'ndjson': ('ndjson', 'application/x-ndjson'),
+    'csv': ('csv', 'text/csv; charset=utf-8'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def species_columns(query):
+    """The species count columns of an export: the species named in the query, or the whole vocabulary."""
+    if query is not None:
+        return sorted(species_query.terms(query))
+    return sorted(species_names.vocabulary().canonical)
+
+
+def _record(file_url, columns):
+    return {
+        'file_url': file_url,
+        'thumbnail_url': columns.get('thumbnail_url'),
+        'uploader': columns.get('uploader'),
+        'uploaded_at': columns.get('uploaded_at') or None,
+        'tags': species_index.species_counts(columns.get('tags') or {}),
+    }
+
+
+def iter_pages(ots_client, query=None, uploader=None, page_limit=PAGE_LIMIT):
+    """
+    Yields lists of matching records, one list per page read.
+
+    With `uploader` and UPLOADER_INDEX_ENABLED the pages come from uploader_index (newest first); otherwise
+    from media_metadata in file_url order. A page may be empty when none of its rows match.
+    """
+    def keep(record):
+        if uploader and record['uploader'] != uploader:
+            return False
+        return query is None or species_query.matches(query, record['tags'].keys())
+
+    if uploader and UPLOADER_INDEX_ENABLED:
+        after = None
+        while True:
+            entries, after = uploader_index.list_page(ots_client, uploader, page_limit, after)
+            page = [dict(_record(entry['file_url'], entry), uploader=uploader) for entry in entries]
+            yield [record for record in page if keep(record)]
+            if after is None:
+                return
+
+    start = [('file_url', INF_MIN)]
+    end = [('file_url', INF_MAX)]
+    while start is not None:
+        _, start, rows, _ = ots_client.get_range(TABLE_NAME, Direction.FORWARD, start, end, limit=page_limit,
+                                                 columns_to_get=['tags', 'thumbnail_url', 'uploader', 'uploaded_at'])
+        page = [_record(row.primary_key[0][1], {col[0]: col[1] for col in row.attribute_columns}) for row in rows]
+        yield [record for record in page if keep(record)]
+
+
+# --- format writers: write_page(records) for every page, then close() ---
+
+class NdjsonWriter:
+    def __init__(self, sink, species):
+        self.sink = sink
+
+    def write_page(self, records):
+        if records:
+            self.sink.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8'))
+
+    def close(self):
+        pass
+
+
+class _TabularWriter:
+    """Shared row flattening for the CSV and Parquet writers."""
+
+    def __init__(self, sink, species):
+        self.sink = sink
+        self.species = species
+        self.header = BASE_COLUMNS + species + ['other_tags']
+
+    def _rows(self, records):
+        for record in records:
+            tags = record['tags']
+            other = {name: count for name, count in tags.items() if name not in self.species}
+            yield ([record[name] for name in BASE_COLUMNS] + [tags.get(name, 0) for name in self.species]
+                   + [json.dumps(other, ensure_ascii=False) if other else None])
+
+
+class CsvWriter(_TabularWriter):
+    def __init__(self, sink, species):
+        super().__init__(sink, species)
+        self._write([self.header])
+
+    def _write(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        self.sink.write(buffer.getvalue().encode('utf-8'))
+
+    def write_page(self, records):
+        if records:
+            self._write(self._rows(records))
+
+    def close(self):
+        pass
+
+
+class ParquetWriter(_TabularWriter):
+    """One row group per page. Needs pyarrow, which is imported only for Parquet exports."""
+
+    def __init__(self, sink, species):
+        super().__init__(sink, species)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet export requires the pyarrow package.")
+        self._pa = pa
+        self.schema = pa.schema(
+            [('file_url', pa.string()), ('thumbnail_url', pa.string()), ('uploader', pa.string()),
+             ('uploaded_at', pa.timestamp('ms', tz='UTC'))]
+            + [(name, pa.int32()) for name in species] + [('other_tags', pa.string())])
+        self._writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), self.schema, compression='snappy')
+
+    def write_page(self, records):
+        if records:
+            columns = list(zip(*self._rows(records)))
+            self._writer.write_table(self._pa.Table.from_arrays(
+                [self._pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+                schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {'ndjson': NdjsonWriter, 'csv': CsvWriter, 'parquet': ParquetWriter}
+
+
+# --- sinks ---
+
+class OssMultipartSink:
+    """
+    File-like sink that uploads to one OSS object: a multipart part every PART_SIZE bytes, completed on
+    close(). An export smaller than one part is written with a single put_object instead.
+    """
+
+    def __init__(self, bucket, key, content_type, part_size=PART_SIZE):
+        self.bucket = bucket
+        self.key = key
+        self.headers = {'Content-Type': content_type}
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            self.upload_id = self.bucket.init_multipart_upload(self.key, headers=self.headers).upload_id
+        number = len(self.parts) + 1
+        result = self.bucket.upload_part(self.key, self.upload_id, number, data)
+        self.parts.append(oss2.models.PartInfo(number, result.etag))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.upload_id is None:
+            self.bucket.put_object(self.key, bytes(self.buffer), headers=self.headers)
+        else:
+            if self.buffer:
+                self._upload_part(bytes(self.buffer))
+            self.bucket.complete_multipart_upload(self.key, self.upload_id, self.parts)
+        self.buffer = bytearray()
+
+    def abort(self):
+        if not self.closed and self.upload_id is not None:
+            self.bucket.abort_multipart_upload(self.key, self.upload_id)
+        self.closed = True
+
+
+def export(ots_client, sink, fmt, query=None, uploader=None, page_limit=PAGE_LIMIT, on_page=None):
+    """
+    Writes the matching catalog rows to `sink` (any object with write(bytes)) in format `fmt`.
+
+    The sink is not closed. on_page(stats) is called after every page, e.g. for progress output.
+
+    Returns:
+        dict: {'rows', 'pages', 'bytes'} where bytes is what was written to the sink.
+
+    Raises:
+        ValueError: For an unknown format, or Parquet without pyarrow.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"'format' must be one of {sorted(WRITERS)}.")
+    counting = _CountingSink(sink)
+    writer = WRITERS[fmt](counting, species_columns(query))
+    stats = {'rows': 0, 'pages': 0, 'bytes': 0}
+    for page in iter_pages(ots_client, query, uploader, page_limit):
+        writer.write_page(page)
+        stats['rows'] += len(page)
+        stats['pages'] += 1
+        stats['bytes'] = counting.size
+        if on_page:
+            on_page(stats)
+    writer.close()
+    stats['bytes'] = counting.size
+    return stats
+
+
+class _CountingSink:
+    def __init__(self, sink):
+        self.sink = sink
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        self.sink.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        # Writers (pyarrow in particular) may close the file they were given; the caller owns the sink.
+        self.closed = True
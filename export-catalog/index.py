@@ -0,0 +1,125 @@
+# index.py for export-catalog function
+# 导出标签目录：GET /export?format=csv|ndjson|parquet&q=crow AND pigeon&uploader=me
+# 按页读取 media_metadata（或指定上传者且 UPLOADER_INDEX_ENABLED=1 时读取 uploader_index），每页写出后再读下一页，通过分片上传直接写入
+# OSS 的 exports/ 前缀，返回对象 key 和预签名下载地址。超出函数超时时间的大规模导出请使用 export_catalog.py。
+import json
+import time
+import traceback
+import uuid
+import oss2
+from tablestore import *
+import tracing
+import catalog_export
+import species_index
+import species_query
+
+# --- 请确保这些配置与你之前的函数一致 ---
+OTS_ENDPOINT = "https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com"
+OTS_INSTANCE_NAME = "n01xiizqc116"
+SESSION_TABLE_NAME = 'sessions'
+OSS_BUCKET_NAME = 'birdtag-media-5225'
+OSS_INTERNAL_ENDPOINT = 'https://oss-cn-hangzhou-internal.aliyuncs.com'  # 函数写入导出文件走内网
+OSS_PUBLIC_ENDPOINT = 'https://oss-cn-hangzhou.aliyuncs.com'  # 预签名下载 URL 由浏览器访问，必须使用公网地址
+
+EXPORT_PREFIX = 'exports/'  # 建议为 exports/ 配置 7 天过期的生命周期规则
+URL_EXPIRES_SECONDS = 900
+
+
+# ---------------------------------------------
+
+@tracing.traced('export-catalog')
+def handler(event, context):
+    print(f"Received event: {event}")
+    trace = tracing.current()
+    trace.phase('parse')
+
+    # 步骤一：【必须先做】解析事件，确保 event_dict 存在
+    try:
+        event_str = event.decode('utf-8')
+        event_dict = json.loads(event_str)
+    except Exception as e:
+        print(f"FATAL: Could not parse event data. Error: {e}")
+        return {"statusCode": 400, "body": json.dumps({"error": "Failed to parse event data."})}
+
+    # 步骤二：【第二步】进行Token验证
+    trace.phase('auth')
+    try:
+        headers = event_dict.get('headers', {})
+        token = headers.get('authorization') or headers.get('Authorization')
+        if not token:
+            raise ValueError("Authorization token is missing.")
+
+        creds = context.credentials
+        ots_client = trace.wrap_ots(OTSClient(end_point=OTS_ENDPOINT, access_key_id=creds.access_key_id,
+                                              access_key_secret=creds.access_key_secret,
+                                              instance_name=OTS_INSTANCE_NAME, sts_token=creds.security_token))
+
+        session_pk = [('token', token)]
+        _, row, _ = ots_client.get_row(SESSION_TABLE_NAME, session_pk, columns_to_get=['user_email', 'expires_at'])
+
+        if not row or not row.attribute_columns:
+            raise ValueError("Invalid token.")
+
+        session_info = {col[0]: col[1] for col in row.attribute_columns}
+        expires_at = session_info.get('expires_at')
+
+        if not expires_at or time.time() > expires_at:
+            ots_client.delete_row(SESSION_TABLE_NAME, Row(session_pk))
+            raise ValueError("Token has expired.")
+
+        current_user_email = session_info.get('user_email')
+        print(f"Token validation successful for user: {current_user_email}")
+
+    except Exception as e:
+        # Token 验证失败，返回 401
+        print(f"Authorization failed: {e}")
+        return {"statusCode": 401, "body": json.dumps({"error": f"Unauthorized: {e}"})}
+
+    # 步骤三：【Token验证通过后】才执行业务逻辑
+    trace.phase('query')
+    try:
+        query_params = event_dict.get('queryParameters', {}) or {}
+        fmt = (query_params.get('format') or 'csv').lower()
+        if fmt not in catalog_export.FORMATS:
+            raise ValueError(f"'format' must be one of {sorted(catalog_export.FORMATS)}.")
+        query_text = query_params.get('q') or query_params.get('species')
+        query = species_query.parse(query_text, normalize=species_index.normalize) if query_text else None
+        # uploader=<email> 只导出该用户上传的文件；uploader=me 表示当前登录用户
+        uploader = query_params.get('uploader')
+        if uploader == 'me':
+            uploader = current_user_email
+    except ValueError as e:  # species_query.QueryError is a ValueError
+        return {"statusCode": 400, "body": json.dumps({"error": f"Invalid request: {e}"})}
+
+    extension, content_type = catalog_export.FORMATS[fmt]
+    object_key = f"{EXPORT_PREFIX}{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}.{extension}"
+    auth = oss2.StsAuth(creds.access_key_id, creds.access_key_secret, creds.security_token)
+    bucket = trace.wrap_bucket(oss2.Bucket(auth, OSS_INTERNAL_ENDPOINT, OSS_BUCKET_NAME))
+    sink = catalog_export.OssMultipartSink(bucket, object_key, content_type)
+    try:
+        print(f"Exporting {fmt} to {object_key}: query={query}, uploader={uploader}")
+        stats = catalog_export.export(ots_client, sink, fmt, query=query, uploader=uploader)
+        trace.phase('store')
+        sink.close()
+    except ValueError as e:  # Parquet without pyarrow
+        sink.abort()
+        return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+    except Exception as e:
+        sink.abort()
+        print(f"An error occurred during business logic execution: {e}")
+        traceback.print_exc()
+        return {"statusCode": 500, "body": json.dumps({"error": "An internal error occurred."})}
+
+    print(f"Exported {stats['rows']} rows in {stats['pages']} pages, {stats['bytes']} bytes "
+          f"({len(sink.parts) or 1} part(s)).")
+    trace.incr('rows_matched', stats['rows'])
+    trace.phase('serialize')
+    public_bucket = oss2.Bucket(auth, OSS_PUBLIC_ENDPOINT, OSS_BUCKET_NAME)
+    response_body = dict(stats, format=fmt, key=object_key,
+                         download_url=public_bucket.sign_url('GET', object_key, URL_EXPIRES_SECONDS, slash_safe=True),
+                         expires_in=URL_EXPIRES_SECONDS)
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json", "Content-Disposition": "inline"},
+        "body": json.dumps(response_body)
+    }
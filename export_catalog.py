@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+标签目录导出脚本（NDJSON / CSV / Parquet）
+
+Streams media_metadata (file_url, thumbnail_url, uploader, uploaded_at, one count column per species)
+to a local file, stdout or an OSS object, page by page, with the same code as the export-catalog
+function (export-catalog/catalog_export.py) but without its timeout. OSS output is written with
+multipart upload, one part per 8 MB. Parquet needs pyarrow.
+
+Credentials come from ALIBABA_CLOUD_ACCESS_KEY_ID / ALIBABA_CLOUD_ACCESS_KEY_SECRET. Use the public
+endpoints when running outside the VPC.
+
+运行方式：
+    python export_catalog.py --format csv --output catalog.csv
+    python export_catalog.py --format ndjson --q "crow AND pigeon" --output - | head
+    python export_catalog.py --format parquet --oss-key exports/catalog.parquet
+    python export_catalog.py --format csv --uploader alice@example.com --sqlite emulator.db --output -
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "export-catalog"))
+
+from tablestore import OTSClient  # noqa: E402
+import catalog_export  # noqa: E402
+import species_index  # noqa: E402
+import species_names  # noqa: E402
+import species_query  # noqa: E402
+
+# Same vocabulary as the deployed functions (the defaults are relative to the function directory).
+species_names.MODEL_NAMES_PATH = os.path.join(ROOT, "export-catalog", "model.names.json")
+species_names.SPECIES_SYNONYMS_PATH = os.path.join(ROOT, "export-catalog", "species_synonyms.json")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Export the media_metadata tag catalog as NDJSON, CSV or Parquet")
+    p.add_argument("--format", default="csv", choices=sorted(catalog_export.FORMATS))
+    p.add_argument("--q", help="Species query, e.g. \"owl OR kingfisher\" (same syntax as query-files)")
+    p.add_argument("--uploader", help="Only files uploaded by this email")
+    p.add_argument("--output", help="Local file, or - for stdout")
+    p.add_argument("--oss-key", help="Write to this OSS object instead (multipart upload)")
+    p.add_argument("--bucket", default="birdtag-media-5225")
+    p.add_argument("--oss-endpoint", default="https://oss-cn-hangzhou-internal.aliyuncs.com")
+    p.add_argument("--page-size", type=int, default=catalog_export.PAGE_LIMIT)
+    p.add_argument("--endpoint", default="https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com")
+    p.add_argument("--instance", default="n01xiizqc116")
+    p.add_argument("--sqlite", help="Export from a local_emulator SQLite store instead of Tablestore")
+    args = p.parse_args()
+    if bool(args.output) == bool(args.oss_key):
+        p.error("give exactly one of --output and --oss-key")
+
+    try:
+        query = species_query.parse(args.q, normalize=species_index.normalize) if args.q else None
+    except species_query.QueryError as e:
+        p.error(f"invalid --q: {e}")
+
+    if args.sqlite:
+        import local_emulator
+        ots_client = local_emulator.FakeOTSClient(local_emulator.SqliteStore(args.sqlite))
+    else:
+        ots_client = OTSClient(args.endpoint, os.environ["ALIBABA_CLOUD_ACCESS_KEY_ID"],
+                               os.environ["ALIBABA_CLOUD_ACCESS_KEY_SECRET"], args.instance)
+
+    if args.oss_key:
+        import oss2
+        bucket = oss2.Bucket(oss2.Auth(os.environ["ALIBABA_CLOUD_ACCESS_KEY_ID"],
+                                       os.environ["ALIBABA_CLOUD_ACCESS_KEY_SECRET"]), args.oss_endpoint, args.bucket)
+        sink = catalog_export.OssMultipartSink(bucket, args.oss_key, catalog_export.FORMATS[args.format][1])
+        target = f"oss://{args.bucket}/{args.oss_key}"
+    elif args.output == "-":
+        sink, target = sys.stdout.buffer, "stdout"
+    else:
+        sink, target = open(args.output, "wb"), args.output
+
+    started = time.perf_counter()
+
+    def progress(stats):
+        print(f"  {stats['pages']} pages, {stats['rows']} rows, {stats['bytes'] / 1e6:.1f} MB "
+              f"({time.perf_counter() - started:.1f}s)", file=sys.stderr)
+
+    try:
+        stats = catalog_export.export(ots_client, sink, args.format, query=query, uploader=args.uploader,
+                                      page_limit=args.page_size, on_page=progress)
+        if sink is not sys.stdout.buffer:
+            sink.close()
+    except BaseException as e:
+        # No partial export is left behind: abort the multipart upload or remove the local file.
+        if isinstance(sink, catalog_export.OssMultipartSink):
+            sink.abort()
+        elif sink is not sys.stdout.buffer:
+            sink.close()
+            os.remove(args.output)
+        if isinstance(e, ValueError):  # Parquet without pyarrow
+            p.error(str(e))
+        raise
+    print(f"[完成] {stats['rows']} rows -> {target} ({stats['bytes'] / 1e6:.1f} MB, "
+          f"{time.perf_counter() - started:.1f}s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
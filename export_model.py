@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Export model.pt for the CPU inference backends of bird_detector.
+
+Produces, next to the weights file:
+    model.onnx                       —— ONNX graph for DETECTOR_BACKEND=onnx
+    model_openvino_model/model.xml   —— OpenVINO IR for DETECTOR_BACKEND=openvino (with --format openvino)
+    model.names.json                 —— class id -> species name, read by both exported backends
+
+Usage:
+    python export_model.py --weights search-by-file/model.pt
+    python export_model.py --weights search-by-file/model.pt --format openvino --copy-to process-upload
+
+Requires ultralytics (plus onnx / openvino for the chosen format) on the machine running the export;
+the deployed functions only need onnxruntime or openvino.
+"""
+
+import argparse
+import json
+import os
+import shutil
+
+
+def export(weights: str, fmt: str, imgsz: int) -> list:
+    from ultralytics import YOLO
+
+    model = YOLO(weights)
+    # Static shapes and a simplified graph give the fastest CPU sessions.
+    exported = model.export(format=fmt, imgsz=imgsz, dynamic=False, simplify=(fmt == "onnx"), opset=12 if fmt == "onnx" else None)
+    print(f"[导出] {fmt} -> {exported}")
+
+    names_path = os.path.join(os.path.dirname(os.path.abspath(weights)), "model.names.json")
+    with open(names_path, "w", encoding="utf-8") as f:
+        json.dump({int(k): v for k, v in model.names.items()}, f, ensure_ascii=False, indent=2)
+    print(f"[导出] class names -> {names_path}")
+    return [exported, names_path]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Export model.pt to ONNX / OpenVINO for bird_detector")
+    p.add_argument("--weights", default="search-by-file/model.pt", help="PyTorch weights to export")
+    p.add_argument("--format", choices=["onnx", "openvino"], default="onnx")
+    p.add_argument("--imgsz", type=int, default=640, help="Static input size of the exported graph")
+    p.add_argument("--copy-to", nargs="*", default=[], help="Function directories that should also receive the artifacts")
+    args = p.parse_args()
+
+    artifacts = export(args.weights, args.format, args.imgsz)
+    for target in args.copy_to:
+        for artifact in artifacts:
+            dest = os.path.join(target, os.path.basename(artifact))
+            if os.path.isdir(artifact):
+                shutil.copytree(artifact, dest, dirs_exist_ok=True)
+            else:
+                shutil.copy2(artifact, dest)
+            print(f"[复制] {artifact} -> {dest}")
+
+
+if __name__ == "__main__":
+    main()
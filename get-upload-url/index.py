@@ -0,0 +1,175 @@
+# index.py for get-upload-url function
+# 签发短时有效的 OSS 直传凭证，客户端直接把文件上传到 OSS，不再经过函数/网关的请求体。
+# 客户端声明的 size 是上限而不是提示：小文件使用 PostObject 表单，policy 的 content-length-range
+# 由 OSS 强制执行；分片上传只签发 size 所需数量的分片 URL。分片大小无法通过签名限制，
+# 因此 process-upload / search-by-file 读取对象前会再按 MAX_UPLOAD_SIZE 检查对象大小。
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import time
+import traceback
+import uuid
+import oss2
+from tablestore import *
+import tracing
+
+# --- 请确保这些配置与你之前的函数一致 ---
+OTS_ENDPOINT = "https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com"
+OTS_INSTANCE_NAME = "n01xiizqc116"
+SESSION_TABLE_NAME = 'sessions'
+OSS_BUCKET_NAME = 'birdtag-media-5225'
+OSS_PUBLIC_ENDPOINT = 'https://oss-cn-hangzhou.aliyuncs.com'  # 预签名 URL 由浏览器访问，必须使用公网地址
+
+URL_EXPIRES_SECONDS = 900  # 不能超过函数 STS 临时凭证的剩余有效期
+MULTIPART_THRESHOLD = 20 * 1024 * 1024  # 超过此大小的文件使用分片上传
+PART_SIZE = 8 * 1024 * 1024
+# 与 process-upload / search-by-file 的 MAX_UPLOAD_SIZE 保持一致（两者都会把整个文件读入内存）
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', str(100 * 1024 * 1024)))
+# purpose -> 目标前缀。uploads/ 会触发 process-upload；search-queries/ 只供 search-by-file 读取
+# （建议为 search-queries/ 配置 1 天过期的生命周期规则）。
+KEY_PREFIXES = {'upload': 'uploads/', 'search': 'search-queries/'}
+
+
+# ---------------------------------------------
+
+def _safe_filename(filename):
+    name = os.path.basename(filename or '')
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', name).strip('._')
+    return name or 'file'
+
+
+def _post_form(object_key, upload_headers, size, creds):
+    """
+    An OSS PostObject form for `object_key`: the signed policy pins the key and headers and limits
+    the file to `size` bytes, which OSS enforces on upload.
+
+    Returns:
+        dict: {"url": ..., "fields": {...}}; POST the fields plus the file (last, as field 'file').
+    """
+    expiration = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(time.time() + URL_EXPIRES_SECONDS))
+    conditions = [{'bucket': OSS_BUCKET_NAME}, {'key': object_key}, ['content-length-range', 1, size]]
+    conditions += [{name: value} for name, value in upload_headers.items()]
+    policy = base64.b64encode(json.dumps({'expiration': expiration, 'conditions': conditions}).encode('utf-8'))
+    signature = base64.b64encode(hmac.new(creds.access_key_secret.encode('utf-8'), policy, hashlib.sha1).digest())
+    fields = {'key': object_key, 'policy': policy.decode('ascii'), 'OSSAccessKeyId': creds.access_key_id,
+              'Signature': signature.decode('ascii'), 'success_action_status': '200', **upload_headers}
+    if creds.security_token:
+        fields['x-oss-security-token'] = creds.security_token
+    return {"url": f"https://{OSS_BUCKET_NAME}.{OSS_PUBLIC_ENDPOINT.split('://', 1)[1]}", "fields": fields}
+
+
+@tracing.traced('get-upload-url')
+def handler(event, context):
+    print(f"Received event: {event}")
+    trace = tracing.current()
+    trace.phase('parse')
+
+    # 步骤一：【必须先做】解析事件，确保 event_dict 存在
+    try:
+        event_str = event.decode('utf-8')
+        event_dict = json.loads(event_str)
+    except Exception as e:
+        print(f"FATAL: Could not parse event data. Error: {e}")
+        return {"statusCode": 400, "body": json.dumps({"error": "Failed to parse event data."})}
+
+    # 步骤二：【第二步】进行Token验证
+    trace.phase('auth')
+    try:
+        headers = event_dict.get('headers', {})
+        token = headers.get('authorization') or headers.get('Authorization')
+        if not token:
+            raise ValueError("Authorization token is missing.")
+
+        creds = context.credentials
+        ots_client = trace.wrap_ots(OTSClient(end_point=OTS_ENDPOINT, access_key_id=creds.access_key_id,
+                                              access_key_secret=creds.access_key_secret,
+                                              instance_name=OTS_INSTANCE_NAME, sts_token=creds.security_token))
+
+        session_pk = [('token', token)]
+        _, row, _ = ots_client.get_row(SESSION_TABLE_NAME, session_pk, columns_to_get=['user_email', 'expires_at'])
+
+        if not row or not row.attribute_columns:
+            raise ValueError("Invalid token.")
+
+        session_info = {col[0]: col[1] for col in row.attribute_columns}
+        expires_at = session_info.get('expires_at')
+
+        if not expires_at or time.time() > expires_at:
+            ots_client.delete_row(SESSION_TABLE_NAME, Row(session_pk))
+            raise ValueError("Token has expired.")
+
+        print(f"Token validation successful for user: {session_info.get('user_email')}")
+
+    except Exception as e:
+        # Token 验证失败，返回 401
+        print(f"Authorization failed: {e}")
+        return {"statusCode": 401, "body": json.dumps({"error": f"Unauthorized: {e}"})}
+
+    # 步骤三：【Token验证通过后】才执行业务逻辑
+    trace.phase('sign')
+    try:
+        request_body = json.loads(event_dict.get('body') or '{}')
+        purpose = request_body.get('purpose', 'upload')
+        content_type = request_body.get('content_type') or 'application/octet-stream'
+        size = int(request_body.get('size') or 0)
+        if purpose not in KEY_PREFIXES:
+            raise ValueError(f"'purpose' must be one of {sorted(KEY_PREFIXES)}.")
+        if size <= 0 or size > MAX_UPLOAD_SIZE:
+            raise ValueError(f"'size' (the file size in bytes) is required and at most {MAX_UPLOAD_SIZE}.")
+    except (json.JSONDecodeError, ValueError, TypeError) as e:
+        return {"statusCode": 400, "body": json.dumps({"error": f"Invalid request body: {e}"})}
+
+    try:
+        object_key = f"{KEY_PREFIXES[purpose]}{uuid.uuid4().hex}-{_safe_filename(request_body.get('filename'))}"
+
+        auth = oss2.StsAuth(creds.access_key_id, creds.access_key_secret, creds.security_token)
+        bucket = trace.wrap_bucket(oss2.Bucket(auth, OSS_PUBLIC_ENDPOINT, OSS_BUCKET_NAME))
+
+        # 客户端上传时必须原样带上这些请求头/表单字段（它们参与签名）；
+        # x-oss-meta-token 会出现在 OSS 事件的 userMeta 中，供 process-upload 校验。
+        upload_headers = {'Content-Type': content_type, 'x-oss-meta-token': token}
+        response_body = {
+            "key": object_key,
+            "file_url": f"https://{OSS_BUCKET_NAME}.{OSS_PUBLIC_ENDPOINT.split('://', 1)[1]}/{object_key}",
+            "headers": upload_headers,
+            "expires_in": URL_EXPIRES_SECONDS,
+        }
+
+        if size > MULTIPART_THRESHOLD:
+            # 分片上传：在服务端初始化，元数据在初始化时写入，之后每个分片单独签名。
+            # 只签发 size 所需的分片数；单个分片的大小由读取方按 MAX_UPLOAD_SIZE 兜底检查。
+            upload_id = bucket.init_multipart_upload(object_key, headers=upload_headers).upload_id
+            part_count = (size + PART_SIZE - 1) // PART_SIZE
+            response_body["multipart"] = {
+                "upload_id": upload_id,
+                "part_size": PART_SIZE,
+                "parts": [
+                    {
+                        "part_number": n,
+                        "url": bucket.sign_url('PUT', object_key, URL_EXPIRES_SECONDS, slash_safe=True,
+                                               params={'uploadId': upload_id, 'partNumber': str(n)}),
+                    }
+                    for n in range(1, part_count + 1)
+                ],
+                # 所有分片完成后，POST <CompleteMultipartUpload> XML（各分片的 PartNumber + ETag）到此 URL
+                "complete_url": bucket.sign_url('POST', object_key, URL_EXPIRES_SECONDS, slash_safe=True,
+                                                params={'uploadId': upload_id}),
+            }
+        else:
+            # PostObject 表单：OSS 拒绝大于声明 size 的文件（预签名 PUT 无法限制 Content-Length）
+            response_body["post"] = _post_form(object_key, upload_headers, size, creds)
+
+        print(f"Issued {purpose} URL for {object_key} (size={size})")
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json", "Content-Disposition": "inline"},
+            "body": json.dumps(response_body)
+        }
+
+    except Exception as e:
+        print(f"An error occurred during business logic execution: {e}")
+        traceback.print_exc()
+        return {"statusCode": 500, "body": json.dumps({"error": "An internal error occurred."})}
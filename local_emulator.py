@@ -0,0 +1,903 @@
+# -*- coding: utf-8 -*-
+"""
+BirdTag 本地端到端模拟器
+
+Runs every function in this repo in-process, without Alibaba Cloud:
+    - FakeOTSClient  —— in-memory or SQLite-backed Tablestore (get_row / put_row / update_row /
+                        delete_row / get_range with pagination / batch_get_row / batch_write_row /
+                        compute_split_points_by_size, optional simulated latency per call)
+    - FakeBucket     —— in-memory OSS bucket (objects, metadata headers, signed URLs, multipart)
+    - FakeContext    —— context.credentials / region / request_id as Function Compute provides them
+    - event builders —— API Gateway HTTP events and OSS trigger events in the exact shape each handler parses
+
+The real tablestore and oss2 packages must be installed: rows, conditions, INF_MIN / INF_MAX and
+exceptions are the SDK's own types, only the network clients are replaced.
+
+Usage as a library (the basis for the benchmark scripts):
+    emu = LocalEmulator()
+    token = emu.create_session("alice@example.com")
+    emu.seed_media("https://.../uploads/crow.jpg", {"crow": 2})
+    resp = emu.invoke("query-files", emu.http_event("GET", "/search", token=token, query={"species": "crow"}))
+
+运行方式（冒烟测试，依次调用每个函数）：
+    python local_emulator.py
+    python local_emulator.py --sqlite emulator.db --with-model
+"""
+
+import argparse
+import base64
+import bisect
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+import types
+import uuid
+from collections import Counter
+
+import oss2
+from tablestore import (BatchGetRowResponse, BatchWriteRowResponse, BatchWriteRowResponseItem, BatchWriteRowType,
+                        CapacityUnit, ComparatorType, CompositeColumnCondition, Direction, INF_MAX, INF_MIN,
+                        LogicalOperator, OTSServiceError, Row, RowDataItem, RowExistenceExpectation)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUCKET = "birdtag-media-5225"
+DEFAULT_REGION = "cn-hangzhou"
+# Tablestore returns at most 5000 rows per get_range page even without a limit.
+PAGE_ROW_LIMIT = 5000
+
+
+# ========== 主键编码：按 Tablestore 的顺序比较 ==========
+def encode_key(values) -> bytes:
+    """Encodes primary key values (including INF_MIN / INF_MAX) into bytes that sort like Tablestore keys."""
+    out = bytearray()
+    for value in values:
+        if value is INF_MIN or isinstance(value, INF_MIN):
+            out += b"\x00"
+        elif value is INF_MAX or isinstance(value, INF_MAX):
+            out += b"\xff"
+        elif isinstance(value, int):
+            out += b"\x01" + (value + 2 ** 63).to_bytes(8, "big")
+        elif isinstance(value, str):
+            out += b"\x02" + value.encode("utf-8").replace(b"\x00", b"\x00\x01") + b"\x00\x00"
+        elif isinstance(value, (bytes, bytearray)):
+            out += b"\x03" + bytes(value).replace(b"\x00", b"\x00\x01") + b"\x00\x00"
+        else:
+            raise TypeError(f"Unsupported primary key value: {value!r}")
+    return bytes(out)
+
+
+def _value_size(value) -> int:
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return 8
+
+
+def _column_condition_passes(condition, cols) -> bool:
+    """Evaluates a SingleColumnCondition / CompositeColumnCondition against {name: (value, ts)}."""
+    if isinstance(condition, CompositeColumnCondition):
+        results = [_column_condition_passes(sub, cols) for sub in condition.sub_conditions]
+        if condition.combinator == LogicalOperator.NOT:
+            return not results[0]
+        return all(results) if condition.combinator == LogicalOperator.AND else any(results)
+    if condition.column_name not in cols:
+        return condition.pass_if_missing
+    value, expected = cols[condition.column_name][0], condition.column_value
+    return {
+        ComparatorType.EQUAL: lambda: value == expected,
+        ComparatorType.NOT_EQUAL: lambda: value != expected,
+        ComparatorType.GREATER_THAN: lambda: value > expected,
+        ComparatorType.GREATER_EQUAL: lambda: value >= expected,
+        ComparatorType.LESS_THAN: lambda: value < expected,
+        ComparatorType.LESS_EQUAL: lambda: value <= expected,
+    }[condition.comparator]()
+
+
+def _capacity_units(size_bytes: int) -> int:
+    """Tablestore charges 1 CU per started 4 KB."""
+    return max(1, (size_bytes + 4095) // 4096)
+
+
+# ========== 存储后端 ==========
+class MemoryStore:
+    """Rows kept in dicts, with a sorted key list per table for range reads."""
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.RLock()
+
+    def _table(self, table):
+        return self._tables.setdefault(table, ({}, []))
+
+    def get(self, table, key):
+        with self._lock:
+            return self._table(table)[0].get(key)
+
+    def put(self, table, key, pk, cols):
+        with self._lock:
+            rows, keys = self._table(table)
+            if key not in rows:
+                bisect.insort(keys, key)
+            rows[key] = (pk, cols)
+
+    def delete(self, table, key):
+        with self._lock:
+            rows, keys = self._table(table)
+            if rows.pop(key, None) is not None:
+                del keys[bisect.bisect_left(keys, key)]
+
+    def scan(self, table, start, end, direction, limit):
+        """FORWARD: start <= key < end ascending. BACKWARD: end < key <= start descending."""
+        with self._lock:
+            rows, keys = self._table(table)
+            if direction == Direction.FORWARD:
+                lo, hi = bisect.bisect_left(keys, start), bisect.bisect_left(keys, end)
+                selected = keys[lo:min(hi, lo + limit)]
+            else:
+                lo, hi = bisect.bisect_right(keys, end), bisect.bisect_right(keys, start)
+                selected = keys[max(lo, hi - limit):hi][::-1]
+            return [(k,) + rows[k] for k in selected]
+
+    def keys(self, table):
+        with self._lock:
+            return list(self._table(table)[1])
+
+
+class SqliteStore:
+    """Same interface as MemoryStore, persisted to a SQLite file so datasets survive between runs."""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS rows (tbl TEXT, k BLOB, pk BLOB, cols BLOB, "
+                         "PRIMARY KEY (tbl, k)) WITHOUT ROWID")
+        self._lock = threading.RLock()
+
+    def get(self, table, key):
+        with self._lock:
+            found = self._db.execute("SELECT pk, cols FROM rows WHERE tbl = ? AND k = ?", (table, key)).fetchone()
+        return (pickle.loads(found[0]), pickle.loads(found[1])) if found else None
+
+    def put(self, table, key, pk, cols):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)",
+                             (table, key, pickle.dumps(pk), pickle.dumps(cols)))
+
+    def delete(self, table, key):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM rows WHERE tbl = ? AND k = ?", (table, key))
+
+    def scan(self, table, start, end, direction, limit):
+        if direction == Direction.FORWARD:
+            sql = "SELECT k, pk, cols FROM rows WHERE tbl = ? AND k >= ? AND k < ? ORDER BY k ASC LIMIT ?"
+            args = (table, start, end, limit)
+        else:
+            sql = "SELECT k, pk, cols FROM rows WHERE tbl = ? AND k <= ? AND k > ? ORDER BY k DESC LIMIT ?"
+            args = (table, start, end, limit)
+        with self._lock:
+            found = self._db.execute(sql, args).fetchall()
+        return [(k, pickle.loads(pk), pickle.loads(cols)) for k, pk, cols in found]
+
+    def keys(self, table):
+        with self._lock:
+            return [k for (k,) in self._db.execute("SELECT k FROM rows WHERE tbl = ? ORDER BY k", (table,))]
+
+
+# ========== Tablestore 模拟 ==========
+class FakeOTSClient:
+    """Drop-in for tablestore.OTSClient backed by a MemoryStore / SqliteStore."""
+
+    _stats_lock = threading.Lock()
+
+    def __init__(self, store, stats=None, latency_ms=0.0, split_unit_bytes=None, **kwargs):
+        self._store = store
+        self.stats = stats if stats is not None else Counter()
+        # Simulated network round trip per call, so that I/O-bound concurrency can be measured locally.
+        self._latency_s = latency_ms / 1000
+        # The Python tablestore SDK has no compute_split_points_by_size; expose it only when asked to.
+        self._split_unit_bytes = split_unit_bytes
+        if split_unit_bytes:
+            self.compute_split_points_by_size = self._compute_split_points_by_size
+
+    # --- helpers ---
+    def _record(self, op, read_cu=0, write_cu=0, rows=0):
+        with self._stats_lock:
+            self._record_locked(op, read_cu, write_cu, rows)
+        if self._latency_s:
+            time.sleep(self._latency_s)
+
+    def _record_locked(self, op, read_cu, write_cu, rows):
+        self.stats["calls." + op] += 1
+        self.stats["calls"] += 1
+        self.stats["cu.read"] += read_cu
+        self.stats["cu.write"] += write_cu
+        self.stats["rows.read"] += rows
+
+    @staticmethod
+    def _to_row(pk, cols, columns_to_get=None):
+        names = cols.keys() if not columns_to_get else [c for c in columns_to_get if c in cols]
+        return Row(list(pk), [(name, cols[name][0], cols[name][1]) for name in names])
+
+    @staticmethod
+    def _row_size(pk, cols):
+        return sum(_value_size(v) for _, v in pk) + sum(len(n) + _value_size(v) for n, (v, _) in cols.items())
+
+    def _check_condition(self, table, key, condition):
+        if condition is None:
+            return
+        expectation = condition.row_existence_expectation
+        existing = self._store.get(table, key)
+        exists = existing is not None
+        if expectation == RowExistenceExpectation.EXPECT_EXIST and not exists:
+            raise OTSServiceError(403, "OTSConditionCheckFail", "Condition check failed.")
+        if expectation == RowExistenceExpectation.EXPECT_NOT_EXIST and exists:
+            raise OTSServiceError(403, "OTSConditionCheckFail", "Condition check failed.")
+        column_condition = getattr(condition, "column_condition", None)
+        if column_condition is not None and not _column_condition_passes(column_condition,
+                                                                         existing[1] if exists else {}):
+            raise OTSServiceError(403, "OTSConditionCheckFail", "Condition check failed.")
+
+    def _apply_put(self, table, row, condition):
+        key = encode_key([v for _, v in row.primary_key])
+        self._check_condition(table, key, condition)
+        now = int(time.time() * 1000)
+        cols = {col[0]: (col[1], col[2] if len(col) > 2 else now) for col in (row.attribute_columns or [])}
+        self._store.put(table, key, list(row.primary_key), cols)
+        return self._row_size(row.primary_key, cols)
+
+    def _apply_update(self, table, row, condition):
+        key = encode_key([v for _, v in row.primary_key])
+        self._check_condition(table, key, condition)
+        existing = self._store.get(table, key)
+        cols = dict(existing[1]) if existing else {}
+        now = int(time.time() * 1000)
+        for op, columns in (row.attribute_columns or {}).items():
+            op = op.upper()
+            for col in columns:
+                name = col if isinstance(col, str) else col[0]
+                if op == "PUT":
+                    cols[name] = (col[1], col[2] if len(col) > 2 else now)
+                elif op in ("DELETE", "DELETE_ALL"):
+                    cols.pop(name, None)
+                elif op == "INCREMENT":
+                    cols[name] = (cols.get(name, (0, now))[0] + col[1], now)
+                else:
+                    raise ValueError(f"Unknown update type: {op}")
+        self._store.put(table, key, list(row.primary_key), cols)
+        return self._row_size(row.primary_key, cols)
+
+    def _apply_delete(self, table, primary_key, condition):
+        if isinstance(primary_key, Row):
+            primary_key = primary_key.primary_key
+        key = encode_key([v for _, v in primary_key])
+        self._check_condition(table, key, condition)
+        self._store.delete(table, key)
+
+    # --- OTSClient API ---
+    def get_row(self, table_name, primary_key, columns_to_get=None, column_filter=None, max_version=1,
+                time_range=None, start_column=None, end_column=None, token=None, transaction_id=None):
+        if column_filter is not None:
+            raise NotImplementedError("column_filter is not emulated.")
+        found = self._store.get(table_name, encode_key([v for _, v in primary_key]))
+        if found is None:
+            self._record("get_row", read_cu=1)
+            return CapacityUnit(1, 0), None, None
+        size = self._row_size(*found)
+        self._record("get_row", read_cu=_capacity_units(size), rows=1)
+        return CapacityUnit(_capacity_units(size), 0), self._to_row(found[0], found[1], columns_to_get), None
+
+    def put_row(self, table_name, row, condition=None, return_type=None, transaction_id=None):
+        size = self._apply_put(table_name, row, condition)
+        self._record("put_row", write_cu=_capacity_units(size))
+        return CapacityUnit(0, _capacity_units(size)), None
+
+    def update_row(self, table_name, row, condition, return_type=None, transaction_id=None):
+        size = self._apply_update(table_name, row, condition)
+        self._record("update_row", write_cu=_capacity_units(size))
+        return CapacityUnit(0, _capacity_units(size)), None
+
+    def delete_row(self, table_name, row=None, condition=None, return_type=None, transaction_id=None, **kwargs):
+        self._apply_delete(table_name, row if row is not None else kwargs.get("primary_key"), condition)
+        self._record("delete_row", write_cu=1)
+        return CapacityUnit(0, 1), None
+
+    def get_range(self, table_name, direction, inclusive_start_primary_key, exclusive_end_primary_key,
+                  columns_to_get=None, limit=None, column_filter=None, max_version=1, time_range=None,
+                  start_column=None, end_column=None, token=None, transaction_id=None):
+        if column_filter is not None:
+            raise NotImplementedError("column_filter is not emulated.")
+        page_limit = min(limit or PAGE_ROW_LIMIT, PAGE_ROW_LIMIT)
+        start = encode_key([v for _, v in inclusive_start_primary_key])
+        end = encode_key([v for _, v in exclusive_end_primary_key])
+        found = self._store.scan(table_name, start, end, direction, page_limit + 1)
+        page, rest = found[:page_limit], found[page_limit:]
+        next_start = list(rest[0][1]) if rest else None
+        size = sum(self._row_size(pk, cols) for _, pk, cols in page)
+        cu = _capacity_units(size)
+        self._record("get_range", read_cu=cu, rows=len(page))
+        rows = [self._to_row(pk, cols, columns_to_get) for _, pk, cols in page]
+        return CapacityUnit(cu, 0), next_start, rows, None
+
+    def batch_get_row(self, request):
+        results = {}
+        read_cu = 0
+        for table_name, item in request.items.items():
+            table_rows = []
+            for primary_key in item.primary_keys:
+                found = self._store.get(table_name, encode_key([v for _, v in primary_key]))
+                if found is None:
+                    table_rows.append(RowDataItem(True, None, None, table_name, CapacityUnit(1, 0), None, None))
+                    read_cu += 1
+                    continue
+                cu = _capacity_units(self._row_size(*found))
+                read_cu += cu
+                row = self._to_row(found[0], found[1], item.columns_to_get)
+                table_rows.append(RowDataItem(True, None, None, table_name, CapacityUnit(cu, 0),
+                                              row.primary_key, row.attribute_columns))
+            results[table_name] = table_rows
+        self._record("batch_get_row", read_cu=read_cu, rows=sum(len(r) for r in results.values()))
+        return BatchGetRowResponse(results)
+
+    def batch_write_row(self, request):
+        results = {}
+        write_cu = 0
+        for table_name, item in request.items.items():
+            table_results = []
+            for row_item in item.row_items:
+                try:
+                    if row_item.type == BatchWriteRowType.PUT:
+                        cu = _capacity_units(self._apply_put(table_name, row_item.row, row_item.condition))
+                    elif row_item.type == BatchWriteRowType.UPDATE:
+                        cu = _capacity_units(self._apply_update(table_name, row_item.row, row_item.condition))
+                    else:
+                        self._apply_delete(table_name, row_item.row.primary_key, row_item.condition)
+                        cu = 1
+                    write_cu += cu
+                    table_results.append(BatchWriteRowResponseItem(True, None, None, CapacityUnit(0, cu),
+                                                                   row_item.row.primary_key))
+                except OTSServiceError as e:
+                    table_results.append(BatchWriteRowResponseItem(False, e.code, e.message, CapacityUnit(0, 1),
+                                                                   row_item.row.primary_key))
+            results[table_name] = table_results
+        self._record("batch_write_row", write_cu=write_cu)
+        return BatchWriteRowResponse(request, results)
+
+    def _compute_split_points_by_size(self, table_name, split_size):
+        """
+        Emulated split computation. Returns (consumed, split_points, locations) where split_points
+        is a list of primary keys; split_size is in units of split_unit_bytes (100 MB in Tablestore).
+        """
+        limit = max(1, int(split_size)) * self._split_unit_bytes
+        split_points = []
+        size = 0
+        for key in self._store.keys(table_name):
+            pk, cols = self._store.get(table_name, key)
+            if size >= limit:
+                split_points.append(list(pk))
+                size = 0
+            size += self._row_size(pk, cols)
+        self._record("compute_split_points_by_size")
+        return CapacityUnit(1, 0), split_points, [("local", len(split_points) + 1)]
+
+
+# ========== OSS 模拟 ==========
+class FakeObject:
+    def __init__(self, data: bytes, headers: dict):
+        self._data = data
+        self._pos = 0
+        self.headers = dict(headers)
+        self.content_length = len(data)
+        self.etag = hashlib.md5(data).hexdigest().upper()
+        self.last_modified = int(time.time())
+
+    def read(self, amt=None):
+        end = len(self._data) if amt is None else min(len(self._data), self._pos + amt)
+        chunk = self._data[self._pos:end]
+        self._pos = end
+        return chunk
+
+    def close(self):
+        self._pos = len(self._data)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(64 * 1024)
+            if not chunk:
+                return
+            yield chunk
+
+
+class FakeBucket:
+    """Drop-in for oss2.Bucket over a dict of {bucket_name: {key: (bytes, headers)}}."""
+
+    def __init__(self, objects, bucket_name, stats=None, endpoint=None):
+        self._objects = objects.setdefault(bucket_name, {})
+        self._uploads = {}
+        self.bucket_name = bucket_name
+        self.endpoint = endpoint or f"https://oss-{DEFAULT_REGION}.aliyuncs.com"
+        self.enable_crc = False  # read by oss2.resumable_upload
+        self.stats = stats if stats is not None else Counter()
+
+    @staticmethod
+    def _read_data(data):
+        if hasattr(data, "read"):
+            data = data.read()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return bytes(data)
+
+    def _not_found(self, key):
+        return oss2.exceptions.NoSuchKey(404, {}, b"", {"Code": "NoSuchKey", "Message": f"{key} does not exist"})
+
+    def put_object(self, key, data, headers=None, progress_callback=None):
+        data = self._read_data(data)
+        self._objects[key] = (data, dict(headers or {}))
+        self.stats["oss.put_object"] += 1
+        self.stats["oss.bytes_written"] += len(data)
+        return types.SimpleNamespace(status=200, etag=hashlib.md5(data).hexdigest().upper())
+
+    def put_object_from_file(self, key, filename, headers=None, progress_callback=None):
+        with open(filename, "rb") as f:
+            return self.put_object(key, f.read(), headers)
+
+    def get_object(self, key, byte_range=None, headers=None, progress_callback=None, process=None, params=None):
+        if key not in self._objects:
+            raise self._not_found(key)
+        data, meta = self._objects[key]
+        if byte_range is not None:
+            start, end = byte_range
+            data = data[start or 0:None if end is None else end + 1]
+        self.stats["oss.get_object"] += 1
+        self.stats["oss.bytes_read"] += len(data)
+        return FakeObject(data, meta)
+
+    def head_object(self, key, headers=None, params=None):
+        if key not in self._objects:
+            raise self._not_found(key)
+        data, meta = self._objects[key]
+        return FakeObject(data, meta)
+
+    def object_exists(self, key, headers=None):
+        return key in self._objects
+
+    def delete_object(self, key, params=None, headers=None):
+        self._objects.pop(key, None)
+        self.stats["oss.delete_object"] += 1
+        return types.SimpleNamespace(status=204)
+
+    def sign_url(self, method, key, expires, headers=None, params=None, slash_safe=False, additional_headers=None):
+        query = "&".join(f"{k}={v}" for k, v in sorted((params or {}).items()))
+        return f"https://{self.bucket_name}.oss-emulator.local/{key}?Expires={int(time.time()) + expires}" + (
+            f"&{query}" if query else "")
+
+    def init_multipart_upload(self, key, headers=None, params=None):
+        upload_id = uuid.uuid4().hex
+        self._uploads[upload_id] = (key, {}, dict(headers or {}))
+        return types.SimpleNamespace(upload_id=upload_id, status=200)
+
+    def upload_part(self, key, upload_id, part_number, data, progress_callback=None, headers=None):
+        data = self._read_data(data)
+        self._uploads[upload_id][1][part_number] = data
+        return types.SimpleNamespace(etag=hashlib.md5(data).hexdigest().upper(), crc=None, status=200)
+
+    def list_parts(self, key, upload_id, marker="", max_parts=1000, headers=None):
+        if upload_id not in self._uploads:
+            raise oss2.exceptions.NoSuchUpload(404, {}, b"", {"Code": "NoSuchUpload", "Message": upload_id})
+        uploaded = self._uploads[upload_id][1]
+        numbers = sorted(n for n in uploaded if n > int(marker or 0))
+        page = numbers[:max_parts]
+        return types.SimpleNamespace(
+            parts=[oss2.models.PartInfo(n, hashlib.md5(uploaded[n]).hexdigest().upper(), size=len(uploaded[n]))
+                   for n in page],
+            is_truncated=len(numbers) > max_parts, next_marker=str(page[-1]) if page else "", status=200)
+
+    def complete_multipart_upload(self, key, upload_id, parts, headers=None):
+        _, uploaded, meta = self._uploads.pop(upload_id)
+        data = b"".join(uploaded[p.part_number] for p in sorted(parts, key=lambda p: p.part_number))
+        return self.put_object(key, data, meta)
+
+    def abort_multipart_upload(self, key, upload_id, headers=None):
+        self._uploads.pop(upload_id, None)
+
+
+class _FakeOssModule(types.ModuleType):
+    """Stands in for the oss2 module inside a handler: Bucket / auth are fakes, everything else is real oss2."""
+
+    def __init__(self, emulator):
+        super().__init__("oss2")
+        self.Bucket = lambda auth, endpoint, bucket_name, *a, **kw: FakeBucket(emulator.objects, bucket_name,
+                                                                              emulator.stats, endpoint)
+        self.Auth = self.StsAuth = self.ProviderAuth = lambda *a, **kw: None
+
+    def __getattr__(self, name):
+        return getattr(oss2, name)
+
+
+# ========== 函数计算上下文 ==========
+class FakeCredentials:
+    access_key_id = "LTAI-local-emulator"
+    access_key_secret = "local-emulator-secret"
+    security_token = "local-emulator-sts-token"
+
+
+class FakeContext:
+    def __init__(self, function_name: str, region: str = DEFAULT_REGION):
+        self.credentials = FakeCredentials()
+        self.region = region
+        self.request_id = str(uuid.uuid4())
+        self.account_id = "0"
+        self.function = types.SimpleNamespace(name=function_name, handler="index.handler", memory=3072, timeout=60)
+        self.service = types.SimpleNamespace(name="birdtag", log_project="", log_store="")
+
+
+# ========== 模拟器 ==========
+class LocalEmulator:
+    def __init__(self, sqlite_path: str = None, bucket: str = DEFAULT_BUCKET, region: str = DEFAULT_REGION,
+                 ots_latency_ms: float = 0.0, split_unit_bytes: int = None):
+        self.store = SqliteStore(sqlite_path) if sqlite_path else MemoryStore()
+        self.ots_latency_ms = ots_latency_ms
+        self.split_unit_bytes = split_unit_bytes
+        self.objects = {}
+        self.stats = Counter()
+        self.bucket_name = bucket
+        self.region = region
+        self.oss_module = _FakeOssModule(self)
+        self._functions = {}
+        self._load_lock = threading.Lock()
+
+    # --- clients ---
+    def ots_client(self, *args, **kwargs) -> FakeOTSClient:
+        return FakeOTSClient(self.store, self.stats, self.ots_latency_ms, self.split_unit_bytes)
+
+    def bucket(self, name: str = None) -> FakeBucket:
+        return FakeBucket(self.objects, name or self.bucket_name, self.stats)
+
+    def context(self, function_name: str) -> FakeContext:
+        return FakeContext(function_name, self.region)
+
+    # --- functions ---
+    def load(self, function_name: str):
+        """Imports <function_name>/index.py with OTSClient and oss2 replaced by the emulator's fakes."""
+        with self._load_lock:
+            if function_name in self._functions:
+                return self._functions[function_name]
+            function_dir = os.path.join(ROOT, function_name)
+            local_modules = {os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(function_dir, "*.py"))}
+            # Sibling modules (bird_detector, ...) may exist in several function directories; load this one's copy.
+            for name in local_modules - {"index"}:
+                sys.modules.pop(name, None)
+            sys.path.insert(0, function_dir)
+            try:
+                spec = importlib.util.spec_from_file_location(f"birdtag_{function_name.replace('-', '_')}",
+                                                              os.path.join(function_dir, "index.py"))
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+            finally:
+                sys.path.remove(function_dir)
+            for loaded in [module] + [sys.modules[n] for n in local_modules if n in sys.modules]:
+                if hasattr(loaded, "OTSClient"):
+                    loaded.OTSClient = self.ots_client
+                if isinstance(getattr(loaded, "oss2", None), types.ModuleType):
+                    loaded.oss2 = self.oss_module
+                # Function Compute runs with the code directory as cwd; resolve './model.pt' etc. against it
+                # instead of changing the emulator's working directory.
+                for name, value in vars(loaded).items():
+                    if name.endswith("_PATH") and isinstance(value, str) and value.startswith("./"):
+                        setattr(loaded, name, os.path.join(function_dir, value[2:]))
+            self._functions[function_name] = module
+            return module
+
+    def invoke(self, function_name: str, event: bytes, entry: str = "handler"):
+        module = self.load(function_name)
+        return getattr(module, entry)(event, self.context(function_name))
+
+
+    # --- events ---
+    @staticmethod
+    def http_event(method: str, path: str, token: str = None, query: dict = None, body=None,
+                   headers: dict = None, base64_body: bool = False) -> bytes:
+        """API Gateway -> Function Compute event, as the HTTP handlers decode it."""
+        all_headers = {"Content-Type": "application/json"}
+        if token:
+            all_headers["Authorization"] = token
+        all_headers.update(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        if base64_body and body is not None:
+            body = base64.b64encode(body if isinstance(body, bytes) else body.encode("utf-8")).decode("ascii")
+        event = {
+            "path": path,
+            "httpMethod": method,
+            "headers": all_headers,
+            "queryParameters": query or {},
+            "pathParameters": {},
+            "body": body if body is not None else "",
+            "isBase64Encoded": base64_body,
+        }
+        return json.dumps(event).encode("utf-8")
+
+    @classmethod
+    def multipart_event(cls, path: str, token: str, file_bytes: bytes, filename: str = "bird.jpg",
+                        field: str = "file") -> bytes:
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+                f"Content-Type: image/jpeg\r\n\r\n").encode() + file_bytes + f"\r\n--{boundary}--\r\n".encode()
+        return cls.http_event("POST", path, token=token, body=body, base64_body=True,
+                              headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+
+    def oss_event(self, key: str, token: str = None) -> bytes:
+        """OSS ObjectCreated trigger event, as process-upload parses it."""
+        user_meta = {"token": token} if token else {}
+        obj = {"key": key, "userMeta": user_meta}
+        stored = self.objects.get(self.bucket_name, {}).get(key)
+        if stored is not None:
+            obj["size"] = len(stored[0])
+        event = {"events": [{
+            "eventName": "ObjectCreated:PutObject",
+            "region": self.region,
+            "oss": {"bucket": {"name": self.bucket_name}, "object": obj},
+        }]}
+        return json.dumps(event).encode("utf-8")
+
+    # --- data seeding ---
+    def _seed_client(self) -> FakeOTSClient:
+        """Seeding writes skip the simulated latency."""
+        return FakeOTSClient(self.store, self.stats)
+
+    def file_url(self, key: str) -> str:
+        return f"https://{self.bucket_name}.oss-{self.region}.aliyuncs.com/{key}"
+
+    def create_user(self, email: str, password: str):
+        password_hash = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        self._seed_client().put_row("users", Row([("email", email)], [("password_hash", password_hash)]))
+
+    def create_session(self, email: str, ttl_seconds: int = 3600) -> str:
+        """Writes a sessions row directly, as login-user does, and returns the token."""
+        token = uuid.uuid4().hex
+        row = Row([("token", token)], [("user_email", email), ("expires_at", int(time.time()) + ttl_seconds)])
+        self._seed_client().put_row("sessions", row)
+        return token
+
+    def seed_media(self, file_url: str, tags: dict, thumbnail_url: str = None, uploader: str = None,
+                   uploaded_at: int = None, **extra):
+        """Writes a media_metadata row and its index entries (species, uploader, time), as process-upload does."""
+        uploaded_at = int(time.time() * 1000) if uploaded_at is None else uploaded_at
+        columns = [("tags", json.dumps(tags)), ("file_type", "image"), ("uploaded_at", uploaded_at)]
+        if uploader:
+            columns.append(("uploader", uploader))
+        if thumbnail_url:
+            columns.append(("thumbnail_url", thumbnail_url))
+        columns.extend(extra.items())
+        client = self._seed_client()
+        client.put_row("media_metadata", Row([("file_url", file_url)], columns))
+        # species_index postings, as species_index.sync() writes them
+        counts = Counter()
+        for species, count in tags.items():
+            counts[species.strip().lower()] += count
+        for species, count in counts.items():
+            posting = [("count", count)] + ([("thumbnail_url", thumbnail_url)] if thumbnail_url else [])
+            client.put_row("species_index", Row([("species", species), ("file_url", file_url)], posting))
+        # time_index rows, as time_index.sync() writes them
+        thumb = [("thumbnail_url", thumbnail_url)] if thumbnail_url else []
+        day = time.strftime("%Y-%m-%d", time.gmtime(uploaded_at / 1000))
+        for species in ["*"] + list(counts):
+            columns = ([("tags", json.dumps(tags))] if species == "*" else []) + thumb
+            client.put_row("time_index", Row([("day", day), ("species", species), ("uploaded_at", uploaded_at),
+                                              ("file_url", file_url)], columns))
+        if uploader:
+            entry = [("tags", json.dumps(tags))] + thumb
+            client.put_row("uploader_index", Row([("uploader", uploader), ("uploaded_at", uploaded_at),
+                                                  ("file_url", file_url)], entry))
+
+
+# ========== 冒烟测试 ==========
+def _body(resp) -> dict:
+    return json.loads(resp["body"]) if isinstance(resp, dict) and resp.get("body") else {}
+
+
+def run_smoke(emu: LocalEmulator, with_model: bool):
+    # seed_media() fills the index tables as build_indexes.py would, so exercise the indexed query path.
+    os.environ.setdefault("SPECIES_INDEX_ENABLED", "1")
+    os.environ.setdefault("UPLOADER_INDEX_ENABLED", "1")
+    results = []
+
+    def check(name, fn):
+        try:
+            detail = fn()
+            results.append((name, True, detail))
+        except Exception as e:  # noqa: BLE001 - report every failure in the summary
+            results.append((name, False, f"{type(e).__name__}: {e}"))
+
+    email = "emulator@example.com"
+    check("register-user", lambda: emu.invoke("register-user", emu.http_event(
+        "POST", "/register", body={"email": email, "password": "pw"}))["statusCode"])
+
+    def login_user():
+        resp = emu.invoke("login-user", emu.http_event("POST", "/login", body={"email": email, "password": "pw"}))
+        assert resp["statusCode"] == 200 and _body(resp)["token"], resp
+        bad = emu.invoke("login-user", emu.http_event("POST", "/login", body={"email": email, "password": "nope"}))
+        assert bad["statusCode"] == 401, bad
+        return f"expires_at {_body(resp)['expires_at']}"
+
+    check("login-user", login_user)
+    token = emu.create_session(email)
+    for i, tags in enumerate([{"crow": 2}, {"crow": 1, "pigeon": 1}, {"owl": 1}]):
+        key = f"uploads/seed_{i}.jpg"
+        emu.bucket().put_object(key, b"not-an-image")
+        emu.seed_media(emu.file_url(key), tags, uploader=email, uploaded_at=1700000000000 + i)
+
+    def query_files():
+        resp = emu.invoke("query-files", emu.http_event("GET", "/search", token=token, query={"species": "crow"}))
+        assert resp["statusCode"] == 200 and len(_body(resp)["links"]) == 2, resp
+        return f"{len(_body(resp)['links'])} links"
+
+    def query_by_count():
+        resp = emu.invoke("query-by-count", emu.http_event("POST", "/query-by-count", token=token, body={"crow": 2}))
+        assert resp["statusCode"] == 200 and len(_body(resp)["links"]) == 1, resp
+        return f"{len(_body(resp)['links'])} links"
+
+    def manage_tags():
+        body = {"url": [emu.file_url("uploads/seed_2.jpg")], "operation": 1, "tags": ["crow,3"]}
+        resp = emu.invoke("manage-tags", emu.http_event("POST", "/tags/manage", token=token, body=body))
+        assert resp["statusCode"] == 200, resp
+        return _body(resp)["message"]
+
+    def delete_files():
+        body = {"urls": [emu.file_url("uploads/seed_0.jpg")]}
+        resp = emu.invoke("delete-files", emu.http_event("POST", "/files/delete", token=token, body=body))
+        assert resp["statusCode"] == 200 and not emu.bucket().object_exists("uploads/seed_0.jpg"), resp
+        return _body(resp)["message"]
+
+    def species_query():
+        # Runs after manage-tags (seed_2 gains crow) and delete-files (seed_0 is gone), so it also
+        # checks that both kept the species_index postings in step.
+        resp = emu.invoke("query-files", emu.http_event("GET", "/search", token=token,
+                                                        query={"q": "crow NOT pigeon"}))
+        links = _body(resp).get("links")
+        assert resp["statusCode"] == 200 and links == [emu.file_url("uploads/seed_2.jpg")], resp
+        bad = emu.invoke("query-files", emu.http_event("GET", "/search", token=token, query={"q": "NOT crow"}))
+        assert bad["statusCode"] == 400, bad
+        return f"{len(links)} links"
+
+    def species_suggest():
+        resp = emu.invoke("species-suggest", emu.http_event("GET", "/species/suggest", query={"prefix": "Hou"}))
+        names = [s["name"] for s in _body(resp)["suggestions"]]
+        assert resp["statusCode"] == 200 and names == ["crow", "sparrow"], resp
+        # Synonyms and plurals resolve to the canonical name stored in the index
+        resp = emu.invoke("query-files", emu.http_event("GET", "/search", token=token, query={"q": "House_Crows OR crows"}))
+        assert len(_body(resp)["links"]) == 2, resp
+        return ", ".join(names)
+
+    def my_files():
+        # Newest first, one per page: seed_2 then seed_1 (seed_0 was deleted above).
+        pages, cursor = [], None
+        while True:
+            query = {"limit": "1", **({"cursor": cursor} if cursor else {})}
+            resp = emu.invoke("my-files", emu.http_event("GET", "/my-files", token=token, query=query))
+            assert resp["statusCode"] == 200, resp
+            pages.append([f["file_url"] for f in _body(resp)["files"]])
+            cursor = _body(resp)["next_cursor"]
+            if not cursor:
+                break
+        files = [url for page in pages for url in page]
+        assert files == [emu.file_url("uploads/seed_2.jpg"), emu.file_url("uploads/seed_1.jpg")], pages
+        return f"{len(files)} files in {len(pages)} pages"
+
+    def export_catalog():
+        resp = emu.invoke("export-catalog", emu.http_event("GET", "/export", token=token,
+                                                           query={"format": "csv", "q": "crow"}))
+        assert resp["statusCode"] == 200 and _body(resp)["download_url"], resp
+        lines = emu.bucket().get_object(_body(resp)["key"]).read().decode("utf-8").splitlines()
+        assert lines[0].startswith("file_url,") and len(lines) == 1 + _body(resp)["rows"], lines
+        return f"{_body(resp)['rows']} rows"
+
+    def query_cache():
+        # Turns catalog versioning on for the reader and the writer: a repeated query is answered from the
+        # cache, and a tag edit bumps the version so the next query sees it.
+        versions = [emu.load("query-files").query_cache.catalog_version, emu.load("manage-tags").catalog_version]
+        for module in versions:
+            module.CATALOG_VERSION_TABLE = "catalog_version"
+        try:
+            event = emu.http_event("GET", "/search", token=token, query={"q": "owl"})
+            first = _body(emu.invoke("query-files", event))["links"]
+            calls = emu.stats["calls"]
+            assert _body(emu.invoke("query-files", event))["links"] == first, "cached result differs"
+            assert emu.stats["calls"] - calls == 2, "cache hit should read only the session and the version"
+            body = {"url": [emu.file_url("uploads/seed_1.jpg")], "operation": 1, "tags": ["owl,1"]}
+            emu.invoke("manage-tags", emu.http_event("POST", "/tags/manage", token=token, body=body))
+            after = _body(emu.invoke("query-files", event))["links"]
+            assert len(after) == len(first) + 1, (first, after)
+        finally:
+            for module in versions:
+                module.CATALOG_VERSION_TABLE = ""
+        return f"{len(first)} -> {len(after)} links after a tag edit"
+
+    def upload_url():
+        body = {"filename": "owl.jpg", "content_type": "image/jpeg", "size": 1024}
+        resp = emu.invoke("get-upload-url", emu.http_event("POST", "/upload-url", token=token, body=body))
+        assert resp["statusCode"] == 200, resp
+        fields = _body(resp)["post"]["fields"]
+        policy = json.loads(base64.b64decode(fields["policy"]))
+        assert ["content-length-range", 1, 1024] in policy["conditions"], policy
+        missing = emu.invoke("get-upload-url", emu.http_event("POST", "/upload-url", token=token,
+                                                              body={"filename": "owl.jpg"}))
+        assert missing["statusCode"] == 400, missing
+        return _body(resp)["key"]
+
+    def rate_limit():
+        # Runs without the model: the request is charged before the file is read, so an empty body is
+        # rejected with 400 while admitted and with 429 once the user's bucket is empty.
+        admission = emu.load("search-by-file").admission
+        saved = admission._buckets
+        admission._buckets = admission.TokenBuckets(per_minute=1, burst=2)
+        try:
+            event = emu.http_event("POST", "/search-by-file", token=token, body={})
+            statuses = [emu.invoke("search-by-file", event)["statusCode"] for _ in range(2)]
+            resp = emu.invoke("search-by-file", event)
+            assert statuses == [400, 400] and resp["statusCode"] == 429 and resp["headers"]["Retry-After"], resp
+        finally:
+            admission._buckets = saved
+        return f"429, Retry-After {resp['headers']['Retry-After']}s"
+
+    def unauthorized():
+        resp = emu.invoke("query-files", emu.http_event("GET", "/search", token="bogus", query={"species": "crow"}))
+        assert resp["statusCode"] == 401, resp
+        return "401"
+
+    check("query-files", query_files)
+    check("query-by-count", query_by_count)
+    check("manage-tags", manage_tags)
+    check("delete-files", delete_files)
+    check("species-query", species_query)
+    check("my-files", my_files)
+    check("species-suggest", species_suggest)
+    check("export-catalog", export_catalog)
+    check("query-cache", query_cache)
+    check("get-upload-url", upload_url)
+    check("rate-limit", rate_limit)
+    check("unauthorized", unauthorized)
+
+    if with_model:
+        image_path = os.path.join(ROOT, "test_images", "crows_1.jpg")
+        with open(image_path, "rb") as f:
+            image = f.read()
+
+        def process_upload():
+            emu.bucket().put_object("uploads/crows_1.jpg", image, headers={"x-oss-meta-token": token})
+            resp = emu.invoke("process-upload", emu.oss_event("uploads/crows_1.jpg", token))
+            _, row, _ = emu.ots_client().get_row("media_metadata", [("file_url", emu.file_url("uploads/crows_1.jpg"))])
+            assert row is not None, resp
+            return dict((c[0], c[1]) for c in row.attribute_columns).get("tags")
+
+        def search_by_file():
+            resp = emu.invoke("search-by-file", emu.multipart_event("/search-by-file", token, image))
+            assert resp["statusCode"] == 200, resp
+            return f"{len(_body(resp)['links'])} links"
+
+        check("process-upload", process_upload)
+        check("search-by-file", search_by_file)
+
+    print("\n" + "=" * 70 + "\n本地模拟器冒烟测试汇总\n" + "=" * 70)
+    for name, ok, detail in results:
+        print(f"{name:>16}: {'PASS ✅' if ok else 'FAIL ❌'}  {detail}")
+    print(f"\nTablestore calls: {emu.stats['calls']}  (read CU {emu.stats['cu.read']}, write CU {emu.stats['cu.write']})")
+    return all(ok for _, ok, _ in results)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Run BirdTag functions in-process against local fakes")
+    p.add_argument("--sqlite", help="Persist the fake Tablestore to this SQLite file instead of memory")
+    p.add_argument("--with-model", action="store_true",
+                   help="Also run process-upload and search-by-file (needs model.pt in both function directories)")
+    args = p.parse_args()
+    emu = LocalEmulator(sqlite_path=args.sqlite)
+    sys.exit(0 if run_smoke(emu, args.with_model) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,93 +1,61 @@
-import requests
+# index.py for login-user function
 import json
+import os
+import time
+import traceback
 import uuid
-
-# ---  请在这里修改你的配置 ---
-
-# 1. 你的 API 网关的公网域名 (请务必替换)
-API_GATEWAY_DOMAIN = "https://9b618e52ff3d4250a85f65db6a017f03-cn-hangzhou.alicloudapi.com"
-
-# 2. 我们将使用一个随机邮箱进行注册和登录测试，避免重复
-#    如果你想用固定邮箱测试，可以替换成 USER_EMAIL = "mytest@example.com"
-UNIQUE_ID = str(uuid.uuid4())
-USER_EMAIL = f"testuser_{UNIQUE_ID}@example.com"
-USER_PASSWORD = "StrongPassword123"
-
-
-# ------------------------------------
-
-def test_register_api():
-    """
-    测试用户注册 API (/register)
-    """
-    api_url = f"{API_GATEWAY_DOMAIN}/register"
-
-    request_body = {
-        "email": USER_EMAIL,
-        "password": USER_PASSWORD
-    }
-
-    print("--- 1. 正在测试 '用户注册' API ---")
-    print(f"请求地址 (POST): {api_url}")
-    print(f"注册邮箱: {USER_EMAIL}")
-
-    try:
-        response = requests.post(api_url, json=request_body, timeout=30)
-        response.raise_for_status()  # 检查HTTP错误
-
-        result_json = response.json()
-        print("\n>>> 注册 API 调用成功！ <<<")
-        print("服务器返回的结果:")
-        print(json.dumps(result_json, indent=4))
-        return True  # 返回成功标志
-
-    except requests.exceptions.RequestException as e:
-        print(f"\n>>> 注册 API 调用失败 <<<")
-        print(f"错误信息: {e}")
-        if 'response' in locals():
-            print(f"服务器返回的原始内容: {response.text}")
-        return False  # 返回失败标志
-
-
-def test_login_api():
-    """
-    测试用户登录 API (/login)
-    """
-    api_url = f"{API_GATEWAY_DOMAIN}/login"
-
-    request_body = {
-        "email": USER_EMAIL,
-        "password": USER_PASSWORD
-    }
-
-    print("\n--- 2. 正在测试 '用户登录' API ---")
-    print(f"请求地址 (POST): {api_url}")
-    print(f"登录邮箱: {USER_EMAIL}")
-
+import hashlib # 用于密码哈希
+from tablestore import *
+import tracing
+
+# --- 配置信息 ---
+OTS_ENDPOINT = "https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com"
+OTS_INSTANCE_NAME = "n01xiizqc116"
+USER_TABLE_NAME = 'users'
+SESSION_TABLE_NAME = 'sessions'
+# 会话有效期；其他函数校验 sessions 表中的 expires_at（秒级时间戳）
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', '3600'))
+# ------------------
+
+@tracing.traced('login-user')
+def handler(event, context):
+    trace = tracing.current()
     try:
-        response = requests.post(api_url, json=request_body, timeout=30)
-        response.raise_for_status()  # 检查HTTP错误
-
-        result_json = response.json()
-        print("\n>>> 登录 API 调用成功！ <<<")
-        print("服务器返回的结果:")
-        print(json.dumps(result_json, indent=4))
-
-        # 提取并验证 token
-        if "token" in result_json and result_json["token"]:
-            print(f"\n成功获取到 Token: {result_json['token']}")
-        else:
-            print("\n错误：登录成功但未返回 Token！")
-
-    except requests.exceptions.RequestException as e:
-        print(f"\n>>> 登录 API 调用失败 <<<")
-        print(f"错误信息: {e}")
-        if 'response' in locals():
-            print(f"服务器返回的原始内容: {response.text}")
-
-
-# --- 脚本执行入口 ---
-if __name__ == '__main__':
-    # 先注册，只有注册成功后才尝试登录
-    if test_register_api():
-        test_login_api()
\ No newline at end of file
+        # 1. 解析请求 body
+        trace.phase('parse')
+        event_str = event.decode('utf-8')
+        event_dict = json.loads(event_str)
+        body = json.loads(event_dict.get('body') or '{}')
+        email = body.get('email')
+        password = body.get('password')
+
+        if not email or not password:
+            return {"statusCode": 400, "body": json.dumps({"error": "Email and password are required."})}
+
+        # 2. 校验用户名和密码
+        trace.phase('auth')
+        creds = context.credentials
+        ots_client = trace.wrap_ots(OTSClient(end_point=OTS_ENDPOINT, access_key_id=creds.access_key_id, access_key_secret=creds.access_key_secret, instance_name=OTS_INSTANCE_NAME, sts_token=creds.security_token))
+
+        _, row, _ = ots_client.get_row(USER_TABLE_NAME, [('email', email)], columns_to_get=['password_hash'])
+        stored_hash = {col[0]: col[1] for col in row.attribute_columns}.get('password_hash') if row else None
+        password_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        if not stored_hash or stored_hash != password_hash:
+            return {"statusCode": 401, "body": json.dumps({"error": "Invalid email or password."})}
+
+        # 3. 创建会话，写入 sessions 表
+        token = str(uuid.uuid4())
+        expires_at = int(time.time()) + SESSION_TTL_SECONDS
+        session_row = Row([('token', token)], [('user_email', email), ('expires_at', expires_at)])
+        ots_client.put_row(SESSION_TABLE_NAME, session_row, Condition(RowExistenceExpectation.IGNORE))
+
+        trace.phase('serialize')
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"message": "Login successful.", "token": token, "expires_at": expires_at})
+        }
+
+    except Exception as e:
+        traceback.print_exc()
+        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
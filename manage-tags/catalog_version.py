@@ -0,0 +1,43 @@
+# catalog_version.py
+# One counter that changes whenever the catalog changes, so a cached query result can be checked for
+# staleness with a single get_row instead of a scan.
+#
+# process-upload, manage-tags, delete-files, query-files and query-by-count carry identical copies of
+# this file; retag_backfill.py imports process-upload's. Every writer calls bump() after it has changed
+# media_metadata and its index tables, and query_cache keys results by current().
+#
+# The counter is the 'version' column of row ('catalog',) in CATALOG_VERSION_TABLE (one string primary
+# key column 'name'), incremented with an atomic INCREMENT. Leave CATALOG_VERSION_TABLE unset to disable
+# it: bump() does nothing and current() returns None, which turns the query cache off. Set it on every
+# function that carries this file, or cached results will not see that function's writes.
+import os
+from tablestore import *
+
+CATALOG_VERSION_TABLE = os.environ.get('CATALOG_VERSION_TABLE', '')
+_PRIMARY_KEY = [('name', 'catalog')]
+
+
+def bump(ots_client):
+    """
+    Marks every cached query result as stale.
+
+    A failure is logged rather than raised, since the caller's write has already succeeded; cached
+    results then stay stale until the next successful bump.
+    """
+    if not CATALOG_VERSION_TABLE:
+        return
+    try:
+        ots_client.update_row(CATALOG_VERSION_TABLE, Row(_PRIMARY_KEY, {'INCREMENT': [('version', 1)]}),
+                              Condition(RowExistenceExpectation.IGNORE))
+    except Exception as e:
+        print(f"[WARNING] Could not bump the catalog version: {e}")
+
+
+def current(ots_client):
+    """The current catalog version (0 before the first bump), or None when versioning is disabled."""
+    if not CATALOG_VERSION_TABLE:
+        return None
+    _, row, _ = ots_client.get_row(CATALOG_VERSION_TABLE, _PRIMARY_KEY, columns_to_get=['version'])
+    if not row or not row.attribute_columns:
+        return 0
+    return {col[0]: col[1] for col in row.attribute_columns}.get('version', 0)
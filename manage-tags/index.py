@@ -3,6 +3,12 @@ import json
 import traceback
 import time  # 确保导入 time 模块
 from tablestore import *
+import tracing
+import species_index
+import uploader_index
+import time_index
+import species_names
+import catalog_version
 
 # --- 请确保这些配置与你之前的函数一致 ---
 OTS_ENDPOINT = "https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com"
@@ -13,8 +19,11 @@ SESSION_TABLE_NAME = 'sessions'  # 新增 sessions 表的配置
 
 # ---------------------------------------------
 
+@tracing.traced('manage-tags')
 def handler(event, context):
     print(f"Received event: {event}")
+    trace = tracing.current()
+    trace.phase('parse')
 
     # 步骤一：【必须先做】解析事件，确保 event_dict 存在
     try:
@@ -25,6 +34,7 @@ def handler(event, context):
         return {"statusCode": 400, "body": json.dumps({"error": "Failed to parse event data."})}
 
     # 步骤二：【第二步】进行Token验证
+    trace.phase('auth')
     try:
         headers = event_dict.get('headers', {})
         token = headers.get('authorization') or headers.get('Authorization')
@@ -32,13 +42,13 @@ def handler(event, context):
             raise ValueError("Authorization token is missing.")
 
         creds = context.credentials
-        ots_client = OTSClient(
+        ots_client = trace.wrap_ots(OTSClient(
             end_point=OTS_ENDPOINT,
             access_key_id=creds.access_key_id,
             access_key_secret=creds.access_key_secret,
             instance_name=OTS_INSTANCE_NAME,
             sts_token=creds.security_token
-        )
+        ))
 
         session_pk = [('token', token)]
         _, row, _ = ots_client.get_row(SESSION_TABLE_NAME, session_pk, columns_to_get=['user_email', 'expires_at'])
@@ -61,12 +71,15 @@ def handler(event, context):
         return {"statusCode": 401, "body": json.dumps({"error": f"Unauthorized: {e}"})}
 
     # 步骤三：【Token验证通过后】才执行业务逻辑
+    trace.phase('update')
     try:
         request_body = json.loads(event_dict.get('body', '{}'))
         urls = request_body['url']
         operation = request_body['operation']
         tags_to_modify_raw = request_body['tags']
         tags_to_modify = {tag.split(',')[0].strip(): int(tag.split(',')[1]) for tag in tags_to_modify_raw}
+        # 统一为规范物种名（"Crows"、"house crow" -> "crow"），与索引和查询使用的名称一致
+        tags_to_modify = species_names.normalize_tags(tags_to_modify)
 
         if not isinstance(urls, list) or operation not in [0, 1] or not isinstance(tags_to_modify, dict):
             raise ValueError("Invalid data format in request body.")
@@ -79,14 +92,17 @@ def handler(event, context):
                 primary_key = [('file_url', url)]
 
                 # 1. 先读取行
-                _, row, _ = ots_client.get_row(TABLE_NAME, primary_key, columns_to_get=['tags'])
+                _, row, _ = ots_client.get_row(TABLE_NAME, primary_key,
+                                               columns_to_get=['tags', 'thumbnail_url', 'uploader', 'uploaded_at'])
 
                 current_tags = {}
+                current_cols = {}
                 if row and row.attribute_columns:
                     current_cols = {col[0]: col[1] for col in row.attribute_columns}
                     current_tags_json = current_cols.get('tags')
                     if current_tags_json:
-                        current_tags = json.loads(current_tags_json)
+                        current_tags = species_names.normalize_tags(json.loads(current_tags_json))
+                old_tags = dict(current_tags)
 
                 # 2. 根据操作修改标签
                 if operation == 1:
@@ -99,11 +115,20 @@ def handler(event, context):
                             if current_tags[species] <= 0:
                                 del current_tags[species]
 
-                # 3. 写回数据库
-                update_of_attribute_columns = {'PUT': [('tags', json.dumps(current_tags))]}
+                # 3. 写回数据库；手动修改标签后删除模型的 detections 列，min_confidence 查询改为使用 tags；
+                #    tags_source='manual' 标记为人工标签，retag_backfill.py 升级模型时不会覆盖
+                update_of_attribute_columns = {'PUT': [('tags', json.dumps(current_tags)), ('tags_source', 'manual')],
+                                               'DELETE_ALL': ['detections']}
                 update_row = Row(primary_key, update_of_attribute_columns)
                 condition = Condition(RowExistenceExpectation.IGNORE)
                 ots_client.update_row(TABLE_NAME, update_row, condition)
+                # 同步物种倒排表 species_index
+                species_index.sync(ots_client, url, old_tags, current_tags, current_cols.get('thumbnail_url'))
+                uploader_index.put(ots_client, url, current_cols.get('uploader'), current_cols.get('uploaded_at'),
+                                   current_tags, current_cols.get('thumbnail_url'))
+                time_index.sync(ots_client, url, current_cols.get('uploaded_at'), species_index.species_counts(old_tags),
+                                species_index.species_counts(current_tags), tags=current_tags,
+                                thumbnail_url=current_cols.get('thumbnail_url'))
 
                 updated_count += 1
             except Exception as e:
@@ -111,7 +136,11 @@ def handler(event, context):
                 traceback.print_exc()
                 errors.append(f"Failed to update {url}")
 
-        # 4. 返回操作结果
+        # 4. 返回操作结果；标签有变化时更新目录版本，使缓存的查询结果失效
+        if updated_count:
+            catalog_version.bump(ots_client)
+        trace.incr('rows_updated', updated_count)
+        trace.phase('serialize')
         response_body = {
             "message": f"Operation completed. {updated_count} items updated successfully.",
             "errors": errors
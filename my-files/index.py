@@ -0,0 +1,114 @@
+# index.py for my-files function
+# 分页列出当前登录用户上传的文件，最新的在前；只读取 uploader_index 中该用户的主键区间，不扫描 media_metadata。
+import base64
+import binascii
+import json
+import time
+import traceback
+from tablestore import *
+import tracing
+import uploader_index
+
+# --- 请确保这些配置与你之前的函数一致 ---
+OTS_ENDPOINT = "https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com"
+OTS_INSTANCE_NAME = "n01xiizqc116"
+SESSION_TABLE_NAME = 'sessions'
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+# ---------------------------------------------
+
+def _encode_cursor(after):
+    raw = json.dumps(list(after), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    """Returns (uploaded_at, file_url) of the last entry of the previous page."""
+    try:
+        uploaded_at, file_url = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(uploaded_at, int) or not isinstance(file_url, str):
+            raise ValueError("unexpected cursor contents")
+        return uploaded_at, file_url
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+@tracing.traced('my-files')
+def handler(event, context):
+    print(f"Received event: {event}")
+    trace = tracing.current()
+    trace.phase('parse')
+
+    # 步骤一：【必须先做】解析事件，确保 event_dict 存在
+    try:
+        event_str = event.decode('utf-8')
+        event_dict = json.loads(event_str)
+    except Exception as e:
+        print(f"FATAL: Could not parse event data. Error: {e}")
+        return {"statusCode": 400, "body": json.dumps({"error": "Failed to parse event data."})}
+
+    # 步骤二：【第二步】进行Token验证
+    trace.phase('auth')
+    try:
+        headers = event_dict.get('headers', {})
+        token = headers.get('authorization') or headers.get('Authorization')
+        if not token:
+            raise ValueError("Authorization token is missing.")
+
+        creds = context.credentials
+        ots_client = trace.wrap_ots(OTSClient(end_point=OTS_ENDPOINT, access_key_id=creds.access_key_id,
+                                              access_key_secret=creds.access_key_secret,
+                                              instance_name=OTS_INSTANCE_NAME, sts_token=creds.security_token))
+
+        session_pk = [('token', token)]
+        _, row, _ = ots_client.get_row(SESSION_TABLE_NAME, session_pk, columns_to_get=['user_email', 'expires_at'])
+
+        if not row or not row.attribute_columns:
+            raise ValueError("Invalid token.")
+
+        session_info = {col[0]: col[1] for col in row.attribute_columns}
+        expires_at = session_info.get('expires_at')
+
+        if not expires_at or time.time() > expires_at:
+            ots_client.delete_row(SESSION_TABLE_NAME, Row(session_pk))
+            raise ValueError("Token has expired.")
+
+        current_user_email = session_info.get('user_email')
+        print(f"Token validation successful for user: {current_user_email}")
+
+    except Exception as e:
+        # Token 验证失败，返回 401
+        print(f"Authorization failed: {e}")
+        return {"statusCode": 401, "body": json.dumps({"error": f"Unauthorized: {e}"})}
+
+    # 步骤三：【Token验证通过后】才执行业务逻辑
+    trace.phase('query')
+    try:
+        query_params = event_dict.get('queryParameters', {}) or {}
+        limit = int(query_params.get('limit') or DEFAULT_PAGE_SIZE)
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}.")
+        after = _decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+    except ValueError as e:
+        return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+    try:
+        files, next_after = uploader_index.list_page(ots_client, current_user_email, limit, after)
+        print(f"Listed {len(files)} files for {current_user_email}.")
+        trace.incr('rows_matched', len(files))
+
+        trace.phase('serialize')
+        response_body = {"files": files, "next_cursor": _encode_cursor(next_after) if next_after else None}
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json", "Content-Disposition": "inline"},
+            "body": json.dumps(response_body)
+        }
+
+    except Exception as e:
+        print(f"An error occurred during business logic execution: {e}")
+        traceback.print_exc()
+        return {"statusCode": 500, "body": json.dumps({"error": "An internal error occurred."})}
@@ -0,0 +1,95 @@
+# uploader_index.py
+# Per-uploader listing of media: one row per file in the uploader_index table.
+#
+# process-upload, manage-tags, delete-files, query-files, query-by-count, my-files and export-catalog
+# carry identical copies of this file. The writers keep one entry per media_metadata row that has an uploader:
+#   PK: uploader (STRING), uploaded_at (INTEGER, ms since epoch), file_url (STRING)
+#   attributes: tags (JSON, as in media_metadata), thumbnail_url (STRING, if the file has one)
+# so a user's library is a single range read on the uploader prefix, newest first when read
+# BACKWARD. Rows written before uploaded_at existed are indexed with uploaded_at = 0 and therefore
+# list last.
+import json
+from tablestore import *
+
+UPLOADER_INDEX_TABLE = 'uploader_index'
+PAGE_LIMIT = 5000
+
+
+def _key(uploader, uploaded_at, file_url):
+    return [('uploader', uploader), ('uploaded_at', int(uploaded_at or 0)), ('file_url', file_url)]
+
+
+def put(ots_client, file_url, uploader, uploaded_at, tags, thumbnail_url=None):
+    """Writes (or overwrites) the entry of one file; files without an uploader are not indexed."""
+    if not uploader:
+        return False
+    columns = [('tags', tags if isinstance(tags, str) else json.dumps(tags or {}))]
+    if thumbnail_url:
+        columns.append(('thumbnail_url', thumbnail_url))
+    ots_client.put_row(UPLOADER_INDEX_TABLE, Row(_key(uploader, uploaded_at, file_url), columns))
+    return True
+
+
+def delete(ots_client, file_url, uploader, uploaded_at):
+    if not uploader:
+        return False
+    ots_client.delete_row(UPLOADER_INDEX_TABLE, Row(_key(uploader, uploaded_at, file_url)),
+                          Condition(RowExistenceExpectation.IGNORE))
+    return True
+
+
+def _entry(row):
+    pk = dict(row.primary_key)
+    columns = {col[0]: col[1] for col in row.attribute_columns}
+    return {
+        'file_url': pk['file_url'],
+        'uploaded_at': pk['uploaded_at'] or None,
+        'thumbnail_url': columns.get('thumbnail_url'),
+        'tags': json.loads(columns['tags']) if columns.get('tags') else {},
+    }
+
+
+def list_page(ots_client, uploader, limit, after=None):
+    """
+    One page of an uploader's files, newest first.
+
+    Parameters:
+        after (tuple): (uploaded_at, file_url) of the last entry of the previous page, or None.
+
+    Returns:
+        tuple: (entries, next_after) where next_after is None on the last page.
+    """
+    if after is None:
+        start = [('uploader', uploader), ('uploaded_at', INF_MAX), ('file_url', INF_MAX)]
+    else:
+        # BACKWARD ranges include their start key, which is the last entry of the previous page.
+        start = _key(uploader, after[0], after[1])
+    end = [('uploader', uploader), ('uploaded_at', INF_MIN), ('file_url', INF_MIN)]
+    skip = (int(after[0] or 0), after[1]) if after is not None else None
+    entries = []
+    while start is not None and len(entries) < limit:
+        _, start, rows, _ = ots_client.get_range(UPLOADER_INDEX_TABLE, Direction.BACKWARD, start, end,
+                                                 limit=limit - len(entries) + (skip is not None))
+        for row in rows:
+            entry = _entry(row)
+            if skip is not None and (entry['uploaded_at'] or 0, entry['file_url']) == skip:
+                continue
+            entries.append(entry)
+        skip = None
+    more = start is not None or len(entries) > limit
+    entries = entries[:limit]
+    if not more or not entries:
+        return entries, None
+    return entries, (entries[-1]['uploaded_at'] or 0, entries[-1]['file_url'])
+
+
+def all_entries(ots_client, uploader):
+    """Every entry of an uploader, in (uploaded_at, file_url) order."""
+    start = [('uploader', uploader), ('uploaded_at', INF_MIN), ('file_url', INF_MIN)]
+    end = [('uploader', uploader), ('uploaded_at', INF_MAX), ('file_url', INF_MAX)]
+    entries = []
+    while start is not None:
+        _, start, rows, _ = ots_client.get_range(UPLOADER_INDEX_TABLE, Direction.FORWARD, start, end,
+                                                 limit=PAGE_LIMIT)
+        entries.extend(_entry(row) for row in rows)
+    return entries
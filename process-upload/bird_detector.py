@@ -0,0 +1,487 @@
+# bird_detector.py
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+# IMPORTANT: The model should be loaded only ONCE.
+# It is kept in a module-level global so that Function Compute can reuse it across invocations
+# (on a "warm" instance). The inference libraries are imported lazily on the first detection,
+# so handlers that reject a request early never pay for them.
+MODEL_PATH = './model.pt' # The model will be in the same directory in the FC environment
+
+# Inference backend: 'pytorch' runs MODEL_PATH through ultralytics; 'onnx' and 'openvino' run an
+# exported graph (see export_model.py) with NumPy pre- and post-processing and no torch import.
+# Point ONNX_MODEL_PATH at model.int8.onnx (see quantize_model.py) to serve the INT8 variant.
+DETECTOR_BACKEND = os.environ.get('DETECTOR_BACKEND', 'pytorch')
+ONNX_MODEL_PATH = os.environ.get('ONNX_MODEL_PATH', './model.onnx')
+OPENVINO_MODEL_PATH = os.environ.get('OPENVINO_MODEL_PATH', './model_openvino_model/model.xml')
+MODEL_NAMES_PATH = os.environ.get('MODEL_NAMES_PATH', './model.names.json')
+
+model = None
+class_dict = None
+_model_lock = threading.Lock()
+
+# Detections at or below this confidence are discarded before counting.
+CONFIDENCE_THRESHOLD = 0.5
+# Detections are predicted down to this floor and returned with their boxes by detect_birds_with_boxes(),
+# so stored results can be re-counted at another threshold (see detections.py) without re-inference.
+DETECTION_FLOOR = float(os.environ.get('DETECTION_FLOOR', '0.1'))
+# IoU above which overlapping boxes of the same class are merged (matches the ultralytics default).
+NMS_IOU_THRESHOLD = 0.7
+
+# Optional sliced inference for large frames with small, distant birds. The image is processed once
+# at full view and then as overlapping TILE_SIZE tiles, batched TILE_BATCH_SIZE at a time. Tiles are
+# skipped once TILE_TIME_BUDGET_MS has been spent, so the cost per image stays bounded.
+TILED_INFERENCE = os.environ.get('TILED_INFERENCE', '0') == '1'
+TILE_SIZE = int(os.environ.get('TILE_SIZE', '640'))
+TILE_OVERLAP = float(os.environ.get('TILE_OVERLAP', '0.2'))
+TILE_MIN_IMAGE_SIDE = int(os.environ.get('TILE_MIN_IMAGE_SIDE', '1280'))  # smaller images use a single pass
+TILE_BATCH_SIZE = int(os.environ.get('TILE_BATCH_SIZE', '8'))
+TILE_TIME_BUDGET_MS = int(os.environ.get('TILE_TIME_BUDGET_MS', '3000'))
+# Tiles are predicted with a lower floor so that the merge sees every candidate before the final filter.
+TILE_CONF_FLOOR = 0.25
+# Boxes of the same species are merged when the intersection covers this much of the smaller box,
+# which also catches a bird cut in half by a tile edge.
+TILE_MERGE_IOS_THRESHOLD = 0.5
+
+# Cold-start timings in milliseconds, filled in as the model is loaded and first used.
+timings = {'import_ms': None, 'model_load_ms': None, 'first_inference_ms': None}
+
+_model_version = None
+_model_version_stat = None
+
+
+class ImageDecodeError(ValueError):
+    """The bytes passed to detect_birds_in_image() are not an image OpenCV can decode."""
+
+
+def inference_settings():
+    """Returns a string identifying every setting that changes detection results for the same model."""
+    if TILED_INFERENCE:
+        return f"conf={CONFIDENCE_THRESHOLD};tiles={TILE_SIZE}/{TILE_OVERLAP}/{TILE_MIN_IMAGE_SIDE}/{TILE_TIME_BUDGET_MS}"
+    return f"conf={CONFIDENCE_THRESHOLD}"
+
+
+def active_model_path():
+    """Returns the weights file used by the configured backend."""
+    if DETECTOR_BACKEND == 'onnx':
+        return ONNX_MODEL_PATH
+    if DETECTOR_BACKEND == 'openvino':
+        return OPENVINO_MODEL_PATH
+    return MODEL_PATH
+
+
+def model_version():
+    """
+    Returns a short digest of the active weights file.
+
+    The digest is recomputed only when the file's size or mtime changes, so it is
+    cheap to call on every request and changes whenever the model file is replaced.
+    """
+    global _model_version, _model_version_stat
+    path = active_model_path()
+    st = os.stat(path)
+    stat_key = (path, st.st_size, st.st_mtime_ns)
+    if _model_version is None or _model_version_stat != stat_key:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        _model_version = sha.hexdigest()[:16]
+        _model_version_stat = stat_key
+    return _model_version
+
+
+# --- NumPy pre- and post-processing for exported YOLOv8 graphs ---
+
+def _letterbox(img, size):
+    """Resizes a BGR image to fit size x size, pads with grey and returns (NCHW float blob, gain, pad)."""
+    import cv2 as cv
+    import numpy as np
+    h, w = img.shape[:2]
+    gain = min(size / h, size / w)
+    new_w, new_h = int(round(w * gain)), int(round(h * gain))
+    pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+    resized = cv.resize(img, (new_w, new_h), interpolation=cv.INTER_LINEAR) if (new_w, new_h) != (w, h) else img
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+    canvas[top:top + new_h, left:left + new_w] = resized
+    # BGR -> RGB, HWC -> CHW, uint8 -> float32 in [0, 1]
+    blob = np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1), dtype=np.float32)[None] / 255.0
+    return blob, gain, (left, top)
+
+
+def _nms(boxes, scores, iou_threshold, metric='iou'):
+    """
+    Greedy non-maximum suppression over xyxy boxes; returns the kept indices, best score first.
+
+    metric='iou' uses intersection over union; metric='ios' uses intersection over the smaller box.
+    """
+    import numpy as np
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = w * h
+        if metric == 'ios':
+            overlap = inter / (np.minimum(areas[i], areas[rest]) + 1e-9)
+        else:
+            overlap = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[overlap <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def _postprocess(output, gain, pad, image_shape, conf_floor):
+    """
+    Decodes a raw YOLOv8 output of shape (1, 4 + num_classes, num_anchors).
+
+    Returns (xyxy, confidence, class_id) in original image coordinates after per-class NMS.
+    """
+    import numpy as np
+    preds = output[0].T  # (num_anchors, 4 + num_classes)
+    class_scores = preds[:, 4:]
+    class_id = class_scores.argmax(axis=1)
+    confidence = class_scores[np.arange(len(class_id)), class_id]
+    mask = confidence > conf_floor
+    preds, class_id, confidence = preds[mask], class_id[mask], confidence[mask]
+    if len(confidence) == 0:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64)
+
+    cx, cy, w, h = preds[:, 0], preds[:, 1], preds[:, 2], preds[:, 3]
+    xyxy = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    xyxy[:, [0, 2]] = (xyxy[:, [0, 2]] - pad[0]) / gain
+    xyxy[:, [1, 3]] = (xyxy[:, [1, 3]] - pad[1]) / gain
+    xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, image_shape[1])
+    xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, image_shape[0])
+
+    # Offset boxes by class so a single NMS pass never merges boxes of different species.
+    offsets = class_id[:, None].astype(np.float32) * float(max(image_shape[:2]) + 1)
+    keep = _nms(xyxy + offsets, confidence, NMS_IOU_THRESHOLD)
+    return xyxy[keep], confidence[keep], class_id[keep]
+
+
+class ExportedYoloModel:
+    """Runs an exported YOLOv8 graph on CPU through ONNX Runtime or OpenVINO."""
+
+    def __init__(self, backend, path, names_path):
+        if backend == 'onnx':
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+            model_input = session.get_inputs()[0]
+            input_name = model_input.name
+            self.input_size = model_input.shape[2] if isinstance(model_input.shape[2], int) else 640
+            self.batch_size = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+            self._run = lambda blob: session.run(None, {input_name: blob})[0]
+        elif backend == 'openvino':
+            import openvino as ov
+            compiled = ov.Core().compile_model(path, 'CPU')
+            output = compiled.output(0)
+            self.input_size = int(compiled.input(0).shape[2])
+            self.batch_size = int(compiled.input(0).shape[0])
+            self._run = lambda blob: compiled(blob)[output]
+        else:
+            raise ValueError(f"Unknown detector backend: {backend}")
+        with open(names_path, 'r', encoding='utf-8') as f:
+            self.names = {int(k): v for k, v in json.load(f).items()}
+
+    def predict_batch(self, imgs, conf_floor):
+        """Runs several BGR images, in as few graph calls as the exported batch size allows."""
+        import numpy as np
+        letterboxed = [_letterbox(img, self.input_size) for img in imgs]
+        step = self.batch_size or len(imgs)
+        results = []
+        for i in range(0, len(imgs), step):
+            chunk = letterboxed[i:i + step]
+            blob = np.concatenate([blob for blob, _, _ in chunk])
+            if len(chunk) < step:
+                # Static-batch graphs need a full batch; pad with empty frames and ignore their output.
+                blob = np.concatenate([blob, np.zeros((step - len(chunk),) + blob.shape[1:], blob.dtype)])
+            output = self._run(blob)
+            for j, (_, gain, pad) in enumerate(chunk):
+                results.append(_postprocess(output[j:j + 1], gain, pad, imgs[i + j].shape, conf_floor))
+        return results
+
+
+def _load_backend(backend):
+    """Imports the libraries for `backend` and loads its weights. Returns (model, class names, import end time)."""
+    if backend == 'pytorch':
+        from ultralytics import YOLO
+        imported = time.time()
+        loaded_model = YOLO(MODEL_PATH)
+        return loaded_model, loaded_model.names, imported
+    imported = time.time()
+    path = ONNX_MODEL_PATH if backend == 'onnx' else OPENVINO_MODEL_PATH
+    loaded_model = ExportedYoloModel(backend, path, MODEL_NAMES_PATH)
+    return loaded_model, loaded_model.names, imported
+
+
+def get_model():
+    """Imports the detection libraries and loads the configured backend on first use."""
+    global model, class_dict
+    if model is None:
+        with _model_lock:
+            if model is None:
+                start = time.time()
+                loaded_model, names, imported = _load_backend(DETECTOR_BACKEND)
+                class_dict = names
+                model = loaded_model
+                timings['import_ms'] = round((imported - start) * 1000, 1)
+                timings['model_load_ms'] = round((time.time() - imported) * 1000, 1)
+                print(f"[cold-start] backend={DETECTOR_BACKEND} {json.dumps(timings)}")
+    return model
+
+
+def set_backend(backend):
+    """Switches to another backend; the new model is loaded on the next detection."""
+    global DETECTOR_BACKEND, model, class_dict, _model_version
+    with _model_lock:
+        DETECTOR_BACKEND = backend
+        model = None
+        class_dict = None
+        _model_version = None
+        for key in timings:
+            timings[key] = None
+
+
+def _predict_batch(imgs, conf_floor):
+    """Runs the loaded model on decoded BGR images and returns one (xyxy, confidence, class_id) per image."""
+    if DETECTOR_BACKEND == 'pytorch':
+        import supervision as sv
+        results = []
+        for result in model(imgs, verbose=False, conf=conf_floor):
+            detections = sv.Detections.from_ultralytics(result)
+            detections = detections[(detections.confidence > conf_floor)]
+            results.append((detections.xyxy, detections.confidence, detections.class_id))
+        return results
+    return model.predict_batch(imgs, conf_floor)
+
+
+def _predict(img, conf_floor):
+    """Runs the loaded model on a decoded BGR image and returns (xyxy, confidence, class_id)."""
+    return _predict_batch([img], conf_floor)[0]
+
+
+def _tile_origins(length, tile, stride):
+    """Start offsets of tiles covering [0, length); the last tile is aligned to the far edge."""
+    if length <= tile:
+        return [0]
+    origins = list(range(0, length - tile, stride))
+    origins.append(length - tile)
+    return origins
+
+
+def _predict_tiled(img, conf_floor):
+    """
+    Sliced inference: one full-view pass plus overlapping tiles, merged with cross-tile NMS.
+
+    Tiles are views into `img` (no copies) and are batched through the model. Returns
+    (xyxy, confidence, class_id) in image coordinates, filtered at conf_floor after merging.
+    """
+    import numpy as np
+    start = time.time()
+    h, w = img.shape[:2]
+    stride = max(1, int(TILE_SIZE * (1 - TILE_OVERLAP)))
+    tiles = [(x, y, img[y:y + TILE_SIZE, x:x + TILE_SIZE])
+             for y in _tile_origins(h, TILE_SIZE, stride)
+             for x in _tile_origins(w, TILE_SIZE, stride)]
+
+    parts = [_predict(img, TILE_CONF_FLOOR)]
+    done = 0
+    for i in range(0, len(tiles), TILE_BATCH_SIZE):
+        if (time.time() - start) * 1000 > TILE_TIME_BUDGET_MS:
+            print(f"[WARNING] Tile budget of {TILE_TIME_BUDGET_MS} ms reached after {done}/{len(tiles)} tiles.")
+            break
+        batch = tiles[i:i + TILE_BATCH_SIZE]
+        for (x, y, _), (xyxy, confidence, class_id) in zip(batch, _predict_batch([t for _, _, t in batch], TILE_CONF_FLOOR)):
+            parts.append((np.asarray(xyxy) + np.array([x, y, x, y], dtype=np.float32), confidence, class_id))
+        done += len(batch)
+
+    xyxy = np.concatenate([np.asarray(p[0], dtype=np.float32).reshape(-1, 4) for p in parts])
+    confidence = np.concatenate([np.asarray(p[1], dtype=np.float32).reshape(-1) for p in parts])
+    class_id = np.concatenate([np.asarray(p[2], dtype=np.int64).reshape(-1) for p in parts])
+    if len(confidence) == 0:
+        return xyxy, confidence, class_id
+
+    # Cross-tile NMS per species, then the usual confidence filter.
+    offsets = class_id[:, None].astype(np.float32) * float(max(h, w) + 1)
+    keep = _nms(xyxy + offsets, confidence, TILE_MERGE_IOS_THRESHOLD, metric='ios')
+    xyxy, confidence, class_id = xyxy[keep], confidence[keep], class_id[keep]
+    mask = confidence > conf_floor
+    return xyxy[mask], confidence[mask], class_id[mask]
+
+
+def warm_up():
+    """
+    Loads the model and runs one inference on a blank frame.
+
+    Intended for the Function Compute initializer hook so that the first real
+    request on a new instance does not pay for model loading or lazy runtime setup.
+    """
+    import numpy as np
+    get_model()
+    if timings['first_inference_ms'] is None:
+        start = time.time()
+        _predict(np.zeros((640, 640, 3), dtype=np.uint8), CONFIDENCE_THRESHOLD)
+        timings['first_inference_ms'] = round((time.time() - start) * 1000, 1)
+    print(f"[cold-start] warm-up complete: {json.dumps(timings)}")
+    return timings
+
+
+def _summarize(xyxy, confidence, class_id):
+    """({species: count} above CONFIDENCE_THRESHOLD, [(species, confidence, box)] above the floor)."""
+    if class_id is None or len(class_id) == 0:
+        return {}, []
+    names = [class_dict[int(cls_id)] for cls_id in class_id]
+    boxes = [(name, float(conf), tuple(float(v) for v in box)) for name, conf, box in zip(names, confidence, xyxy)]
+    counts = dict(Counter(name for name, conf, _ in boxes if conf > CONFIDENCE_THRESHOLD))
+    return counts, boxes
+
+
+def _detect(img):
+    """Runs the single-pass or tiled path on a decoded image, keeping everything above DETECTION_FLOOR."""
+    floor = min(DETECTION_FLOOR, CONFIDENCE_THRESHOLD)
+    if TILED_INFERENCE and max(img.shape[:2]) >= TILE_MIN_IMAGE_SIDE:
+        # Tiles are predicted at TILE_CONF_FLOOR, so nothing below it comes back from this path.
+        return _predict_tiled(img, floor)
+    return _predict(img, floor)
+
+
+def detect_birds_with_boxes(image_bytes, raise_errors=False):
+    """
+    Like detect_birds_in_image(), but also returns every detection above DETECTION_FLOOR.
+
+    Parameters:
+        image_bytes (bytes): The raw byte content of the image file.
+        raise_errors (bool): Raise instead of returning ({}, []) on failure, as detect_birds_in_image() does.
+
+    Returns:
+        tuple: ({species: count} above CONFIDENCE_THRESHOLD,
+                [(species, confidence, (x1, y1, x2, y2))] in image pixels). ({}, []) on failure.
+    """
+    try:
+        get_model()
+        import cv2 as cv
+        import numpy as np
+
+        img = cv.imdecode(np.frombuffer(image_bytes, np.uint8), cv.IMREAD_COLOR)
+        if img is None:
+            raise ImageDecodeError("Failed to decode image from bytes.")
+
+        start = time.time()
+        counts, boxes = _summarize(*_detect(img))
+        if timings['first_inference_ms'] is None:
+            timings['first_inference_ms'] = round((time.time() - start) * 1000, 1)
+            print(f"[cold-start] {json.dumps(timings)}")
+        print(f"Detection successful. Found: {counts} ({len(boxes)} boxes above {DETECTION_FLOOR})")
+        return counts, boxes
+
+    except Exception as e:
+        print(f"An error occurred during bird detection: {e}")
+        if raise_errors:
+            raise
+        return {}, []
+
+
+def detect_birds_in_image(image_bytes, raise_errors=False):
+    """
+    Detects birds in an image provided as bytes and returns a count of each species.
+
+    Parameters:
+        image_bytes (bytes): The raw byte content of the image file. Any bytes-like object
+                             (e.g. a memoryview slice of a request body) works without copying.
+        raise_errors (bool): Raise instead of returning {} when the image cannot be decoded
+                             (ImageDecodeError) or the model fails, so callers that cache the
+                             result can tell a failure from an image without birds.
+
+    Returns:
+        dict: A dictionary with detected bird names as keys and their counts as values.
+              Example: {'crow': 2, 'pigeon': 1}
+    """
+    try:
+        get_model()
+        import cv2 as cv
+        import numpy as np
+
+        # Convert bytes to a NumPy array, then decode it into an image
+        np_arr = np.frombuffer(image_bytes, np.uint8)
+        img = cv.imdecode(np_arr, cv.IMREAD_COLOR)
+
+        if img is None:
+            raise ImageDecodeError("Failed to decode image from bytes.")
+
+        # Run the model on the image and keep detections above the confidence threshold
+        start = time.time()
+        if TILED_INFERENCE and max(img.shape[:2]) >= TILE_MIN_IMAGE_SIDE:
+            _, confidence, class_id = _predict_tiled(img, CONFIDENCE_THRESHOLD)
+        else:
+            _, confidence, class_id = _predict(img, CONFIDENCE_THRESHOLD)
+        if timings['first_inference_ms'] is None:
+            timings['first_inference_ms'] = round((time.time() - start) * 1000, 1)
+            print(f"[cold-start] {json.dumps(timings)}")
+
+        if class_id is None or len(class_id) == 0:
+            return {}
+
+        # Get the names of detected classes
+        detected_class_names = [class_dict[int(cls_id)] for cls_id in class_id]
+
+        # Count the occurrences of each class name
+        bird_counts = dict(Counter(detected_class_names))
+
+        print(f"Detection successful. Found: {bird_counts}")
+        return bird_counts
+
+    except Exception as e:
+        print(f"An error occurred during bird detection: {e}")
+        if raise_errors:
+            raise
+        return {}
+
+def detect_birds_in_images(images, with_boxes=False):
+    """
+    Batched detect_birds_in_image() for offline jobs such as retag_backfill.py.
+
+    Images small enough for a single pass go through the model together; with TILED_INFERENCE on,
+    large images still take the per-image tiled path. An image that cannot be decoded yields None, so
+    callers can tell it from an image without birds.
+
+    Parameters:
+        images (list): Raw image bytes, one entry per image.
+        with_boxes (bool): Return (counts, boxes) pairs as detect_birds_with_boxes() does.
+
+    Returns:
+        list: One {species: count} dict (or pair), or None, per image, in the order of `images`.
+    """
+    get_model()
+    import cv2 as cv
+    import numpy as np
+
+    results = [None] * len(images)
+    batch = []
+    for i, image_bytes in enumerate(images):
+        img = cv.imdecode(np.frombuffer(image_bytes, np.uint8), cv.IMREAD_COLOR)
+        if img is None:
+            print(f"Failed to decode image {i} of the batch.")
+        elif TILED_INFERENCE and max(img.shape[:2]) >= TILE_MIN_IMAGE_SIDE:
+            results[i] = _summarize(*_detect(img))
+        else:
+            batch.append((i, img))
+    if batch:
+        predictions = _predict_batch([img for _, img in batch], min(DETECTION_FLOOR, CONFIDENCE_THRESHOLD))
+        for (i, _), prediction in zip(batch, predictions):
+            results[i] = _summarize(*prediction)
+    return results if with_boxes else [None if result is None else result[0] for result in results]
+
+# Note: The video prediction function is removed for simplicity in this step.
+# It can be added back later following a similar refactoring pattern.
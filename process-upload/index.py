@@ -1,40 +1,92 @@
 # index.py
 import oss2
 import json
+import os
 from tablestore import *
-from PIL import Image
+from PIL import Image, ImageOps
 import io
 import bird_detector  # Import our refactored detection module
 import time  # Import the time module for timestamps
 import traceback  # Import traceback for detailed error logging
+import tracing  # Per-invocation spans and the structured trace log line
+import species_index  # (species, file_url) postings used by query-files
+import uploader_index  # (uploader, uploaded_at, file_url) entries used by my-files
+import time_index  # (day, species, uploaded_at, file_url) rows for since/until queries
+import species_names  # Canonical species names, so tags and index keys agree with queries
+import detections  # Packed per-detection column, re-counted by queries with min_confidence
+import catalog_version  # Bumped after every write so cached query results are invalidated
 
 # --- CONFIGURATION ---
 OTS_ENDPOINT = "https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com"
 OTS_INSTANCE_NAME = "n01xiizqc116"
 TABLE_NAME = 'media_metadata'
 SESSION_TABLE_NAME = 'sessions'  # Added for authentication
+# Larger objects are not downloaded: the whole file is read into memory. Keep equal to get-upload-url's limit,
+# which signed upload URLs cannot enforce for every part of a multipart upload.
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', str(100 * 1024 * 1024)))
+
+# Thumbnail variants generated for every upload, as (name, longest side in px, PIL format, save options).
+# The first entry is also stored as 'thumbnail_url', which is what the query APIs return.
+THUMBNAIL_SPECS = [
+    ('200', 200, 'WEBP', {'quality': 80, 'method': 2}),
+    ('800', 800, 'JPEG', {'quality': 82}),
+]
+THUMBNAIL_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg', 'PNG': 'png'}
+THUMBNAIL_CONTENT_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg', 'PNG': 'image/png'}
 
 
 # ---------------------
 
-def create_thumbnail(image_bytes):
-    """Generates a 200x200 thumbnail from image bytes."""
+def initializer(context):
+    """Function Compute initializer hook: pre-warms the detection model on a new instance."""
+    bird_detector.warm_up()
+
+
+def create_thumbnails(image_bytes, specs=THUMBNAIL_SPECS):
+    """
+    Generates every thumbnail in `specs` from one decode of the image.
+
+    JPEG sources are decoded with libjpeg DCT scaling (draft mode) at the smallest scale that is
+    still at least as large as the biggest thumbnail, and EXIF orientation is applied before resizing.
+    Each smaller size is resized from the previous one rather than from the original.
+
+    Returns:
+        list: (name, format, bytes) tuples in the order of `specs`; empty if the image cannot be read.
+    """
     try:
         img = Image.open(io.BytesIO(image_bytes))
-        img.thumbnail((200, 200))
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        buffer.seek(0)
-        return buffer.getvalue()
+        largest = max(size for _, size, _, _ in specs)
+        if img.format == 'JPEG':
+            img.draft('RGB', (largest, largest))
+        if img.getexif().get(0x0112, 1) != 1:  # EXIF Orientation
+            img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+
+        rendered = {}
+        source = img
+        for name, size, fmt, options in sorted(specs, key=lambda spec: -spec[1]):
+            thumb = source.copy()
+            thumb.thumbnail((size, size), reducing_gap=2.0)
+            source = thumb
+            if fmt == 'JPEG' and thumb.mode != 'RGB':
+                thumb = thumb.convert('RGB')
+            buffer = io.BytesIO()
+            thumb.save(buffer, format=fmt, **options)
+            rendered[name] = (name, fmt, buffer.getvalue())
+        return [rendered[name] for name, _, _, _ in specs]
     except Exception as e:
-        print(f"Error creating thumbnail: {e}")
-        return None
+        print(f"Error creating thumbnails: {e}")
+        return []
 
 
+@tracing.traced('process-upload')
 def handler(event, context):
     """
     This is the main handler function that gets triggered by an OSS event.
     """
+    trace = tracing.current()
+    trace.phase('parse')
     # 1. Parse event and get OSS info
     evt = json.loads(event)
     bucket_name = evt['events'][0]['oss']['bucket']['name']
@@ -47,14 +99,15 @@ def handler(event, context):
         return "Skipped"
 
     # 2. Initialize Tablestore client for authentication
+    trace.phase('auth')
     creds = context.credentials
-    ots_client = OTSClient(
+    ots_client = trace.wrap_ots(OTSClient(
         end_point=OTS_ENDPOINT,
         access_key_id=creds.access_key_id,
         access_key_secret=creds.access_key_secret,
         instance_name=OTS_INSTANCE_NAME,
         sts_token=creds.security_token
-    )
+    ))
 
     # --- [START] NEW TOKEN AUTHENTICATION LOGIC ---
     try:
@@ -96,10 +149,18 @@ def handler(event, context):
     # --- [END] NEW TOKEN AUTHENTICATION LOGIC ---
 
     # 3. Initialize OSS client and download the file
+    trace.phase('download')
     auth = oss2.StsAuth(creds.access_key_id, creds.access_key_secret, creds.security_token)
-    bucket = oss2.Bucket(auth, f'https://oss-{region}.aliyuncs.com', bucket_name)
+    bucket = trace.wrap_bucket(oss2.Bucket(auth, f'https://oss-{region}.aliyuncs.com', bucket_name))
 
     try:
+        # The OSS event carries the object size; check it before downloading anything.
+        object_size = evt['events'][0]['oss']['object'].get('size')
+        if object_size is None:
+            object_size = bucket.head_object(object_key).content_length
+        if object_size > MAX_UPLOAD_SIZE:
+            print(f"Object {object_key} is {object_size} bytes, above MAX_UPLOAD_SIZE ({MAX_UPLOAD_SIZE}), skipping.")
+            return "Skipped: Object too large"
         print(f"Processing file: {object_key}")
         remote_stream = bucket.get_object(object_key)
         file_content = remote_stream.read()
@@ -108,41 +169,87 @@ def handler(event, context):
         return "Failed: Object not found"
 
     # 4. Process the file: Detect birds and create thumbnail
-    detected_tags = bird_detector.detect_birds_in_image(file_content)
-    thumbnail_bytes = create_thumbnail(file_content)
+    trace.phase('process')
+    detection_failed = False
+    with trace.span('inference'):
+        try:
+            model_tags, boxes = bird_detector.detect_birds_with_boxes(file_content, raise_errors=True)
+        except Exception:
+            # Saved untagged and without model_version, so retag_backfill.py picks the row up again
+            trace.incr('detection_failed')
+            detection_failed = True
+            model_tags, boxes = {}, []
+    # Store canonical names ("crow", not "Crow" / "crows") so every index key matches the query normalizer
+    detected_tags = species_names.normalize_tags(model_tags)
+    packed_detections = detections.pack([(species_names.normalize(species), confidence, box)
+                                         for species, confidence, box in boxes], bird_detector.DETECTION_FLOOR)
+    cpu_start = time.process_time()
+    with trace.span('thumbnails'):
+        thumbnails = create_thumbnails(file_content)
+    print(f"Thumbnails rendered in {(time.process_time() - cpu_start) * 1000:.1f} CPU ms: "
+          f"{', '.join(f'{name}={len(data)}B' for name, _, data in thumbnails)}")
 
-    # 5. Upload thumbnail back to OSS
+    # 5. Upload thumbnails back to OSS
+    trace.phase('store')
     thumbnail_url = None
-    if thumbnail_bytes:
-        thumbnail_key = object_key.replace('uploads/', 'thumbnails/').rsplit('.', 1)[0] + '-thumb.png'
-        bucket.put_object(thumbnail_key, thumbnail_bytes)
-        thumbnail_url = f'https://{bucket_name}.oss-{region}.aliyuncs.com/{thumbnail_key}'
+    thumbnail_urls = {}
+    thumbnail_base = object_key.replace('uploads/', 'thumbnails/').rsplit('.', 1)[0]
+    for name, fmt, data in thumbnails:
+        thumbnail_key = f'{thumbnail_base}-thumb-{name}.{THUMBNAIL_EXTENSIONS[fmt]}'
+        bucket.put_object(thumbnail_key, data, headers={'Content-Type': THUMBNAIL_CONTENT_TYPES[fmt]})
+        thumbnail_urls[name] = f'https://{bucket_name}.oss-{region}.aliyuncs.com/{thumbnail_key}'
         print(f"Thumbnail created and uploaded to: {thumbnail_key}")
+    if thumbnail_urls:
+        thumbnail_url = thumbnail_urls[THUMBNAIL_SPECS[0][0]]
 
     # 6. Save metadata to Tablestore
     original_file_url = f'https://{bucket_name}.oss-{region}.aliyuncs.com/{object_key}'
     primary_key = [('file_url', original_file_url)]
+    uploaded_at = int(time.time() * 1000)
 
     attribute_columns = [
         ('tags', json.dumps(detected_tags)),
         ('file_type', 'image'),
-        ('uploader', current_user_email)  # Add the uploader's email
+        ('uploader', current_user_email),  # Add the uploader's email
+        ('uploaded_at', uploaded_at),  # ms since epoch; also part of the uploader_index key
     ]
+    if not detection_failed:
+        # every box above DETECTION_FLOOR, for min_confidence queries
+        attribute_columns.append(('detections', packed_detections))
+        try:
+            # Rows tagged by an older model.pt are found and re-tagged by retag_backfill.py
+            attribute_columns.append(('model_version', bird_detector.model_version()))
+        except OSError as e:
+            print(f"[WARNING] Could not read the model version: {e}")
     if thumbnail_url:
         attribute_columns.append(('thumbnail_url', thumbnail_url))
+        attribute_columns.append(('thumbnails', json.dumps(thumbnail_urls)))
 
     row = Row(primary_key, attribute_columns)
     try:
+        # An earlier upload to the same key, so its index entries can be replaced
+        _, old_row, _ = ots_client.get_row(TABLE_NAME, primary_key, columns_to_get=['tags', 'uploader', 'uploaded_at'])
+        old = {col[0]: col[1] for col in old_row.attribute_columns} if old_row and old_row.attribute_columns else {}
         ots_client.put_row(TABLE_NAME, row)  # The condition is not needed for put_row
+        species_index.sync(ots_client, original_file_url, old.get('tags'), detected_tags, thumbnail_url)
+        uploader_index.delete(ots_client, original_file_url, old.get('uploader'), old.get('uploaded_at'))
+        uploader_index.put(ots_client, original_file_url, current_user_email, uploaded_at, detected_tags, thumbnail_url)
+        time_index.sync(ots_client, original_file_url, old.get('uploaded_at'),
+                        species_index.species_counts(old.get('tags') or {}), None)
+        time_index.sync(ots_client, original_file_url, uploaded_at, None, species_index.species_counts(detected_tags),
+                        tags=detected_tags, thumbnail_url=thumbnail_url)
+        catalog_version.bump(ots_client)
         print(f"Successfully saved metadata to Tablestore for: {original_file_url}")
     except Exception as e:
         print(f"Error saving metadata to Tablestore: {e}")
         return "Failed: Could not save metadata"
 
     # 7. Check subscriptions and generate notifications
+    trace.phase('notify')
     try:
         print("Checking subscriptions to generate notifications...")
-        for tag in detected_tags.keys():
+        # Subscriptions are keyed by the model's class names, so look them up with those
+        for tag in model_tags.keys():
             inclusive_start_primary_key = [('tag', tag), ('user_email', INF_MIN)]
             exclusive_end_primary_key = [('tag', tag), ('user_email', INF_MAX)]
 
@@ -159,6 +266,7 @@ def handler(event, context):
                     notification_row = Row(notification_pk, notification_cols)
                     condition = Condition(RowExistenceExpectation.IGNORE)
                     ots_client.put_row('notifications', notification_row, condition)
+                    trace.incr('notifications')
                     print(f"Successfully created notification for {recipient_email} for tag '{tag}'.")
     except Exception as e:
         print(f"[WARNING] Failed to generate notifications: {e}")
@@ -0,0 +1,94 @@
+# species_index.py
+# Postings for species queries: one row per (species, file_url) in the species_index table.
+#
+# process-upload, manage-tags, delete-files, query-files and export-catalog carry identical copies of
+# this file. The writers call sync() whenever a media_metadata row's tags change, so the table always
+# holds exactly one posting per species of every file:
+#   PK: species (STRING, canonical name from species_names.normalize), file_url (STRING)
+#   attributes: count (INTEGER), thumbnail_url (STRING, if the file has one)
+# query-files reads the postings of one species with a single get_range over (species, *); rows come
+# back in file_url order, which is what the sorted-list merges in species_query.py rely on.
+import json
+import os
+from tablestore import *
+import species_names
+
+SPECIES_INDEX_TABLE = os.environ.get('SPECIES_INDEX_TABLE', 'species_index')
+POSTINGS_PAGE_LIMIT = 5000
+
+
+def normalize(species):
+    return species_names.normalize(species)
+
+
+def species_counts(tags):
+    """
+    Normalized {species: count} from a tags value as stored in media_metadata.
+
+    Accepts the JSON string, a {species: count} dict or a plain list of species; names with the same
+    canonical form ("Crows", "house crow", "crow") are merged.
+    """
+    if isinstance(tags, (bytes, str)):
+        try:
+            tags = json.loads(tags)
+        except ValueError:
+            return {}
+    counts = {}
+    if isinstance(tags, dict):
+        for species, count in tags.items():
+            key = normalize(species)
+            if key:
+                counts[key] = counts.get(key, 0) + (count if isinstance(count, int) else 1)
+    elif isinstance(tags, list):
+        for species in tags:
+            key = normalize(species)
+            if key:
+                counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def sync(ots_client, file_url, old_tags, new_tags, thumbnail_url=None):
+    """
+    Brings the postings of `file_url` from `old_tags` to `new_tags` (either may be None).
+
+    Only species whose count changed are written, so re-saving unchanged tags costs nothing.
+
+    Returns:
+        tuple: (written, deleted) posting counts.
+    """
+    old = species_counts(old_tags) if old_tags is not None else {}
+    new = species_counts(new_tags) if new_tags is not None else {}
+    written = deleted = 0
+    for species, count in new.items():
+        if old.get(species) == count:
+            continue
+        columns = [('count', count)]
+        if thumbnail_url:
+            columns.append(('thumbnail_url', thumbnail_url))
+        ots_client.put_row(SPECIES_INDEX_TABLE, Row([('species', species), ('file_url', file_url)], columns))
+        written += 1
+    for species in old:
+        if species not in new:
+            ots_client.delete_row(SPECIES_INDEX_TABLE, Row([('species', species), ('file_url', file_url)]),
+                                  Condition(RowExistenceExpectation.IGNORE))
+            deleted += 1
+    return written, deleted
+
+
+def postings(ots_client, species, columns_to_get=('thumbnail_url',)):
+    """
+    Every posting of one species.
+
+    Returns:
+        list: (file_url, {column: value}) tuples sorted by file_url.
+    """
+    key = normalize(species)
+    start = [('species', key), ('file_url', INF_MIN)]
+    end = [('species', key), ('file_url', INF_MAX)]
+    out = []
+    while start is not None:
+        _, start, rows, _ = ots_client.get_range(SPECIES_INDEX_TABLE, Direction.FORWARD, start, end,
+                                                 columns_to_get=list(columns_to_get), limit=POSTINGS_PAGE_LIMIT)
+        for row in rows:
+            out.append((row.primary_key[1][1], {col[0]: col[1] for col in row.attribute_columns}))
+    return out
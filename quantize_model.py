@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+INT8 post-training quantization for the exported bird detector.
+
+Calibrates model.onnx on test_images/ plus any extra directories, writes model.int8.onnx and
+then compares the INT8 model against the FP32 model on the same images:
+    - per-species count agreement
+    - per-image latency (p50 / p95)
+    - model file size and resident memory after loading
+
+Deploy the quantized model with the ONNX backend:
+    DETECTOR_BACKEND=onnx  ONNX_MODEL_PATH=./model.int8.onnx
+
+运行方式：
+    python export_model.py --weights search-by-file/model.pt
+    python quantize_model.py --calib-dir /path/to/more/birds --report quant_report.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+
+def hr(title: str = "", char: str = "-"):
+    line = char * 70
+    print(f"\n{line}\n{title}\n{line}" if title else f"\n{line}")
+
+
+def list_images(directories: List[str]) -> List[str]:
+    paths = []
+    for directory in directories:
+        for pattern in IMAGE_PATTERNS:
+            paths.extend(glob.glob(os.path.join(directory, "**", pattern), recursive=True))
+    return sorted(set(paths))
+
+
+def rss_mb():
+    """Resident set size of this process in MB (Linux only), or None."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class ImageCalibrationReader:
+    """Feeds letterboxed calibration images to onnxruntime's static quantizer."""
+
+    def __init__(self, detector, model_path: str, image_paths: List[str]):
+        import cv2 as cv
+        import onnxruntime as ort
+        session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        model_input = session.get_inputs()[0]
+        size = model_input.shape[2] if isinstance(model_input.shape[2], int) else 640
+        self._input_name = model_input.name
+        self._blobs = []
+        for path in image_paths:
+            img = cv.imread(path, cv.IMREAD_COLOR)
+            if img is not None:
+                self._blobs.append(detector._letterbox(img, size)[0])
+        self._iter = iter(self._blobs)
+
+    def get_next(self):
+        blob = next(self._iter, None)
+        return None if blob is None else {self._input_name: blob}
+
+    def rewind(self):
+        self._iter = iter(self._blobs)
+
+
+def quantize(detector, fp32_path: str, int8_path: str, calib_paths: List[str]):
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepared_path = fp32_path.replace(".onnx", ".prep.onnx")
+    quant_pre_process(fp32_path, prepared_path)
+    reader = ImageCalibrationReader(detector, prepared_path, calib_paths)
+    print(f"[量化] calibrating on {len(reader._blobs)} images ...")
+    quantize_static(
+        prepared_path,
+        int8_path,
+        reader,
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    os.remove(prepared_path)
+    print(f"[量化] INT8 model -> {int8_path}")
+
+
+def evaluate(detector, model_path: str, image_paths: List[str]) -> dict:
+    detector.ONNX_MODEL_PATH = model_path
+    detector.set_backend("onnx")
+    rss_before = rss_mb()
+    detector.warm_up()
+    rss_after = rss_mb()
+
+    counts: Dict[str, dict] = {}
+    latencies_ms: List[float] = []
+    for path in image_paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        t0 = time.perf_counter()
+        counts[os.path.basename(path)] = detector.detect_birds_in_image(data)
+        latencies_ms.append((time.perf_counter() - t0) * 1000)
+
+    latencies_ms.sort()
+    return {
+        "model": os.path.basename(model_path),
+        "file_mb": round(os.path.getsize(model_path) / 1024 / 1024, 2),
+        "rss_delta_mb": round(rss_after - rss_before, 1) if rss_before is not None else None,
+        "latency_p50_ms": round(statistics.median(latencies_ms), 1),
+        "latency_p95_ms": round(latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.95))], 1),
+        "counts": counts,
+    }
+
+
+def species_agreement(reference: Dict[str, dict], candidate: Dict[str, dict]) -> dict:
+    """For each species, the fraction of images (where either model saw it) with identical counts."""
+    seen: Dict[str, int] = {}
+    agreed: Dict[str, int] = {}
+    for name, ref_counts in reference.items():
+        cand_counts = candidate.get(name, {})
+        for species in set(ref_counts) | set(cand_counts):
+            seen[species] = seen.get(species, 0) + 1
+            if ref_counts.get(species, 0) == cand_counts.get(species, 0):
+                agreed[species] = agreed.get(species, 0) + 1
+    return {species: round(agreed.get(species, 0) / total, 3) for species, total in sorted(seen.items())}
+
+
+def main():
+    p = argparse.ArgumentParser(description="INT8 quantization and FP32 comparison for bird_detector")
+    p.add_argument("--model-dir", default=os.path.join(ROOT, "search-by-file"), help="Directory holding model.onnx and model.names.json")
+    p.add_argument("--calib-dir", nargs="*", default=[], help="Extra calibration image directories")
+    p.add_argument("--eval-dir", default=os.path.join(ROOT, "test_images"), help="Images used for the comparison report")
+    p.add_argument("--skip-quantize", action="store_true", help="Only rebuild the report from an existing model.int8.onnx")
+    p.add_argument("--report", help="Write the report as JSON to this path")
+    args = p.parse_args()
+
+    model_dir = os.path.abspath(args.model_dir)
+    sys.path.insert(0, model_dir)
+    import bird_detector
+    bird_detector.MODEL_NAMES_PATH = os.path.join(model_dir, "model.names.json")
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    int8_path = os.path.join(model_dir, "model.int8.onnx")
+
+    if not args.skip_quantize:
+        calib_paths = list_images([os.path.join(ROOT, "test_images")] + args.calib_dir)
+        if not calib_paths:
+            print("[错误] No calibration images found.")
+            sys.exit(1)
+        quantize(bird_detector, fp32_path, int8_path, calib_paths)
+
+    eval_paths = list_images([args.eval_dir])
+    fp32 = evaluate(bird_detector, fp32_path, eval_paths)
+    int8 = evaluate(bird_detector, int8_path, eval_paths)
+    agreement = species_agreement(fp32["counts"], int8["counts"])
+    exact = sum(1 for name in fp32["counts"] if fp32["counts"][name] == int8["counts"].get(name)) / max(1, len(eval_paths))
+
+    hr("INT8 vs FP32 报告", "=")
+    for label, result in (("FP32", fp32), ("INT8", int8)):
+        print(f"{label}: file {result['file_mb']} MB | RSS +{result['rss_delta_mb']} MB | "
+              f"p50 {result['latency_p50_ms']} ms | p95 {result['latency_p95_ms']} ms")
+    print(f"\nspeed-up (p50)       : {fp32['latency_p50_ms'] / max(int8['latency_p50_ms'], 1e-6):.2f}x")
+    print(f"exact image matches  : {exact:.1%}")
+    print("per-species agreement:")
+    for species, rate in agreement.items():
+        print(f"{species:>20}: {rate:.1%}")
+
+    if args.report:
+        report = {"fp32": fp32, "int8": int8, "species_agreement": agreement, "exact_image_match": round(exact, 3)}
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n[报告] -> {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# detections.py
+# Packed per-detection records, so species counts can be recomputed at any confidence without
+# running the model again.
+#
+# process-upload, query-files and query-by-count carry identical copies of this file. process-upload
+# stores every detection above bird_detector.DETECTION_FLOOR in the 'detections' BINARY column of
+# media_metadata, next to the tags counted at bird_detector.CONFIDENCE_THRESHOLD:
+#   header   b'BD', version (uint8), floor (float16), label bytes (uint16)
+#   labels   canonical species names, UTF-8, '\n'-separated
+#   records  RECORD_DTYPE: label index (uint16), confidence (float16), box x1, y1, x2, y2 (uint16, px)
+# All little-endian; 12 bytes per detection. manage-tags drops the column when tags are edited by
+# hand, and rows without it fall back to their tags.
+#
+# min_confidence keeps detections with confidence > min_confidence, the same strict comparison the
+# stored tags use against CONFIDENCE_THRESHOLD, so min_confidence=0.5 reproduces the tags. Confidences
+# are rounded up to the next float16 when packed (not to the nearest), so a confidence just above a
+# threshold that float16 represents exactly, such as 0.5, still compares above it. Values below
+# the stored floor are rejected: DETECTION_FLOOR here must match process-upload's. With TILED_INFERENCE=1
+# on process-upload (set it here too), large images are predicted at TILE_CONF_FLOOR and nothing below it
+# is stored for them, so the floor becomes max(DETECTION_FLOOR, TILE_CONF_FLOOR).
+import math
+import os
+import struct
+
+MAGIC = b'BD'
+VERSION = 1
+DETECTION_FLOOR = float(os.environ.get('DETECTION_FLOOR', '0.1'))
+TILE_CONF_FLOOR = 0.25  # bird_detector.TILE_CONF_FLOOR
+TILED_INFERENCE = os.environ.get('TILED_INFERENCE', '0') == '1'
+_HEADER = struct.Struct('<2sBeH')
+_RECORD_FIELDS = [('label', '<u2'), ('confidence', '<f2'), ('box', '<u2', (4,))]
+
+_dtype = None
+
+
+def _float16_up(values):
+    """`values` as float16, rounded up: the result is never below the input."""
+    import numpy as np
+    values = np.asarray(values, dtype=np.float64)
+    rounded = values.astype(np.float16)
+    return np.where(rounded < values, np.nextafter(rounded, np.float16(np.inf)), rounded)
+
+
+def record_dtype():
+    """The NumPy dtype of one packed record (NumPy is imported on first use)."""
+    global _dtype
+    if _dtype is None:
+        import numpy as np
+        _dtype = np.dtype(_RECORD_FIELDS)
+    return _dtype
+
+
+def pack(detections, floor):
+    """
+    Packs (species, confidence, (x1, y1, x2, y2)) tuples into the binary column format.
+
+    Species names are stored as given, so pass them normalized. Box coordinates are clipped to 0..65535.
+
+    Returns:
+        bytearray: The column value (the Tablestore SDK writes bytearray as BINARY).
+    """
+    import numpy as np
+    names = [species for species, _, _ in detections]
+    labels = list(dict.fromkeys(names))
+    index = {species: i for i, species in enumerate(labels)}
+    records = np.zeros(len(detections), dtype=record_dtype())
+    records['label'] = [index[species] for species in names]
+    records['confidence'] = _float16_up([confidence for _, confidence, _ in detections])
+    boxes = np.asarray([box for _, _, box in detections], dtype=np.float32).reshape(-1, 4)
+    records['box'] = np.clip(np.rint(boxes), 0, 0xFFFF)
+    label_bytes = '\n'.join(labels).encode('utf-8')
+    return bytearray(_HEADER.pack(MAGIC, VERSION, floor, len(label_bytes)) + label_bytes + records.tobytes())
+
+
+def unpack(blob):
+    """
+    Returns (labels, records, floor) from a packed column value; records is a read-only NumPy view.
+
+    Raises:
+        ValueError: If the value is not in this format.
+    """
+    import numpy as np
+    blob = bytes(blob)
+    if len(blob) < _HEADER.size:
+        raise ValueError("Detections column is too short.")
+    magic, version, floor, label_length = _HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unknown detections format {magic!r} v{version}.")
+    start = _HEADER.size + label_length
+    labels = blob[_HEADER.size:start].decode('utf-8').split('\n') if label_length else []
+    records = np.frombuffer(blob, dtype=record_dtype(), offset=start)
+    return labels, records, floor
+
+
+def counts(blob, min_confidence):
+    """{species: count} of the detections with confidence > min_confidence."""
+    import numpy as np
+    labels, records, _ = unpack(blob)
+    kept = records['label'][records['confidence'] > _float16_up(min_confidence)]
+    totals = np.bincount(kept, minlength=len(labels))
+    return {labels[i]: int(n) for i, n in enumerate(totals) if n}
+
+
+def stored_floor():
+    """The lowest confidence stored for every row, and so the lowest min_confidence a query may ask for."""
+    return max(DETECTION_FLOOR, TILE_CONF_FLOOR) if TILED_INFERENCE else DETECTION_FLOOR
+
+
+def parse_min_confidence(query_params):
+    """
+    The 'min_confidence' query parameter as a float in [stored_floor(), 1], or None if absent.
+
+    Raises:
+        ValueError: If the value is not a finite number, above 1, or below the stored floor (detections
+                    under it were never stored, so the counts would silently miss them).
+    """
+    value = query_params.get('min_confidence')
+    if value in (None, ''):
+        return None
+    floor = stored_floor()
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'min_confidence' must be a number between {floor} and 1.")
+    if not math.isfinite(value) or value > 1:
+        raise ValueError(f"'min_confidence' must be a number between {floor} and 1.")
+    if value < floor:
+        name = 'TILE_CONF_FLOOR' if floor > DETECTION_FLOOR else 'DETECTION_FLOOR'
+        raise ValueError(f"'min_confidence' must be at least {floor} ({name}): detections below it are not stored.")
+    return value
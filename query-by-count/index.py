@@ -1,18 +1,33 @@
 # index.py for query-by-count function
 import json
+import os
 import time  # <--- 新增导入
 from tablestore import *
+import tracing
+import scan_budget
+import parallel_scan
+import uploader_index
+import time_index
+import species_names
+import detections
+import query_cache
 
 # --- 请确保这些配置与你之前的函数一致 ---
 OTS_ENDPOINT = "https://n01xiizqc116.cn-hangzhou.ots-internal.aliyuncs.com"  # <--- 注意：这里建议使用 ots-internal 地址
 OTS_INSTANCE_NAME = "n01xiizqc116"
 TABLE_NAME = 'media_metadata'
+# 0 (default): the uploader filter scans media_metadata; 1: read the caller's rows from uploader_index. Set it
+# to 1 only after build_indexes.py has filled uploader_index, or the filter misses every row not yet indexed.
+UPLOADER_INDEX_ENABLED = os.environ.get('UPLOADER_INDEX_ENABLED', '0') == '1'
 
 
 # ---------------------------------------------
 
+@tracing.traced('query-by-count')
 def handler(event, context):
     print(f"Received event: {event}")
+    trace = tracing.current()
+    trace.phase('parse')
 
     # 步骤一：【必须先做】解析事件
     try:
@@ -22,6 +37,7 @@ def handler(event, context):
         return {"statusCode": 400, "body": json.dumps({"error": f"Failed to parse event data: {e}"})}
 
     # 步骤二：【第二步】进行Token验证
+    trace.phase('auth')
     try:
         headers = event_dict.get('headers', {})
         token = headers.get('authorization') or headers.get('Authorization')
@@ -29,13 +45,13 @@ def handler(event, context):
             raise ValueError("Authorization token is missing.")
 
         creds = context.credentials
-        ots_client = OTSClient(
+        ots_client = trace.wrap_ots(OTSClient(
             end_point=OTS_ENDPOINT,
             access_key_id=creds.access_key_id,
             access_key_secret=creds.access_key_secret,
             instance_name=OTS_INSTANCE_NAME,
             sts_token=creds.security_token
-        )
+        ))
 
         session_pk = [('token', token)]
         _, row, _ = ots_client.get_row('sessions', session_pk, columns_to_get=['user_email', 'expires_at'])
@@ -59,63 +75,134 @@ def handler(event, context):
         return {"statusCode": 401, "body": json.dumps({"error": f"Unauthorized: {e}"})}
 
     # 步骤三：【Token验证通过后】才执行业务逻辑
+    trace.phase('query')
 
     # 1. 从POST请求的body中解析查询条件
     try:
         query_tags = json.loads(event_dict.get('body', '{}'))
         if not query_tags or not isinstance(query_tags, dict):
             raise ValueError("Query tags must be a non-empty JSON object.")
+        if not all(isinstance(count, int) for count in query_tags.values()):
+            raise ValueError("Counts must be integers.")
+        # 查询条件与库中标签都统一为规范物种名后再比较
+        query_tags = species_names.normalize_tags(query_tags)
     except (json.JSONDecodeError, ValueError) as e:
         return {"statusCode": 400, "body": json.dumps({"error": f"Invalid request body: {e}"})}
 
     print(f"Searching for files matching counts: {query_tags}")
 
-    # 2. 扫描全表并根据数量要求进行过滤 (注意: ots_client 已在上面初始化，无需重复)
-    results = []
+    # 游标：上一次请求因预算耗尽而中断时返回的 next_cursor（通过查询参数传回），记录了尚未读取的主键区间
+    query_params = event_dict.get('queryParameters', {}) or {}
+    ranges = None
+    if query_params.get('cursor'):
+        try:
+            ranges = scan_budget.decode_cursor(query_params['cursor'], ['file_url'])
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+    # uploader=<email> 只统计该用户上传的文件；uploader=me 表示当前登录用户
+    uploader = query_params.get('uploader')
+    if uploader == 'me':
+        uploader = current_user_email
+    # since/until 限定上传时间（毫秒时间戳或 ISO 8601，until 不含、默认为当前时间）
     try:
-        inclusive_start_primary_key = [('file_url', INF_MIN)]
-        exclusive_end_primary_key = [('file_url', INF_MAX)]
-
-        # 使用循环来处理可能有多页的扫描结果
-        while True:
-            consumed, next_start_primary_key, row_list, next_token = ots_client.get_range(
-                TABLE_NAME,
-                Direction.FORWARD,
-                inclusive_start_primary_key,
-                exclusive_end_primary_key,
-                limit=100
-            )
-
-            for row in row_list:
-                columns = {col[0]: col[1] for col in row.attribute_columns}
-                tags_json = columns.get('tags')
-
-                if tags_json:
-                    db_tags = json.loads(tags_json)
-
-                    # --- 核心过滤逻辑 ---
-                    is_match = True
-                    for species, min_count in query_tags.items():
-                        if db_tags.get(species, 0) < min_count:
-                            is_match = False
-                            break
-
-                    if is_match:
-                        file_url = columns.get('thumbnail_url') or row.primary_key[0][1]
-                        results.append(file_url)
-
-            if not next_start_primary_key:
-                break
-            inclusive_start_primary_key = next_start_primary_key
+        window = time_index.parse_window(query_params, int(time.time() * 1000))
+    except ValueError as e:
+        return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+    # min_confidence 按存储的 detections 列重新计数（无需重新推理）；没有该列的行仍使用 tags
+    try:
+        min_confidence = detections.parse_min_confidence(query_params)
+    except ValueError as e:
+        return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+    # 只有读取 time_index 按天分桶时才限制窗口长度；按 uploader 读取或扫描全表时按 uploaded_at 过滤即可
+    if window and not uploader and min_confidence is None:
+        try:
+            time_index.check_span(window)
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+    def counts_match(db_tags):
+        db_tags = species_names.normalize_tags(db_tags)
+        # --- 核心过滤逻辑 ---
+        for species, min_count in query_tags.items():
+            if db_tags.get(species, 0) < min_count:
+                return False
+        return True
+
+    def match_row(row):
+        columns = {col[0]: col[1] for col in row.attribute_columns}
+        tags_json = columns.get('tags')
+
+        if uploader and columns.get('uploader') != uploader:
+            return None
+        if window and not (columns.get('uploaded_at') and window[0] <= columns['uploaded_at'] < window[1]):
+            return None
+        if min_confidence is not None and columns.get('detections'):
+            if counts_match(detections.counts(columns['detections'], min_confidence)):
+                return columns.get('thumbnail_url') or row.primary_key[0][1]
+            return None
+        if tags_json and counts_match(json.loads(tags_json)):
+            return columns.get('thumbnail_url') or row.primary_key[0][1]
+        return None
+
+    def run_query():
+        # 索引表中的 tags 按默认置信度阈值计数，指定 min_confidence 时走扫描；uploader_index 未启用时也走扫描
+        if min_confidence is None and (UPLOADER_INDEX_ENABLED if uploader else window):
+            # 按上传者或上传时间过滤时只读取 uploader_index 中该用户的记录、或 time_index 中窗口覆盖的按天分桶
+            # （两者都已包含 tags），无需扫描全表
+            if uploader:
+                entries = uploader_index.all_entries(ots_client, uploader)
+                if window:
+                    entries = [entry for entry in entries if window[0] <= (entry['uploaded_at'] or 0) < window[1]]
+            else:
+                entries = time_index.read(ots_client, time_index.ALL_SPECIES, *window)
+            results = [entry['thumbnail_url'] or entry['file_url']
+                       for entry in sorted(entries, key=lambda entry: entry['file_url']) if counts_match(entry['tags'])]
+            print(f"Found {len(results)} matching files (uploader={uploader}, window={window}).")
+            trace.incr('rows_matched', len(results))
+            return {"links": results}
+
+        # 2. 扫描全表并根据数量要求进行过滤 (注意: ots_client 已在上面初始化，无需重复)
+        budget = scan_budget.ScanBudget()
+        # 按主键区间切分后并行分页扫描，结果按主键顺序合并
+        scan_ranges = ranges if ranges is not None else parallel_scan.split_ranges(ots_client, TABLE_NAME, ['file_url'])
+        columns = ['tags', 'thumbnail_url', 'uploader', 'uploaded_at']
+        if min_confidence is not None:
+            columns.append('detections')
+        results, remaining = parallel_scan.scan(ots_client, TABLE_NAME, scan_ranges, match_row, budget=budget,
+                                                page_limit=100, columns_to_get=columns)
+        exhausted = budget.exhausted() if remaining else None
+        print(f"Found {len(results)} matching files.")
+        trace.incr('rows_matched', len(results))
+
+        response_body = {"links": results}
+        if exhausted:
+            # 预算耗尽：返回已找到的部分结果和继续扫描用的游标
+            print(f"[WARNING] Scan budget '{exhausted}' exhausted after {budget.usage()}")
+            trace.incr(f"scan_budget_exhausted.{exhausted}")
+            trace.set('scan_budget', dict(budget.usage(), exhausted=exhausted))
+            response_body.update({"partial": True, "budget_exhausted": exhausted,
+                                  "next_cursor": scan_budget.encode_cursor(remaining)})
+        return response_body
 
+    try:
+        if ranges is not None:
+            response_body = run_query()
+        else:
+            # 相同的查询（规范化后）在目录版本未变时直接复用缓存结果；未给 until 时按无终点缓存
+            cache_params = {'query_tags': query_tags, 'uploader': uploader,
+                            'since': window[0] if window else None,
+                            'until': window[1] if window and query_params.get('until') else None,
+                            'min_confidence': min_confidence}
+            response_body, cache_source = query_cache.cached_query(ots_client, 'query-by-count', cache_params,
+                                                                   run_query)
+            trace.set('query_cache', cache_source)
     except Exception as e:
         print(f"Error querying Tablestore: {e}")
         return {"statusCode": 500, "body": json.dumps({"error": "Failed to query database."})}
 
-    print(f"Found {len(results)} matching files.")
-
     # 3. 返回结果
-    response_body = {"links": results}
+    trace.phase('serialize')
     return {
         "statusCode": 200,
         "headers": {"Content-Type": "application/json", "Content-Disposition": "inline"},
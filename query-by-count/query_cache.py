@@ -0,0 +1,171 @@
+# query_cache.py
+# Caches the response bodies of query-files and query-by-count, keyed by the normalized query and
+# validated against catalog_version, so dashboards polling the same query skip the scan.
+#
+# query-files and query-by-count carry identical copies of this file. A result is stored under
+# (query key, catalog version): any upload, tag edit, delete or re-tag bumps the version, after which
+# the old entries are never hit again and fall out of the LRU.
+#   Tier 1 is an in-memory LRU of QUERY_CACHE_SIZE entries per warm instance.
+#   Tier 2 is an optional Tablestore table shared by every instance, enabled by QUERY_CACHE_TABLE. The
+#   table needs a single string primary key column 'cache_key'; give it a time-to-live (e.g. one day).
+# Identical queries that arrive on one instance while the first is still running wait for its result
+# instead of scanning again (single-flight). Only complete results are cached: a response cut short by
+# the scan budget (next_cursor) is not, and cursor requests bypass the cache.
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from tablestore import *
+import catalog_version
+import tracing
+
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', '128'))
+QUERY_CACHE_TABLE = os.environ.get('QUERY_CACHE_TABLE', '')
+# Tablestore string columns hold at most 2 MB; larger results stay in memory only.
+REMOTE_MAX_BYTES = 1024 * 1024
+# A follower stops waiting for the leader after this long and runs the query itself.
+COALESCE_TIMEOUT_S = 30
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # cache_key -> response body
+_flights = {}  # cache_key -> _Flight of the query running for it
+_counters = Counter()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None
+
+
+def canonical_query(node):
+    """A species_query AST with AND / OR operands sorted, so "pigeon AND crow" keys like "crow AND pigeon"."""
+    if node is None or node[0] == 'term':
+        return node
+    if node[0] == 'not':
+        return ['not', canonical_query(node[1])]
+    children = [canonical_query(child) for child in node[1]]
+    return [node[0], sorted(children, key=lambda child: json.dumps(child))]
+
+
+def make_key(function_name, params, version):
+    """Cache key of a query: `params` must be JSON-serializable and hold everything the result depends on."""
+    digest = hashlib.sha256(json.dumps([function_name, params], sort_keys=True).encode('utf-8')).hexdigest()
+    return f"{function_name}:{digest}:{version}"
+
+
+def _count(name):
+    with _lock:
+        _counters[name] += 1
+    tracing.current().incr(f"query_cache.{name}")
+
+
+def _get_local(cache_key):
+    with _lock:
+        if cache_key not in _entries:
+            return None
+        _entries.move_to_end(cache_key)
+        return _entries[cache_key]
+
+
+def _put_local(cache_key, body):
+    with _lock:
+        _entries[cache_key] = body
+        _entries.move_to_end(cache_key)
+        while len(_entries) > QUERY_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def _get_remote(ots_client, cache_key):
+    _, row, _ = ots_client.get_row(QUERY_CACHE_TABLE, [('cache_key', cache_key)], columns_to_get=['body'])
+    if not row or not row.attribute_columns:
+        return None
+    return json.loads({col[0]: col[1] for col in row.attribute_columns}['body'])
+
+
+def _put_remote(ots_client, cache_key, body):
+    encoded = json.dumps(body)
+    if len(encoded) > REMOTE_MAX_BYTES:
+        return
+    row = Row([('cache_key', cache_key)], [('body', encoded), ('created_at', int(time.time()))])
+    ots_client.put_row(QUERY_CACHE_TABLE, row, Condition(RowExistenceExpectation.IGNORE))
+
+
+def cached_query(ots_client, function_name, params, run_query):
+    """
+    Returns run_query()'s response body for `params`, reusing a cached body when the catalog has not
+    changed since it was computed.
+
+    Parameters:
+        ots_client (OTSClient): Reads the catalog version and the shared tier.
+        function_name (str): Keeps the two functions' keys apart.
+        params (dict): The normalized query; see make_key().
+        run_query (callable): Runs the query and returns the response body (a dict).
+
+    Returns:
+        tuple: (body, source) where source is 'memory', 'tablestore', 'coalesced', 'computed', or
+               'uncached' when catalog versioning is off or its table could not be read.
+    """
+    try:
+        version = catalog_version.current(ots_client)
+    except Exception as e:
+        print(f"[WARNING] Could not read the catalog version, query cache skipped: {e}")
+        version = None
+    if version is None:
+        return run_query(), 'uncached'
+    cache_key = make_key(function_name, params, version)
+
+    body = _get_local(cache_key)
+    if body is not None:
+        _count('hit_memory')
+        return body, 'memory'
+
+    with _lock:
+        flight = _flights.get(cache_key)
+        leader = flight is None
+        if leader:
+            flight = _flights[cache_key] = _Flight()
+    if not leader:
+        if flight.done.wait(COALESCE_TIMEOUT_S) and flight.body is not None:
+            _count('coalesced')
+            return flight.body, 'coalesced'
+        # The leader failed, returned a partial result or is too slow: run the query here.
+        _count('miss')
+        return run_query(), 'computed'
+
+    try:
+        if QUERY_CACHE_TABLE:
+            try:
+                body = _get_remote(ots_client, cache_key)
+            except Exception as e:
+                # The shared tier is best-effort; fall through to the query.
+                print(f"[WARNING] Query cache lookup failed: {e}")
+            if body is not None:
+                _put_local(cache_key, body)
+                flight.body = body
+                _count('hit_tablestore')
+                return body, 'tablestore'
+        _count('miss')
+        body = run_query()
+        if body.get('partial'):
+            return body, 'computed'
+        _put_local(cache_key, body)
+        flight.body = body
+        if QUERY_CACHE_TABLE:
+            try:
+                _put_remote(ots_client, cache_key, body)
+            except Exception as e:
+                print(f"[WARNING] Query cache write failed: {e}")
+        return body, 'computed'
+    finally:
+        with _lock:
+            _flights.pop(cache_key, None)
+        flight.done.set()
+
+
+def stats():
+    """This instance's cache counters and entry count."""
+    with _lock:
+        return dict(_counters, entries=len(_entries))
@@ -0,0 +1,251 @@
+# tracing.py
+# Per-invocation spans, counters and one structured JSON log line for every handler.
+#
+# Every function directory carries an identical copy of this file (Function Compute deploys each
+# directory on its own). A handler decorated with @tracing.traced gets a Trace for the invocation;
+# Tablestore clients and OSS buckets wrapped with trace.wrap_ots() / trace.wrap_bucket() time every
+# call automatically, and the handler adds spans, phases and counters for the rest. When the handler
+# returns, a single line is printed:
+#   {"type": "trace", "function": ..., "request_id": ..., "status": 200, "duration_ms": ...,
+#    "spans": {"ots.get_range": {"count": 3, "ms": 41.2}, ...}, "counters": {...}, ...}
+#
+# Setting TRACE_PROFILE_SLOW_MS to a positive value also samples the handler's stack every
+# TRACE_PROFILE_INTERVAL_MS while it runs and adds the hottest stacks to the log line of any
+# invocation slower than the threshold.
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') == '1'
+TRACE_PROFILE_SLOW_MS = float(os.environ.get('TRACE_PROFILE_SLOW_MS', '0'))
+TRACE_PROFILE_INTERVAL_MS = float(os.environ.get('TRACE_PROFILE_INTERVAL_MS', '5'))
+TRACE_PROFILE_TOP_STACKS = 5
+
+_local = threading.local()
+
+
+class _Sampler(threading.Thread):
+    """Records the target thread's stack every interval; stacks are kept as collapsed 'a;b;c' strings."""
+
+    def __init__(self, thread_id, interval_s):
+        super().__init__(daemon=True)
+        self._thread_id = thread_id
+        self._interval_s = interval_s
+        self._stop_event = threading.Event()
+        self.stacks = Counter()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval_s):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            names = [f"{os.path.basename(fs.filename)}:{fs.name}:{fs.lineno}"
+                     for fs in traceback.extract_stack(frame, limit=24)]
+            self.stacks[';'.join(names)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Trace:
+    def __init__(self, function_name, request_id):
+        self.function_name = function_name
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.counters = Counter()
+        self.fields = {}
+        self._phase = None
+        self._phase_started = None
+        self._sampler = None
+        # Spans and counters may be recorded from worker threads (e.g. parallel scans).
+        self._lock = threading.Lock()
+
+    # --- timing ---
+    def add_span(self, name, elapsed_ms):
+        with self._lock:
+            span = self.spans.setdefault(name, {'count': 0, 'ms': 0.0})
+            span['count'] += 1
+            span['ms'] += elapsed_ms
+
+    @contextmanager
+    def span(self, name):
+        """Times the enclosed block; repeated spans with the same name are summed."""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_span(name, (time.perf_counter() - start) * 1000)
+
+    def phase(self, name):
+        """Ends the current phase (if any) and starts `name`; phases run back to back until finish()."""
+        now = time.perf_counter()
+        if self._phase is not None:
+            self.add_span(f"phase.{self._phase}", (now - self._phase_started) * 1000)
+        self._phase, self._phase_started = name, now
+
+    # --- counters and fields ---
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def set(self, key, value):
+        self.fields[key] = value
+
+    # --- client wrappers ---
+    def wrap_ots(self, client):
+        return _TracedClient(client, self, 'ots', _record_ots)
+
+    def wrap_bucket(self, bucket):
+        return _TracedClient(bucket, self, 'oss', _record_oss)
+
+    # --- output ---
+    def start_profiler(self):
+        if TRACE_PROFILE_SLOW_MS > 0:
+            self._sampler = _Sampler(threading.get_ident(), TRACE_PROFILE_INTERVAL_MS / 1000)
+            self._sampler.start()
+
+    def finish(self, status=None):
+        self.phase(None)
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        record = {
+            'type': 'trace',
+            'function': self.function_name,
+            'request_id': self.request_id,
+            'status': status,
+            'duration_ms': round(duration_ms, 2),
+            'spans': {name: {'count': s['count'], 'ms': round(s['ms'], 2)} for name, s in self.spans.items()},
+            'counters': dict(self.counters),
+        }
+        record.update(self.fields)
+        if self._sampler is not None:
+            self._sampler.stop()
+            if duration_ms >= TRACE_PROFILE_SLOW_MS:
+                record['profile'] = {
+                    'samples': sum(self._sampler.stacks.values()),
+                    'interval_ms': TRACE_PROFILE_INTERVAL_MS,
+                    'top_stacks': [{'stack': stack, 'samples': n}
+                                   for stack, n in self._sampler.stacks.most_common(TRACE_PROFILE_TOP_STACKS)],
+                }
+        print(json.dumps(record, default=str))
+        return record
+
+
+class _NullTrace(Trace):
+    """Returned by current() outside a traced invocation, so instrumented code never has to check."""
+
+    def __init__(self):
+        super().__init__(None, None)
+
+    def wrap_ots(self, client):
+        return client
+
+    def wrap_bucket(self, bucket):
+        return bucket
+
+    def finish(self, status=None):
+        return None
+
+
+def _row_size(row):
+    """Approximate payload size: names plus values, with numbers and booleans counted as 8 bytes."""
+    if row is None:
+        return 0
+    size = 0
+    for col in row.primary_key or ():
+        size += len(col[1]) if isinstance(col[1], (str, bytes)) else 8
+    for col in row.attribute_columns or ():
+        size += len(col[0]) + (len(col[1]) if isinstance(col[1], (str, bytes)) else 8)
+    return size
+
+
+def _record_ots(trace, method, result):
+    """Counts rows, bytes and capacity units from the tuples the tablestore SDK returns."""
+    if not isinstance(result, tuple) or not result:
+        return
+    consumed = result[0]
+    if hasattr(consumed, 'read'):
+        trace.incr('ots.read_cu', consumed.read or 0)
+        trace.incr('ots.write_cu', consumed.write or 0)
+    if method == 'get_range':
+        rows = result[2] or []
+        trace.incr('rows_scanned', len(rows))
+        trace.incr('ots.bytes_read', sum(_row_size(r) for r in rows))
+    elif method == 'get_row' and result[1] is not None:
+        trace.incr('rows_scanned')
+        trace.incr('ots.bytes_read', _row_size(result[1]))
+
+
+def _record_oss(trace, method, result):
+    if method == 'get_object':
+        trace.incr('oss.bytes_read', getattr(result, 'content_length', 0) or 0)
+
+
+class _TracedClient:
+    """Proxy that times every method call on the wrapped client as span '<prefix>.<method>'."""
+
+    def __init__(self, client, trace, prefix, record):
+        self._client = client
+        self._trace = trace
+        self._prefix = prefix
+        self._record = record
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        @functools.wraps(attr)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                self._trace.incr(f"{self._prefix}.errors")
+                raise
+            finally:
+                self._trace.add_span(f"{self._prefix}.{name}", (time.perf_counter() - start) * 1000)
+            self._record(self._trace, name, result)
+            return result
+
+        return timed
+
+
+def current():
+    """The Trace of the invocation running on this thread (a no-op trace outside one)."""
+    trace = getattr(_local, 'trace', None)
+    return trace if trace is not None else _NullTrace()
+
+
+def traced(function_name):
+    """Decorator for handler(event, context): one Trace per invocation, logged when the handler returns."""
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if not TRACE_ENABLED:
+                return handler(event, context)
+            trace = Trace(function_name, getattr(context, 'request_id', None))
+            _local.trace = trace
+            trace.start_profiler()
+            status = None
+            try:
+                response = handler(event, context)
+                if isinstance(response, dict):
+                    status = response.get('statusCode')
+                    trace.incr('response_bytes', len(response.get('body') or ''))
+                return response
+            except Exception:
+                status = 'exception'
+                raise
+            finally:
+                _local.trace = None
+                trace.finish(status)
+        return wrapper
+    return decorate
@@ -3,12 +3,25 @@ import json
 import traceback
 import time
 from tablestore import *
+import os
+import tracing
+import scan_budget
+import parallel_scan
+import species_index
+import species_query
+import uploader_index
+import time_index
+import detections
+import query_cache
 
 # --- 配置信息 ---
 OTS_ENDPOINT = "https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com"
 OTS_INSTANCE_NAME = "n01xiizqc116"
 TABLE_NAME = 'media_metadata'
 SESSION_TABLE_NAME = 'sessions'  # 新增 sessions 表的配置
+# 0 (default): scan media_metadata; 1: answer queries from the species_index postings table. Set it to 1
+# only after build_indexes.py has filled species_index, or queries return nothing for existing rows.
+SPECIES_INDEX_ENABLED = os.environ.get('SPECIES_INDEX_ENABLED', '0') == '1'
 
 
 # --------------------
@@ -31,8 +44,11 @@ def _ensure_str(s):
 
 
 # ---【 这是修正后的 handler 函数 】---
+@tracing.traced('query-files')
 def handler(event, context):
     print(f"Received event: {event}")
+    trace = tracing.current()
+    trace.phase('parse')
 
     # 步骤一：【必须先做】解析事件，确保 event_dict 存在
     try:
@@ -46,6 +62,7 @@ def handler(event, context):
         return {"statusCode": 400, "body": json.dumps({"error": "Failed to parse event data."})}
 
     # 步骤二：【第二步】进行Token验证
+    trace.phase('auth')
     try:
         headers = event_dict.get('headers', {})
         token = headers.get('authorization') or headers.get('Authorization')
@@ -53,13 +70,13 @@ def handler(event, context):
             raise ValueError("Authorization token is missing.")
 
         creds = context.credentials
-        ots_client = OTSClient(
+        ots_client = trace.wrap_ots(OTSClient(
             end_point=OTS_ENDPOINT,
             access_key_id=creds.access_key_id,
             access_key_secret=creds.access_key_secret,
             instance_name=OTS_INSTANCE_NAME,
             sts_token=creds.security_token
-        )
+        ))
 
         session_pk = [('token', token)]
         _, row, _ = ots_client.get_row(SESSION_TABLE_NAME, session_pk, columns_to_get=['user_email', 'expires_at'])
@@ -74,7 +91,8 @@ def handler(event, context):
             ots_client.delete_row(SESSION_TABLE_NAME, Row(session_pk))
             raise ValueError("Token has expired.")
 
-        print(f"Token validation successful for user: {session_info.get('user_email')}")
+        current_user_email = session_info.get('user_email')
+        print(f"Token validation successful for user: {current_user_email}")
 
     except Exception as e:
         # Token 验证失败，返回 401
@@ -82,35 +100,96 @@ def handler(event, context):
         return {"statusCode": 401, "body": json.dumps({"error": f"Unauthorized: {e}"})}
 
     # 步骤三：【Token验证通过后】才执行原来的业务逻辑
+    trace.phase('query')
     try:
         query_params = event_dict.get('queryParameters', {}) or {}
-        species_to_find = query_params.get('species')
-
-        if not species_to_find:
+        # q 支持布尔查询，如 "crow AND pigeon"、"owl OR kingfisher"、"sparrow NOT myna"；species 为单个物种
+        query_text = query_params.get('q') or query_params.get('species')
+        # since/until 限定上传时间（毫秒时间戳或 ISO 8601，until 不含、默认为当前时间）；只给时间窗口时返回窗口内的全部上传
+        try:
+            window = time_index.parse_window(query_params, int(time.time() * 1000))
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        if not query_text and not window:
             return {
                 "statusCode": 400,
                 "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({"error": "Query parameter 'species' is required."})
+                "body": json.dumps({"error": "Query parameter 'q', 'species' or 'since' is required."})
             }
 
-        species_q = species_to_find.strip().lower()
-        print(f"Searching for species: {species_q}")
-
-        # 扫描全表来查找匹配的数据（带分页）
-        results = []
-        seen = set()
-
-        inclusive_start_primary_key = [('file_url', INF_MIN)]
-        exclusive_end_primary_key = [('file_url', INF_MAX)]
-        next_start_pk = inclusive_start_primary_key
-        next_token = None
-
-        while True:
-            consumed, next_start_primary_key, row_list, next_token = ots_client.get_range(
-                TABLE_NAME, Direction.FORWARD, next_start_pk, exclusive_end_primary_key, limit=100, token=next_token
-            )
-
-            for row in row_list:
+        try:
+            query = species_query.parse(query_text, normalize=species_index.normalize) if query_text else None
+        except species_query.QueryError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": f"Invalid query: {e}"})}
+        # uploader=<email> 只返回该用户上传的文件；uploader=me 表示当前登录用户
+        uploader = query_params.get('uploader')
+        if uploader == 'me':
+            uploader = current_user_email
+        # min_confidence 按存储的 detections 列重新计数（无需重新推理）；没有该列的行仍使用 tags
+        try:
+            min_confidence = detections.parse_min_confidence(query_params)
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+        print(f"Searching for: {query}" + (f" uploaded by {uploader}" if uploader else "")
+              + (f" between {window[0]} and {window[1]}" if window else "")
+              + (f" at confidence > {min_confidence}" if min_confidence is not None else ""))
+        trace.set('query_terms', len(species_query.terms(query)) if query else 0)
+
+        # 游标：上一次请求因预算耗尽而中断时返回的 next_cursor，记录了尚未读取的主键区间
+        cursor_ranges = None
+        if query_params.get('cursor'):
+            try:
+                cursor_ranges = scan_budget.decode_cursor(query_params['cursor'], ['file_url'])
+            except ValueError as e:
+                return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        # 索引表按默认置信度阈值计数，指定 min_confidence 时走扫描
+        use_index = SPECIES_INDEX_ENABLED and cursor_ranges is None and min_confidence is None
+        if window and use_index:
+            # 只有读取 time_index 按天分桶时才限制窗口长度；扫描 media_metadata 时按 uploaded_at 过滤即可
+            try:
+                time_index.check_span(window)
+            except ValueError as e:
+                return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        def run_query():
+            if use_index:
+                # 每个物种一次 get_range 读取倒排表，再按有序列表求交/并/差
+                thumbnails = {}
+
+                def fetch(species):
+                    if window:
+                        # 只读取时间窗口覆盖的按天分桶
+                        with trace.span('time_index'):
+                            rows = [(entry['file_url'], entry) for entry in time_index.read(ots_client, species, *window)]
+                        rows.sort(key=lambda item: item[0])
+                    else:
+                        with trace.span('postings'):
+                            rows = species_index.postings(ots_client, species)
+                    trace.incr('postings_read', len(rows))
+                    for file_url, cols in rows:
+                        thumbnails[file_url] = cols.get('thumbnail_url')
+                    return [file_url for file_url, _ in rows]
+
+                with trace.span('evaluate'):
+                    file_urls = species_query.evaluate(query, fetch) if query else fetch(time_index.ALL_SPECIES)
+                if uploader and file_urls:
+                    with trace.span('uploader_index'):
+                        own = sorted(entry['file_url'] for entry in uploader_index.all_entries(ots_client, uploader))
+                    file_urls = species_query.intersect(file_urls, own)
+                results = [_ensure_str(thumbnails.get(file_url) or file_url) for file_url in file_urls]
+                print(f"Found {len(results)} matching files.")
+                trace.incr('rows_matched', len(results))
+
+                return {"links": results}
+
+            # 扫描全表来查找匹配的数据（按主键区间并行分页扫描）；带游标时从上次未读的区间继续
+            ranges = cursor_ranges if cursor_ranges is not None else parallel_scan.split_ranges(
+                ots_client, TABLE_NAME, ['file_url'])
+            budget = scan_budget.ScanBudget()
+
+            def match_row(row):
                 pk = {k: v for k, v in row.primary_key}
                 cols = {col[0]: col[1] for col in row.attribute_columns}
                 tags_raw = cols.get('tags')
@@ -123,30 +202,57 @@ def handler(event, context):
                 elif isinstance(tags_raw, dict):
                     tags = tags_raw
 
-                matched = False
-                if isinstance(tags, dict):
-                    for k in tags.keys():
-                        if species_q == _ensure_str(k).strip().lower(): matched = True; break
-                elif isinstance(tags, list):
-                    for item in tags:
-                        if species_q == _ensure_str(item).strip().lower(): matched = True; break
-
-                if matched:
-                    file_url = _ensure_str(cols.get('thumbnail_url') or pk.get('file_url'))
-                    if file_url and file_url not in seen:
-                        seen.add(file_url)
-                        results.append(file_url)
-
-            if next_token:
-                next_start_pk = next_start_primary_key
-                continue
-            if next_start_primary_key is None:
-                break
-            next_start_pk = next_start_primary_key
-
-        print(f"Found {len(results)} matching files.")
-
-        response_body = {"links": results}
+                if uploader and _ensure_str(cols.get('uploader') or '') != uploader:
+                    return None
+                if window and not (cols.get('uploaded_at') and window[0] <= cols['uploaded_at'] < window[1]):
+                    return None
+                if min_confidence is not None and cols.get('detections'):
+                    species = detections.counts(cols['detections'], min_confidence).keys()
+                else:
+                    species = species_index.species_counts(tags or {}).keys()
+                if query is None or species_query.matches(query, species):
+                    return _ensure_str(cols.get('thumbnail_url') or pk.get('file_url'))
+                return None
+
+            columns = ['tags', 'thumbnail_url', 'uploader', 'uploaded_at']
+            if min_confidence is not None:
+                columns.append('detections')
+            matches, remaining = parallel_scan.scan(ots_client, TABLE_NAME, ranges, match_row, budget=budget,
+                                                     page_limit=100, columns_to_get=columns)
+            exhausted = budget.exhausted() if remaining else None
+
+            results = []
+            seen = set()
+            for file_url in matches:
+                if file_url and file_url not in seen:
+                    seen.add(file_url)
+                    results.append(file_url)
+
+            print(f"Found {len(results)} matching files.")
+            trace.incr('rows_matched', len(results))
+
+            response_body = {"links": results}
+            if exhausted:
+                # 预算耗尽：返回已找到的部分结果和继续扫描用的游标
+                print(f"[WARNING] Scan budget '{exhausted}' exhausted after {budget.usage()}")
+                trace.incr(f"scan_budget_exhausted.{exhausted}")
+                trace.set('scan_budget', dict(budget.usage(), exhausted=exhausted))
+                response_body.update({"partial": True, "budget_exhausted": exhausted,
+                                      "next_cursor": scan_budget.encode_cursor(remaining)})
+            return response_body
+
+        if cursor_ranges is not None:
+            response_body = run_query()
+        else:
+            # 相同的查询（规范化后）在目录版本未变时直接复用缓存结果
+            # 未给 until 时窗口终点是"现在"：之后的上传都会更新目录版本，所以按无终点缓存
+            cache_params = {'query': query_cache.canonical_query(query), 'uploader': uploader,
+                            'since': window[0] if window else None,
+                            'until': window[1] if window and query_params.get('until') else None,
+                            'min_confidence': min_confidence}
+            response_body, cache_source = query_cache.cached_query(ots_client, 'query-files', cache_params, run_query)
+            trace.set('query_cache', cache_source)
+        trace.phase('serialize')
         return {
             "isBase64Encoded": False,
             "statusCode": 200,
@@ -0,0 +1,170 @@
+# parallel_scan.py
+# Full-table get_range scans split into primary-key ranges and read concurrently.
+#
+# query-files, query-by-count and search-by-file carry identical copies of this file. The table is
+# cut into ranges at split points from Tablestore's compute_split_points_by_size when the client
+# provides it. Otherwise the split points are found with a "skip scan" over the first primary key
+# column: one limit=1 get_range per distinct character after the common prefix of all keys, grouped
+# into SCAN_WORKERS roughly equal ranges. Split points only affect how the work is divided; the
+# ranges always cover the whole table, so results are the same with any split.
+#
+# Ranges are read by a bounded, per-instance thread pool. Each range is still paged sequentially,
+# and a shared ScanBudget (see scan_budget.py) stops every worker before its next page.
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tablestore import *
+import tracing
+
+SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', '4'))
+# Passed to compute_split_points_by_size, in the API's unit of 100 MB.
+SCAN_SPLIT_SIZE = int(os.environ.get('SCAN_SPLIT_SIZE', '1'))
+# Split points are reused for this long; stale points only make the ranges less even.
+SPLIT_CACHE_SECONDS = int(os.environ.get('SPLIT_CACHE_SECONDS', '300'))
+SKIP_SCAN_MAX_PROBES = 64
+
+_executor = None
+_executor_lock = threading.Lock()
+_split_cache = {}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix='scan')
+    return _executor
+
+
+def _edge_value(ots_client, table_name, pk_names, direction):
+    """First (FORWARD) or last (BACKWARD) value of the first primary key column, or None if the table is empty."""
+    low = [(name, INF_MIN) for name in pk_names]
+    high = [(name, INF_MAX) for name in pk_names]
+    start, end = (low, high) if direction == Direction.FORWARD else (high, low)
+    _, _, rows, _ = ots_client.get_range(table_name, direction, start, end, columns_to_get=[pk_names[0]], limit=1)
+    return rows[0].primary_key[0][1] if rows else None
+
+
+def _skip_scan_split_points(ots_client, table_name, pk_names, parts):
+    """Split points on the character after the common prefix of the first and last string key."""
+    first = _edge_value(ots_client, table_name, pk_names, Direction.FORWARD)
+    last = _edge_value(ots_client, table_name, pk_names, Direction.BACKWARD)
+    if not isinstance(first, str) or not isinstance(last, str) or first == last:
+        return []
+    depth = 0
+    while depth < min(len(first), len(last)) and first[depth] == last[depth]:
+        depth += 1
+    prefix = first[:depth]
+
+    # Every character that occurs at `depth`, found by jumping past each one in turn.
+    occupied = []
+    start = prefix
+    tail = [(name, INF_MIN) for name in pk_names[1:]]
+    end = [(pk_names[0], INF_MAX)] + [(name, INF_MAX) for name in pk_names[1:]]
+    while len(occupied) < SKIP_SCAN_MAX_PROBES:
+        _, _, rows, _ = ots_client.get_range(table_name, Direction.FORWARD, [(pk_names[0], start)] + tail, end,
+                                             columns_to_get=[pk_names[0]], limit=1)
+        if not rows:
+            break
+        value = rows[0].primary_key[0][1]
+        if value == prefix:  # the prefix itself is a key; continue after it
+            start = prefix + '\0'
+            continue
+        if not value.startswith(prefix):
+            break
+        char = value[depth]
+        occupied.append(char)
+        if ord(char) >= 0x10FFFF:
+            break
+        start = prefix + chr(ord(char) + 1)
+
+    if len(occupied) < 2:
+        return []
+    parts = min(parts, len(occupied))
+    # Every group after the first starts at its first occupied character.
+    return [prefix + occupied[len(occupied) * i // parts] for i in range(1, parts)]
+
+
+def split_ranges(ots_client, table_name, pk_names, parts=None):
+    """
+    Cuts a table into consecutive primary-key ranges.
+
+    Returns:
+        list: [(inclusive_start_pk, exclusive_end_pk)] in primary-key order, covering the whole table.
+    """
+    parts = parts or SCAN_WORKERS
+    cached = _split_cache.get(table_name)
+    if cached and time.time() - cached[0] < SPLIT_CACHE_SECONDS:
+        points = cached[1]
+    else:
+        points = None
+        compute = getattr(ots_client, 'compute_split_points_by_size', None)
+        if compute is not None:
+            try:
+                _, split_points, _ = compute(table_name, SCAN_SPLIT_SIZE)
+                points = [point[0][1] if isinstance(point, (list, tuple)) and isinstance(point[0], (list, tuple))
+                          else point for point in split_points]
+            except Exception as e:
+                print(f"[WARNING] compute_split_points_by_size failed, falling back to a skip scan: {e}")
+        if points is None:
+            points = _skip_scan_split_points(ots_client, table_name, pk_names, parts)
+        _split_cache[table_name] = (time.time(), points)
+
+    def key(first_value, fill):
+        return [(pk_names[0], first_value)] + [(name, fill) for name in pk_names[1:]]
+
+    boundaries = [key(INF_MIN, INF_MIN)] + [key(p, INF_MIN) for p in points] + [key(INF_MAX, INF_MAX)]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _scan_range(ots_client, table_name, start_pk, end_pk, process_row, budget, page_limit, columns_to_get, trace):
+    """Pages through one range. Returns (results, unscanned start key or None when the range is done)."""
+    results = []
+    next_pk = start_pk
+    while next_pk is not None:
+        if budget is not None and budget.exhausted():
+            return results, next_pk
+        consumed, next_pk, row_list, _ = ots_client.get_range(
+            table_name, Direction.FORWARD, next_pk, end_pk, columns_to_get=columns_to_get, limit=page_limit)
+        if budget is not None:
+            budget.charge(consumed, len(row_list))
+        filter_start = time.perf_counter()
+        for row in row_list:
+            item = process_row(row)
+            if item is not None:
+                results.append(item)
+        trace.add_span('filter', (time.perf_counter() - filter_start) * 1000)
+    return results, None
+
+
+def scan(ots_client, table_name, ranges, process_row, budget=None, page_limit=100, columns_to_get=None,
+         ordered=True):
+    """
+    Scans `ranges` concurrently and applies process_row(row) to every row (in worker threads).
+
+    Parameters:
+        ranges (list): (inclusive_start_pk, exclusive_end_pk) pairs, e.g. from split_ranges() or a cursor.
+        process_row (callable): Returns the value to keep for a row, or None to drop it.
+        budget (ScanBudget): Optional shared budget; when it runs out, workers stop before their next page.
+        ordered (bool): Return results in primary-key order (ranges in the order given) rather than in
+                        the order the ranges finished.
+
+    Returns:
+        tuple: (results, remaining) where remaining lists the (start_pk, end_pk) ranges not yet read.
+    """
+    extra = (process_row, budget, page_limit, columns_to_get, tracing.current())
+    if len(ranges) <= 1 or SCAN_WORKERS <= 1:
+        outcomes = [_scan_range(ots_client, table_name, start, end, *extra) for start, end in ranges]
+        finished = range(len(ranges))
+    else:
+        futures = [_get_executor().submit(_scan_range, ots_client, table_name, start, end, *extra)
+                   for start, end in ranges]
+        index = {future: i for i, future in enumerate(futures)}
+        finished = range(len(futures)) if ordered else [index[future] for future in as_completed(futures)]
+        outcomes = [future.result() for future in futures]
+
+    results = [item for i in finished for item in outcomes[i][0]]
+    remaining = [(resume, ranges[i][1]) for i, (_, resume) in enumerate(outcomes) if resume is not None]
+    return results, remaining
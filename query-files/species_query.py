@@ -0,0 +1,248 @@
+# species_query.py
+# Boolean species queries for query-files: "crow AND pigeon", "owl OR kingfisher", "sparrow NOT myna".
+#
+# Grammar (keywords are case-insensitive; a species name that contains spaces or a keyword is quoted):
+#   expr   := and_ ('OR' and_)*
+#   and_   := unary (['AND'] unary)*        adjacent terms are ANDed, so "sparrow NOT myna" is
+#   unary  := 'NOT' unary | '(' expr ')' | SPECIES | "quoted species"      sparrow AND (NOT myna)
+#
+# parse() turns the text into a small AST of tuples:
+#   ('term', species) | ('and', [node, ...]) | ('or', [node, ...]) | ('not', node)
+# evaluate() runs it against sorted posting lists (one fetch per distinct species): AND intersects
+# its positive operands smallest-first and then subtracts its NOT operands, OR merges. A NOT needs a
+# positive operand in the same AND to subtract from, since there is no posting list of "everything".
+# matches() evaluates the same AST against one row's species set, for the full-scan fallback.
+import bisect
+import heapq
+import re
+
+KEYWORDS = {'AND', 'OR', 'NOT'}
+MAX_TERMS = 20
+# Above this size ratio, intersect by binary search into the larger list instead of a linear merge.
+GALLOP_RATIO = 8
+
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+
+
+class QueryError(ValueError):
+    """The query text is not valid in the grammar above."""
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if not m or m.end() == pos:
+            raise QueryError(f"Unexpected character at position {pos}: {text[pos]!r}")
+        pos = m.end()
+        if m.group(1):
+            tokens.append(('(', None))
+        elif m.group(2):
+            tokens.append((')', None))
+        elif m.group(3) is not None:
+            tokens.append(('species', m.group(3)))
+        elif m.group(4).upper() in KEYWORDS:
+            tokens.append((m.group(4).upper(), None))
+        else:
+            tokens.append(('species', m.group(4)))
+    return tokens
+
+
+def parse(text, normalize=lambda s: s.strip().lower()):
+    """
+    Parses query text into an AST.
+
+    Raises:
+        QueryError: If the text is empty, malformed, has more than MAX_TERMS species, or uses a NOT
+                    that has nothing to subtract from.
+    """
+    tokens = _tokenize(text or '')
+    if not tokens:
+        raise QueryError("Query is empty.")
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def take(kind):
+        nonlocal pos
+        if peek() != kind:
+            found = peek() or 'end of query'
+            raise QueryError(f"Expected {kind} but found {found}.")
+        pos += 1
+        return tokens[pos - 1][1]
+
+    def parse_or():
+        children = [parse_and()]
+        while peek() == 'OR':
+            take('OR')
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else ('or', children)
+
+    def parse_and():
+        children = [parse_unary()]
+        while peek() in ('AND', 'NOT', '(', 'species'):
+            if peek() == 'AND':
+                take('AND')
+            children.append(parse_unary())
+        return children[0] if len(children) == 1 else ('and', children)
+
+    def parse_unary():
+        kind = peek()
+        if kind == 'NOT':
+            take('NOT')
+            return ('not', parse_unary())
+        if kind == '(':
+            take('(')
+            node = parse_or()
+            take(')')
+            return node
+        species = normalize(take('species'))
+        if not species:
+            raise QueryError("Empty species name.")
+        return ('term', species)
+
+    node = parse_or()
+    if pos != len(tokens):
+        raise QueryError(f"Unexpected {peek()} after the end of the query.")
+    if len(terms(node)) > MAX_TERMS:
+        raise QueryError(f"A query may name at most {MAX_TERMS} species.")
+    _check_negation(node)
+    return node
+
+
+def _check_negation(node, in_and=False):
+    kind = node[0]
+    if kind == 'not':
+        if not in_and:
+            raise QueryError("NOT must follow a species it excludes from, e.g. 'sparrow NOT myna'.")
+        _check_negation(node[1])
+    elif kind == 'and':
+        if all(child[0] == 'not' for child in node[1]):
+            raise QueryError("NOT must follow a species it excludes from, e.g. 'sparrow NOT myna'.")
+        for child in node[1]:
+            _check_negation(child, in_and=True)
+    elif kind == 'or':
+        for child in node[1]:
+            _check_negation(child)
+
+
+def terms(node):
+    """Distinct species named in the AST, in first-appearance order."""
+    if node[0] == 'term':
+        return [node[1]]
+    children = [node[1]] if node[0] == 'not' else node[1]
+    out = []
+    for child in children:
+        for species in terms(child):
+            if species not in out:
+                out.append(species)
+    return out
+
+
+def matches(node, species_set):
+    """True if a file tagged with `species_set` (normalized names) satisfies the query."""
+    kind = node[0]
+    if kind == 'term':
+        return node[1] in species_set
+    if kind == 'not':
+        return not matches(node[1], species_set)
+    if kind == 'and':
+        return all(matches(child, species_set) for child in node[1])
+    return any(matches(child, species_set) for child in node[1])
+
+
+# --- sorted-list set operations ---
+def intersect(small, large):
+    """Intersection of two sorted, duplicate-free lists."""
+    if len(small) > len(large):
+        small, large = large, small
+    out = []
+    if not small:
+        return out
+    if len(large) > GALLOP_RATIO * len(small):
+        lo = 0
+        for value in small:
+            lo = bisect.bisect_left(large, value, lo)
+            if lo == len(large):
+                break
+            if large[lo] == value:
+                out.append(value)
+        return out
+    i = j = 0
+    while i < len(small) and j < len(large):
+        if small[i] == large[j]:
+            out.append(small[i])
+            i += 1
+            j += 1
+        elif small[i] < large[j]:
+            i += 1
+        else:
+            j += 1
+    return out
+
+
+def union(lists):
+    """Union of sorted, duplicate-free lists."""
+    out = []
+    for value in heapq.merge(*lists):
+        if not out or out[-1] != value:
+            out.append(value)
+    return out
+
+
+def difference(keep, remove):
+    """Values of sorted `keep` that are not in sorted `remove`."""
+    if not keep or not remove:
+        return list(keep)
+    drop = set(intersect(keep, remove))
+    return [value for value in keep if value not in drop]
+
+
+def evaluate(node, fetch):
+    """
+    Evaluates the AST over posting lists.
+
+    Parameters:
+        fetch (callable): fetch(species) -> sorted list of file_urls; called at most once per species.
+
+    Returns:
+        list: Matching file_urls in sorted order.
+    """
+    cache = {}
+
+    def postings(species):
+        if species not in cache:
+            cache[species] = fetch(species)
+        return cache[species]
+
+    def run(node):
+        kind = node[0]
+        if kind == 'term':
+            return postings(node[1])
+        if kind == 'or':
+            return union([run(child) for child in node[1]])
+        # 'and': plain terms first (one lookup each), then nested sub-queries; stop at the first empty set.
+        positive = sorted((child for child in node[1] if child[0] != 'not'), key=lambda child: child[0] != 'term')
+        negative = [child[1] for child in node[1] if child[0] == 'not']
+        operands = []
+        for child in positive:
+            result = run(child)
+            if not result:
+                return []
+            operands.append(result)
+        operands.sort(key=len)
+        result = operands[0]
+        for other in operands[1:]:
+            result = intersect(result, other)
+            if not result:
+                return []
+        for child in negative:
+            result = difference(result, run(child))
+            if not result:
+                return []
+        return result
+
+    return run(node)
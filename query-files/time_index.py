@@ -0,0 +1,146 @@
+# time_index.py
+# Upload-time index for recent-activity queries: rows bucketed by UTC day in the time_index table.
+#
+# process-upload, manage-tags, delete-files, query-files and query-by-count carry identical copies of
+# this file. Every file with an uploaded_at has one row per detected species plus one ALL_SPECIES row:
+#   PK: day (STRING, 'YYYY-MM-DD' UTC), species (STRING), uploaded_at (INTEGER, ms), file_url (STRING)
+#   attributes: thumbnail_url (STRING, if any); the ALL_SPECIES row also holds the file's tags (JSON)
+# so "new owls this week" reads (day, 'owl', since..until) in each of the 7 day buckets and
+# "uploaded today" reads the ALL_SPECIES rows of one bucket. Reads of windows longer than
+# TIME_INDEX_MAX_DAYS are rejected (check_span) rather than turned into hundreds of range reads; queries
+# that scan media_metadata instead filter by uploaded_at and take any window.
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from tablestore import *
+
+TIME_INDEX_TABLE = 'time_index'
+TIME_INDEX_MAX_DAYS = int(os.environ.get('TIME_INDEX_MAX_DAYS', '92'))
+# Sorts before every species name; no species normalizes to it.
+ALL_SPECIES = '*'
+PAGE_LIMIT = 5000
+DAY_MS = 24 * 3600 * 1000
+
+
+def day_bucket(uploaded_at):
+    return datetime.fromtimestamp(uploaded_at / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+def parse_time(value):
+    """
+    Milliseconds since epoch from a query parameter: an integer in ms, or an ISO 8601 date or
+    datetime ('2026-10-19', '2026-10-19T08:00:00Z'); naive values are taken as UTC.
+
+    Raises:
+        ValueError: If the value is neither.
+    """
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid time {value!r}: use milliseconds since epoch or ISO 8601.")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def parse_window(query_params, now_ms):
+    """
+    (since_ms, until_ms) from the 'since' / 'until' query parameters, or None if neither is given.
+    'until' is exclusive and defaults to now.
+
+    Raises:
+        ValueError: If a value is invalid or 'since' is missing.
+    """
+    since, until = query_params.get('since'), query_params.get('until')
+    if not since and not until:
+        return None
+    if not since:
+        raise ValueError("'since' is required when 'until' is given.")
+    since_ms = parse_time(since)
+    until_ms = parse_time(until) if until else now_ms
+    if until_ms <= since_ms:
+        raise ValueError("'until' must be later than 'since'.")
+    return since_ms, until_ms
+
+
+def check_span(window):
+    """
+    Checks that `window` can be answered from time_index; call it only when the query reads time_index.
+
+    Raises:
+        ValueError: If the window is longer than TIME_INDEX_MAX_DAYS.
+    """
+    since_ms, until_ms = window
+    if until_ms - since_ms > TIME_INDEX_MAX_DAYS * DAY_MS:
+        raise ValueError(f"The time window may span at most {TIME_INDEX_MAX_DAYS} days.")
+
+
+def buckets(since_ms, until_ms):
+    """Day buckets overlapping [since_ms, until_ms)."""
+    day = datetime.fromtimestamp(since_ms / 1000, tz=timezone.utc).date()
+    last = datetime.fromtimestamp((until_ms - 1) / 1000, tz=timezone.utc).date()
+    out = []
+    while day <= last:
+        out.append(day.strftime('%Y-%m-%d'))
+        day += timedelta(days=1)
+    return out
+
+
+def _key(species, uploaded_at, file_url):
+    return [('day', day_bucket(uploaded_at)), ('species', species), ('uploaded_at', int(uploaded_at)),
+            ('file_url', file_url)]
+
+
+def sync(ots_client, file_url, uploaded_at, old_species, new_species, tags=None, thumbnail_url=None):
+    """
+    Brings the rows of one file from `old_species` to `new_species` (iterables of normalized names).
+
+    The ALL_SPECIES row is written whenever `tags` is given (upload and retag) and deleted when
+    `new_species` is None (delete). Files without uploaded_at are not indexed.
+    """
+    if not uploaded_at:
+        return
+    old = set(old_species or ())
+    thumbnail = [('thumbnail_url', thumbnail_url)] if thumbnail_url else []
+    if new_species is None:
+        for species in old | {ALL_SPECIES}:
+            ots_client.delete_row(TIME_INDEX_TABLE, Row(_key(species, uploaded_at, file_url)),
+                                  Condition(RowExistenceExpectation.IGNORE))
+        return
+    new = set(new_species)
+    for species in new - old:
+        ots_client.put_row(TIME_INDEX_TABLE, Row(_key(species, uploaded_at, file_url), list(thumbnail)))
+    for species in old - new:
+        ots_client.delete_row(TIME_INDEX_TABLE, Row(_key(species, uploaded_at, file_url)),
+                              Condition(RowExistenceExpectation.IGNORE))
+    if tags is not None:
+        columns = [('tags', tags if isinstance(tags, str) else json.dumps(tags))] + thumbnail
+        ots_client.put_row(TIME_INDEX_TABLE, Row(_key(ALL_SPECIES, uploaded_at, file_url), columns))
+
+
+def read(ots_client, species, since_ms, until_ms):
+    """
+    Rows of one species (or ALL_SPECIES) uploaded in [since_ms, until_ms), one range read per day bucket.
+
+    Returns:
+        list: {'file_url', 'uploaded_at', 'thumbnail_url', 'tags'} dicts in upload-time order.
+    """
+    out = []
+    for day in buckets(since_ms, until_ms):
+        start = [('day', day), ('species', species), ('uploaded_at', since_ms), ('file_url', INF_MIN)]
+        end = [('day', day), ('species', species), ('uploaded_at', until_ms), ('file_url', INF_MIN)]
+        while start is not None:
+            _, start, rows, _ = ots_client.get_range(TIME_INDEX_TABLE, Direction.FORWARD, start, end, limit=PAGE_LIMIT)
+            for row in rows:
+                pk = dict(row.primary_key)
+                columns = {col[0]: col[1] for col in row.attribute_columns}
+                out.append({
+                    'file_url': pk['file_url'],
+                    'uploaded_at': pk['uploaded_at'],
+                    'thumbnail_url': columns.get('thumbnail_url'),
+                    'tags': json.loads(columns['tags']) if columns.get('tags') else None,
+                })
+    return out
@@ -3,6 +3,7 @@ import json
 import traceback
 import hashlib # 用于密码哈希
 from tablestore import *
+import tracing
 
 # --- 配置信息 ---
 OTS_ENDPOINT = "https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com"
@@ -10,9 +11,12 @@ OTS_INSTANCE_NAME = "n01xiizqc116"
 USER_TABLE_NAME = 'users'
 # ------------------
 
+@tracing.traced('register-user')
 def handler(event, context):
+    trace = tracing.current()
     try:
         # 1. 解析请求 body
+        trace.phase('parse')
         event_str = event.decode('utf-8')
         event_dict = json.loads(event_str)
         body = json.loads(event_dict.get('body', '{}'))
@@ -23,8 +27,9 @@ def handler(event, context):
             raise ValueError("Email and password are required.")
 
         # 2. 初始化客户端
+        trace.phase('register')
         creds = context.credentials
-        ots_client = OTSClient(end_point=OTS_ENDPOINT, access_key_id=creds.access_key_id, access_key_secret=creds.access_key_secret, instance_name=OTS_INSTANCE_NAME, sts_token=creds.security_token)
+        ots_client = trace.wrap_ots(OTSClient(end_point=OTS_ENDPOINT, access_key_id=creds.access_key_id, access_key_secret=creds.access_key_secret, instance_name=OTS_INSTANCE_NAME, sts_token=creds.security_token))
 
         # 3. 检查用户是否已存在
         primary_key = [('email', email)]
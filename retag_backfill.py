@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+模型升级后的重新打标（backfill）脚本
+
+process-upload stores the digest of model.pt (bird_detector.model_version()) in every media_metadata row
+it writes. After the model is replaced, this job finds every row whose model_version differs from the
+new model (rows written before the column existed have none), re-runs detection on the original image
+and rewrites the tags. Rows whose tags were edited by hand (tags_source='manual', set by manage-tags)
+are skipped and counted as 'manual'; a re-upload through process-upload makes them model rows again:
+    - originals are downloaded from OSS by a thread pool, --prefetch ahead of the row being processed
+    - detection runs --batch-size images per model call (bird_detector.detect_birds_in_images); the
+      tags and the packed per-box 'detections' column (see detections.py) are both rewritten
+    - media_metadata updates go through batch_write_row, conditioned on tags and uploaded_at being
+      unchanged and the row not marked manual, so a retag or re-upload that lands meanwhile is never
+      overwritten
+    - species_index, uploader_index and time_index are then brought in line for the rows that were
+      updated, also through batch_write_row
+    - the last primary key whose batch is fully written is checkpointed to --checkpoint, so an
+      interrupted run resumes where it stopped; --rows-per-sec caps the load on Tablestore and OSS
+    - only a missing original (NoSuchKey), an image that cannot be decoded and a failed update
+      condition are counted and passed over; other OSS and Tablestore errors (throttling, server busy,
+      network) are retried with backoff, and if they persist the run stops before the checkpoint moves
+      past the rows involved
+    - each batch that updated a row bumps the catalog version (catalog_version.py), so cached query
+      results are recomputed; set CATALOG_VERSION_TABLE as for the functions
+
+Credentials come from ALIBABA_CLOUD_ACCESS_KEY_ID / ALIBABA_CLOUD_ACCESS_KEY_SECRET. Use the public
+endpoints when running outside the VPC.
+
+运行方式：
+    python retag_backfill.py --endpoint https://n01xiizqc116.cn-hangzhou.ots.aliyuncs.com
+    python retag_backfill.py --model-dir process-upload --backend onnx --rows-per-sec 5 --limit 100
+    ONNX_MODEL_PATH=./model.int8.onnx python retag_backfill.py --backend onnx   # the INT8 variant
+    python retag_backfill.py --dry-run                     # count the rows that would be re-tagged
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "process-upload"))
+
+from oss2.exceptions import NoSuchKey  # noqa: E402
+from tablestore import (BatchWriteRowRequest, CompositeColumnCondition, ComparatorType, Condition,  # noqa: E402
+                        DeleteRowItem, Direction, INF_MAX, INF_MIN, LogicalOperator, OTSClient, PutRowItem,
+                        Row, RowExistenceExpectation, SingleColumnCondition, TableInBatchWriteRowItem,
+                        UpdateRowItem)
+import species_names  # noqa: E402
+import species_index  # noqa: E402
+import uploader_index  # noqa: E402
+import time_index  # noqa: E402
+import detections  # noqa: E402
+import catalog_version  # noqa: E402
+
+# Same vocabulary as the deployed functions (the defaults are relative to the function directory).
+species_names.MODEL_NAMES_PATH = os.path.join(ROOT, "process-upload", "model.names.json")
+species_names.SPECIES_SYNONYMS_PATH = os.path.join(ROOT, "process-upload", "species_synonyms.json")
+
+MEDIA_TABLE = "media_metadata"
+PAGE_LIMIT = 500
+# Tablestore accepts at most 200 rows per batch_write_row.
+BATCH_WRITE_LIMIT = 200
+COLUMNS = ["tags", "thumbnail_url", "uploader", "uploaded_at", "model_version", "tags_source"]
+# tags_source value written by manage-tags; those tags are never replaced by model output.
+MANUAL_SOURCE = "manual"
+# Transient OSS / Tablestore errors are retried this many times, sleeping RETRY_BASE_S * 2**attempt.
+RETRIES = 4
+RETRY_BASE_S = 0.5
+CONDITION_CHECK_FAIL = "OTSConditionCheckFail"
+
+
+class BatchWriter:
+    """
+    Collects put_row / delete_row calls and sends them through batch_write_row.
+
+    Exposes the put_row / delete_row subset of OTSClient that species_index, uploader_index and
+    time_index use, so their sync functions batch unchanged. Index writes carry no conditions, so every
+    failure is transient and retried by write_batch().
+    """
+
+    def __init__(self, ots_client, limit=BATCH_WRITE_LIMIT):
+        self.ots_client = ots_client
+        self.limit = limit
+        self.items = []
+        self.stats = Counter()
+
+    def put_row(self, table_name, row, condition=None):
+        self._add(table_name, PutRowItem(row, condition or Condition(RowExistenceExpectation.IGNORE)))
+
+    def delete_row(self, table_name, row, condition=None):
+        self._add(table_name, DeleteRowItem(row, condition or Condition(RowExistenceExpectation.IGNORE)))
+
+    def _add(self, table_name, item):
+        self.items.append((table_name, item))
+        if len(self.items) >= self.limit:
+            self.flush()
+
+    def flush(self):
+        items, self.items = self.items, []
+        for start in range(0, len(items), self.limit):
+            write_batch(self.ots_client, items[start:start + self.limit])
+        self.stats["rows"] += len(items)
+
+
+def _send_batch(ots_client, items):
+    """
+    Sends (table_name, row item) pairs in one batch_write_row call.
+
+    Returns:
+        list: (table_name, row item, error code, error message) of the rows that failed.
+    """
+    by_table = {}
+    for table_name, item in items:
+        by_table.setdefault(table_name, []).append(item)
+    request = BatchWriteRowRequest()
+    for table_name, row_items in by_table.items():
+        request.add(TableInBatchWriteRowItem(table_name, row_items))
+    response = ots_client.batch_write_row(request)
+    if response.is_all_succeed():
+        return []
+    failed = []
+    for table_name, row_items in by_table.items():
+        for results in (response.table_of_put, response.table_of_update, response.table_of_delete):
+            # Each result carries the index of its row in the request, not the primary key.
+            failed.extend((table_name, row_items[result.index], result.error_code, result.error_message)
+                          for result in results.get(table_name, []) if not result.is_ok)
+    return failed
+
+
+def write_batch(ots_client, items):
+    """
+    Writes (table_name, row item) pairs with batch_write_row, retrying rows that fail for any reason
+    other than their condition (throttling, server busy) and whole requests that fail.
+
+    Returns:
+        list: The (table_name, row item) pairs whose condition check failed.
+
+    Raises:
+        RuntimeError: If some rows still fail after RETRIES retries.
+    """
+    conflicts = []
+    error = None
+    for attempt in range(RETRIES + 1):
+        if not items:
+            return conflicts
+        if attempt:
+            time.sleep(RETRY_BASE_S * 2 ** (attempt - 1))
+        try:
+            failed = _send_batch(ots_client, items)
+        except Exception as e:  # OTSServiceError / OTSClientError for the whole request
+            error = str(e)
+            continue
+        conflicts.extend((table_name, item) for table_name, item, code, _ in failed if code == CONDITION_CHECK_FAIL)
+        items = [(table_name, item) for table_name, item, code, _ in failed if code != CONDITION_CHECK_FAIL]
+        if items:
+            error = next(f"{code}: {message}" for _, _, code, message in failed if code != CONDITION_CHECK_FAIL)
+    raise RuntimeError(f"{len(items)} row(s) still failing after {RETRIES} retries ({error})")
+
+
+def _object_location(file_url):
+    """(bucket name, object key) of an original image URL as written by process-upload."""
+    parsed = urlparse(file_url)
+    return parsed.hostname.split(".", 1)[0], parsed.path.lstrip("/")
+
+
+def _retag_condition(columns):
+    """The row still holds the tags (and upload) we re-ran detection for, and was not edited by hand since."""
+    condition = CompositeColumnCondition(LogicalOperator.AND)
+    condition.add_sub_condition(SingleColumnCondition("tags", columns.get("tags") or "{}", ComparatorType.EQUAL,
+                                                      pass_if_missing=True))
+    condition.add_sub_condition(SingleColumnCondition("uploaded_at", columns.get("uploaded_at") or 0,
+                                                      ComparatorType.EQUAL, pass_if_missing=True))
+    condition.add_sub_condition(SingleColumnCondition("tags_source", MANUAL_SOURCE, ComparatorType.NOT_EQUAL,
+                                                      pass_if_missing=True))
+    return Condition(RowExistenceExpectation.EXPECT_EXIST, condition)
+
+
+def load_checkpoint(path, target_version):
+    """Returns (last file_url, counters) of an earlier run for the same model, or (None, {})."""
+    if not path or not os.path.exists(path):
+        return None, {}
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("target_version") != target_version:
+        print(f"[checkpoint] {path} is for model {state.get('target_version')}, starting over")
+        return None, {}
+    return state.get("last_file_url"), state.get("stats", {})
+
+
+def save_checkpoint(path, target_version, last_file_url, stats):
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"target_version": target_version, "last_file_url": last_file_url, "stats": dict(stats),
+                   "updated_at": int(time.time())}, f, indent=2)
+    os.replace(tmp, path)
+
+
+def is_manual(columns):
+    """Whether the row's tags were edited by hand in manage-tags."""
+    return columns.get("tags_source") == MANUAL_SOURCE
+
+
+def stale_rows(ots_client, target_version, after=None):
+    """
+    Yields (file_url, columns, stale) for every media_metadata row after `after`, in primary key order.
+
+    A row is stale when its model_version differs from `target_version` and its tags are not manual.
+    """
+    start = [("file_url", after if after is not None else INF_MIN)]
+    end = [("file_url", INF_MAX)]
+    while start is not None:
+        _, start, rows, _ = ots_client.get_range(MEDIA_TABLE, Direction.FORWARD, start, end,
+                                                 columns_to_get=COLUMNS, limit=PAGE_LIMIT)
+        for row in rows:
+            file_url = row.primary_key[0][1]
+            if file_url == after:
+                continue
+            columns = {col[0]: col[1] for col in row.attribute_columns}
+            yield file_url, columns, columns.get("model_version") != target_version and not is_manual(columns)
+
+
+def _download(get_bucket, file_url):
+    """
+    The original's bytes, or None if it no longer exists.
+
+    Raises:
+        Exception: The last OSS error, if the download still fails after RETRIES retries.
+    """
+    bucket_name, key = _object_location(file_url)
+    for attempt in range(RETRIES + 1):
+        try:
+            return get_bucket(bucket_name).get_object(key).read()
+        except NoSuchKey:
+            print(f"  [missing] {file_url}")
+            return None
+        except Exception as e:
+            if attempt == RETRIES:
+                raise
+            print(f"  [retry] {file_url}: {e}")
+            time.sleep(RETRY_BASE_S * 2 ** attempt)
+
+
+def _apply_batch(ots_client, batch, detector, target_version, stats, dry_run):
+    """Re-tags one batch of (file_url, columns, image bytes); returns nothing, updates `stats`."""
+    images = [entry for entry in batch if entry[2] is not None]
+    stats["missing"] += len(batch) - len(images)
+    if not images:
+        return
+    detected = detector.detect_birds_in_images([data for _, _, data in images], with_boxes=True)
+    stats["inferred"] += len(images)
+
+    updates = []
+    for ((file_url, columns, _), result) in zip(images, detected):
+        if result is None:
+            # Keep the current tags rather than replacing them with an empty result.
+            print(f"  [undecodable] {file_url}, left as is")
+            stats["undecodable"] += 1
+            continue
+        tags, boxes = result
+        tags = species_names.normalize_tags(tags)
+        packed = detections.pack([(species_names.normalize(species), confidence, box)
+                                  for species, confidence, box in boxes], detector.DETECTION_FLOOR)
+        changed = species_index.species_counts(columns.get("tags") or {}) != tags
+        stats["changed" if changed else "unchanged"] += 1
+        updates.append((file_url, columns, tags, packed))
+    if dry_run:
+        return
+
+    # Phase 1: media_metadata, conditioned on the row not having been retagged or re-uploaded meanwhile.
+    items = [(MEDIA_TABLE, UpdateRowItem(Row([("file_url", file_url)],
+                                             {"PUT": [("tags", json.dumps(tags)), ("detections", packed),
+                                                      ("model_version", target_version)]}),
+                                         _retag_condition(columns)))
+             for file_url, columns, tags, packed in updates]
+    conflicts = set()
+    for start in range(0, len(items), BATCH_WRITE_LIMIT):
+        conflicts.update(item.row.primary_key[0][1] for _, item in write_batch(ots_client, items[start:start + BATCH_WRITE_LIMIT]))
+    stats["conflicts"] += len(conflicts)
+
+    # Phase 2: derived indexes, only for the rows whose update went through.
+    writer = BatchWriter(ots_client)
+    for file_url, columns, tags, _ in updates:
+        if file_url in conflicts:
+            print(f"  [conflict] {file_url} changed during the backfill, left as is")
+            continue
+        old_tags, thumbnail_url = columns.get("tags") or {}, columns.get("thumbnail_url")
+        species_index.sync(writer, file_url, old_tags, tags, thumbnail_url)
+        uploader_index.put(writer, file_url, columns.get("uploader"), columns.get("uploaded_at"), tags, thumbnail_url)
+        time_index.sync(writer, file_url, columns.get("uploaded_at"), species_index.species_counts(old_tags),
+                        species_index.species_counts(tags), tags=tags, thumbnail_url=thumbnail_url)
+        stats["updated"] += 1
+    try:
+        writer.flush()
+    except RuntimeError as e:
+        # media_metadata already holds the new tags, so running again would not revisit these rows.
+        raise RuntimeError(f"Index writes failed after media_metadata was updated ({e}); "
+                           f"run build_indexes.py to bring the index tables back in line") from e
+    stats["index_writes"] += writer.stats["rows"]
+    if len(updates) > len(conflicts):
+        catalog_version.bump(ots_client)
+
+
+def run_backfill(ots_client, get_bucket, detector, target_version, checkpoint=None, batch_size=8, prefetch=16,
+                 workers=4, rows_per_sec=None, limit=None, dry_run=False) -> Counter:
+    """
+    Re-tags every row whose model_version differs from `target_version`, except rows tagged by hand.
+
+    Parameters:
+        get_bucket (callable): bucket name -> oss2.Bucket (or local_emulator.FakeBucket).
+        detector: bird_detector module (anything with detect_birds_in_images).
+        prefetch (int): originals downloaded ahead of the batch being processed.
+        rows_per_sec (float): upper bound on re-tagged rows per second, or None.
+        limit (int): stop after this many stale rows.
+
+    Returns:
+        Counter: scanned / stale / manual / inferred / changed / unchanged / updated / conflicts / missing /
+                 undecodable / index_writes.
+
+    Raises:
+        Exception: An OSS or Tablestore error that persisted through the retries. The checkpoint still
+                   points before the batch that failed, so running again retries it.
+    """
+    after, saved = load_checkpoint(checkpoint, target_version)
+    stats = Counter(saved)
+    if after:
+        print(f"[checkpoint] resuming after {after}")
+    started = time.perf_counter()
+    done_at_start = stats["stale"]
+    pending = deque()  # (file_url, columns, future) in primary key order
+    batch = []
+    last_seen, limited = after, False
+
+    def finish_batch(last_file_url):
+        _apply_batch(ots_client, batch, detector, target_version, stats, dry_run)
+        batch.clear()
+        if not dry_run and last_file_url is not None:
+            save_checkpoint(checkpoint, target_version, last_file_url, stats)
+        if rows_per_sec:
+            # Sleep until the average rate since start is back under the cap.
+            ahead = (stats["stale"] - done_at_start) / rows_per_sec - (time.perf_counter() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def take_one():
+        file_url, columns, future = pending.popleft()
+        batch.append((file_url, columns, future.result()))
+        if len(batch) >= batch_size:
+            finish_batch(file_url)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for file_url, columns, stale in stale_rows(ots_client, target_version, after):
+            if stale and limit is not None and stats["stale"] - done_at_start >= limit:
+                limited = True
+                break
+            stats["scanned"] += 1
+            last_seen = file_url
+            if is_manual(columns):
+                stats["manual"] += 1
+            if stale:
+                stats["stale"] += 1
+                if dry_run:
+                    continue
+                pending.append((file_url, columns, pool.submit(_download, get_bucket, file_url)))
+                while len(pending) > prefetch:
+                    take_one()
+            if stats["scanned"] % 1000 == 0:
+                print(f"  {stats['scanned']} scanned, {stats['stale']} stale, {stats['updated']} updated "
+                      f"({time.perf_counter() - started:.1f}s)")
+        while pending:
+            take_one()
+        finish_batch(batch[-1][0] if batch else None)
+    if not dry_run and not limited and last_seen != after:
+        # The whole table has been seen; delete the checkpoint to scan it again for the same model.
+        save_checkpoint(checkpoint, target_version, last_seen, stats)
+    return stats
+
+
+def main():
+    p = argparse.ArgumentParser(description="Re-tag media_metadata rows written by an older model.pt")
+    p.add_argument("--model-dir", default=os.path.join(ROOT, "process-upload"),
+                   help="Function directory holding the new model files")
+    p.add_argument("--backend", default=None, choices=["pytorch", "onnx", "openvino"])
+    p.add_argument("--target-version", help="Model version to re-tag to (default: digest of the model in --model-dir)")
+    p.add_argument("--checkpoint", default="retag_backfill.checkpoint.json")
+    p.add_argument("--batch-size", type=int, default=8, help="Images per model call")
+    p.add_argument("--prefetch", type=int, default=16, help="Originals downloaded ahead of inference")
+    p.add_argument("--workers", type=int, default=4, help="Concurrent OSS downloads")
+    p.add_argument("--rows-per-sec", type=float, help="Throttle, so live uploads and queries are not starved")
+    p.add_argument("--limit", type=int, help="Stop after this many stale rows")
+    p.add_argument("--dry-run", action="store_true", help="Count the stale rows without downloading or writing")
+    p.add_argument("--endpoint", default="https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com")
+    p.add_argument("--instance", default="n01xiizqc116")
+    p.add_argument("--oss-endpoint", default="https://oss-cn-hangzhou-internal.aliyuncs.com")
+    args = p.parse_args()
+
+    from detector_loader import load_detector
+    detector = load_detector(args.model_dir)
+    if args.backend:
+        detector.set_backend(args.backend)
+    target_version = args.target_version or detector.model_version()
+
+    import oss2
+    key_id, key_secret = os.environ["ALIBABA_CLOUD_ACCESS_KEY_ID"], os.environ["ALIBABA_CLOUD_ACCESS_KEY_SECRET"]
+    ots_client = OTSClient(args.endpoint, key_id, key_secret, args.instance)
+    auth = oss2.Auth(key_id, key_secret)
+    buckets = {}
+
+    def get_bucket(name):
+        if name not in buckets:
+            buckets[name] = oss2.Bucket(auth, args.oss_endpoint, name)
+        return buckets[name]
+
+    print(f"Re-tagging rows not at model {target_version} (backend={detector.DETECTOR_BACKEND})")
+    started = time.perf_counter()
+    stats = run_backfill(ots_client, get_bucket, detector, target_version, checkpoint=args.checkpoint,
+                         batch_size=args.batch_size, prefetch=args.prefetch, workers=args.workers,
+                         rows_per_sec=args.rows_per_sec, limit=args.limit, dry_run=args.dry_run)
+    elapsed = time.perf_counter() - started
+    print(f"[完成] {stats['scanned']} scanned, {stats['stale']} stale, {stats['manual']} tagged by hand (kept), "
+          f"{stats['updated']} updated "
+          f"({stats['changed']} with new tags), {stats['conflicts']} conflicts, {stats['missing']} missing originals, "
+          f"{stats['undecodable']} undecodable, "
+          f"{stats['index_writes']} index writes in {elapsed:.1f}s"
+          f"{' (dry run, nothing written)' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# admission.py
+# Admission control for the inference endpoints: per-token and per-user rate limits and a cap on
+# concurrent inference, so one client looping uploads cannot take every warm instance.
+#
+# Copy this file into any function directory that should be throttled the same way (search-by-file
+# carries it today). Three checks, each answered with Rejected(reason, retry_after) -> HTTP 429:
+#   - rate: token buckets in memory, one per session token and one per user email; a request takes
+#     one token from both. RATE_LIMIT_BURST tokens, refilled at RATE_LIMIT_PER_MINUTE.
+#   - shared rate (optional): memory is per instance, so N warm instances allow N times the rate.
+#     Setting RATE_LIMIT_TABLE adds a per-user fixed-window counter in Tablestore, bumped with an
+#     atomic INCREMENT and read back. The table has one string primary key column 'limit_key'; give it
+#     a short time-to-live (e.g. one day) so old windows expire.
+#   - concurrency: at most INFERENCE_MAX_CONCURRENCY model calls run at once on an instance; a request
+#     waits up to INFERENCE_QUEUE_TIMEOUT_S for a slot.
+# Decisions are counted per instance (stats()) and on the invocation's trace ('admission.*').
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from tablestore import *
+import tracing
+
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_PER_MINUTE', '30'))  # 0 disables rate limiting
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', '10'))
+RATE_LIMIT_TABLE = os.environ.get('RATE_LIMIT_TABLE', '')
+RATE_LIMIT_WINDOW_S = 60
+RATE_LIMIT_MAX_KEYS = 10000  # least recently used buckets beyond this are dropped (a dropped key starts full)
+INFERENCE_MAX_CONCURRENCY = int(os.environ.get('INFERENCE_MAX_CONCURRENCY', '2'))
+INFERENCE_QUEUE_TIMEOUT_S = float(os.environ.get('INFERENCE_QUEUE_TIMEOUT_S', '5'))
+INFERENCE_RETRY_AFTER_S = 2
+
+
+class Rejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Too many requests ({reason}); retry after {retry_after:.1f}s.")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def response(self):
+        """The 429 response for the handler to return."""
+        return {
+            "statusCode": 429,
+            "headers": {"Content-Type": "application/json", "Retry-After": str(max(1, math.ceil(self.retry_after)))},
+            "body": json.dumps({"error": str(self), "reason": self.reason, "retry_after": self.retry_after})
+        }
+
+
+class TokenBuckets:
+    """Token buckets keyed by string, safe to share between threads."""
+
+    def __init__(self, per_minute, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of last update)
+        self._lock = threading.Lock()
+
+    def take(self, keys, now=None):
+        """
+        Takes one token from the bucket of every key, or from none of them.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds until every bucket has one.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            levels = {}
+            wait = 0.0
+            for key in keys:
+                tokens, updated = self._buckets.get(key, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                levels[key] = tokens
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / self.rate)
+            for key, tokens in levels.items():
+                self._buckets[key] = (tokens if wait else tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+_buckets = TokenBuckets(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+_inference_slots = threading.BoundedSemaphore(max(1, INFERENCE_MAX_CONCURRENCY))
+_in_flight = 0
+_stats_lock = threading.Lock()
+_counters = Counter()
+
+
+def _count(name):
+    with _stats_lock:
+        _counters[name] += 1
+    tracing.current().incr(f"admission.{name}")
+
+
+def _take_shared(ots_client, user, now):
+    """Counts the request in the user's Tablestore window; returns seconds to wait if over the limit."""
+    window = int(now // RATE_LIMIT_WINDOW_S)
+    pk = [('limit_key', f"{user}:{window}")]
+    ots_client.update_row(RATE_LIMIT_TABLE, Row(pk, {'INCREMENT': [('count', 1)]}),
+                          Condition(RowExistenceExpectation.IGNORE))
+    _, row, _ = ots_client.get_row(RATE_LIMIT_TABLE, pk, columns_to_get=['count'])
+    count = {col[0]: col[1] for col in row.attribute_columns}.get('count', 0) if row else 0
+    # Concurrent requests can both read the other's increment, so the check errs on the strict side.
+    limit = max(1, int(RATE_LIMIT_PER_MINUTE * RATE_LIMIT_WINDOW_S / 60))
+    if count > limit:
+        return (window + 1) * RATE_LIMIT_WINDOW_S - now
+    return 0.0
+
+
+def admit(token, user, ots_client=None):
+    """
+    Charges one request to `token` and `user`.
+
+    Raises:
+        Rejected: If either is over its rate limit.
+    """
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return
+    wait = _buckets.take([f"token:{token}", f"user:{user}"])
+    if wait:
+        _count('rejected.rate')
+        raise Rejected('rate', wait)
+    if RATE_LIMIT_TABLE and ots_client is not None:
+        try:
+            wait = _take_shared(ots_client, user, time.time())
+        except Exception as e:
+            # The shared counter is best-effort; the in-memory limit still applies.
+            print(f"[WARNING] Shared rate limit check failed: {e}")
+            _count('shared_errors')
+            wait = 0
+        if wait:
+            _count('rejected.shared_rate')
+            raise Rejected('shared_rate', wait)
+    _count('admitted')
+
+
+@contextmanager
+def inference_slot():
+    """
+    Holds one of INFERENCE_MAX_CONCURRENCY inference slots for the enclosed block.
+
+    Raises:
+        Rejected: If no slot frees up within INFERENCE_QUEUE_TIMEOUT_S.
+    """
+    global _in_flight
+    started = time.perf_counter()
+    if not _inference_slots.acquire(timeout=INFERENCE_QUEUE_TIMEOUT_S):
+        _count('rejected.concurrency')
+        raise Rejected('concurrency', INFERENCE_RETRY_AFTER_S)
+    tracing.current().add_span('admission.queue', (time.perf_counter() - started) * 1000)
+    with _stats_lock:
+        _in_flight += 1
+    try:
+        yield
+    finally:
+        with _stats_lock:
+            _in_flight -= 1
+        _inference_slots.release()
+
+
+def stats():
+    """This instance's admission counters, plus inference calls running now and rate-limit keys tracked."""
+    with _stats_lock:
+        return dict(_counters, in_flight=_in_flight, tracked_keys=len(_buckets))
@@ -0,0 +1,117 @@
+# detection_cache.py
+# Caches bird_detector results so repeated search-by-file queries skip inference.
+#
+# Tier 1 is an in-memory LRU that lives as long as the warm Function Compute instance.
+# Tier 2 is an optional Tablestore table shared by every instance. It is enabled by
+# setting the DETECTION_CACHE_TABLE environment variable; the table needs a single
+# string primary key column named 'cache_key'.
+# Only results of a successful inference are stored: a model failure or an image that cannot be
+# decoded raises out of detect_with_cache() and leaves both tiers untouched.
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from tablestore import *
+import admission
+import bird_detector
+
+CACHE_MAX_ENTRIES = int(os.environ.get('DETECTION_CACHE_SIZE', '256'))
+CACHE_TABLE_NAME = os.environ.get('DETECTION_CACHE_TABLE', '')
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_entries_model_version = None
+
+
+def make_cache_key(image_bytes, model_version, inference_settings):
+    """Builds the cache key from the image digest, model identity and threshold / tiling settings."""
+    image_digest = hashlib.sha256(image_bytes).hexdigest()
+    return f"{image_digest}:{model_version}:{inference_settings}"
+
+
+def _get_local(cache_key, model_version):
+    global _entries_model_version
+    with _lock:
+        # model.pt changed since these entries were stored, so none of them are valid.
+        if _entries_model_version != model_version:
+            _entries.clear()
+            _entries_model_version = model_version
+            return None
+        if cache_key not in _entries:
+            return None
+        _entries.move_to_end(cache_key)
+        return _entries[cache_key]
+
+
+def _put_local(cache_key, model_version, detected_tags):
+    global _entries_model_version
+    with _lock:
+        if _entries_model_version != model_version:
+            _entries.clear()
+            _entries_model_version = model_version
+        _entries[cache_key] = detected_tags
+        _entries.move_to_end(cache_key)
+        while len(_entries) > CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def _get_remote(ots_client, cache_key):
+    _, row, _ = ots_client.get_row(CACHE_TABLE_NAME, [('cache_key', cache_key)], columns_to_get=['detected_tags'])
+    if not row or not row.attribute_columns:
+        return None
+    columns = {col[0]: col[1] for col in row.attribute_columns}
+    return json.loads(columns['detected_tags'])
+
+
+def _put_remote(ots_client, cache_key, detected_tags):
+    attribute_columns = [('detected_tags', json.dumps(detected_tags)), ('created_at', int(time.time()))]
+    row = Row([('cache_key', cache_key)], attribute_columns)
+    ots_client.put_row(CACHE_TABLE_NAME, row, Condition(RowExistenceExpectation.IGNORE))
+
+
+def detect_with_cache(image_bytes, ots_client=None):
+    """
+    Returns bird_detector.detect_birds_in_image(image_bytes), reusing a cached result when possible.
+
+    Parameters:
+        image_bytes (bytes): The raw byte content of the image file (any bytes-like object).
+        ots_client (OTSClient): Optional client for the shared Tablestore tier.
+
+    Returns:
+        tuple: (detected_tags, source) where source is 'memory', 'tablestore' or 'model'.
+
+    Raises:
+        admission.Rejected: If the model is needed and no inference slot frees up in time.
+        bird_detector.ImageDecodeError: If the image cannot be decoded.
+        Exception: Whatever the model raised (load failure, out of memory); nothing is cached.
+    """
+    model_version = bird_detector.model_version()
+    cache_key = make_cache_key(image_bytes, model_version, bird_detector.inference_settings())
+
+    detected_tags = _get_local(cache_key, model_version)
+    if detected_tags is not None:
+        return detected_tags, 'memory'
+
+    use_remote = bool(CACHE_TABLE_NAME) and ots_client is not None
+    if use_remote:
+        try:
+            detected_tags = _get_remote(ots_client, cache_key)
+        except Exception as e:
+            # The shared tier is best-effort; fall through to inference.
+            print(f"[WARNING] Detection cache lookup failed: {e}")
+        if detected_tags is not None:
+            _put_local(cache_key, model_version, detected_tags)
+            return detected_tags, 'tablestore'
+
+    # Cache hits above never wait for an inference slot.
+    with admission.inference_slot():
+        detected_tags = bird_detector.detect_birds_in_image(image_bytes, raise_errors=True)
+    _put_local(cache_key, model_version, detected_tags)
+    if use_remote:
+        try:
+            _put_remote(ots_client, cache_key, detected_tags)
+        except Exception as e:
+            print(f"[WARNING] Detection cache write failed: {e}")
+    return detected_tags, 'model'
@@ -2,23 +2,48 @@
 import json
 import traceback
 import base64
+import binascii
+import os
 import time  # <--- 新增导入
+import oss2
 from tablestore import *
 # 假设你的AI模型检测代码在一个名为 bird_detector 的模块中
 import bird_detector
-# multipart/form-data 解析需要用到这个库
-from requests_toolbelt.multipart import decoder
+# 检测结果缓存（内存 LRU + 可选的 Tablestore 共享层）
+import detection_cache
+# multipart/form-data 零拷贝解析（按 boundary 扫描，返回 memoryview）
+import multipart
+# 每次调用的分段计时 + 一行结构化 JSON 日志
+import tracing
+# 准入控制：按 token / 用户限流 + 推理并发上限（超出返回 429 和 Retry-After）
+import admission
+# 全表扫描：主键区间并行扫描 + 每次请求的读取预算
+import parallel_scan
+import scan_budget
 
 # --- 请确保这些配置与你之前的函数一致 ---
 OTS_ENDPOINT = "https://n01xiizqc116.cn-hangzhou.vpc.tablestore.aliyuncs.com"  # <-- 注意：建议使用 ots-internal Endpoint
 OTS_INSTANCE_NAME = "n01xiizqc116"
 TABLE_NAME = 'media_metadata'
+OSS_BUCKET_NAME = 'birdtag-media-5225'
+# 以 JSON {"oss_key": ...} 方式搜索时允许读取的前缀（文件先通过 get-upload-url 直传到 OSS）
+SEARCH_KEY_PREFIXES = ('search-queries/', 'uploads/')
+# 直传对象的大小上限（与 get-upload-url 一致）；签名无法限制分片上传的实际大小，读取前在此检查
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', str(100 * 1024 * 1024)))
 
 
 # ---------------------------------------------
 
+def initializer(context):
+    """Function Compute initializer hook: pre-warms the detection model on a new instance."""
+    bird_detector.warm_up()
+
+
+@tracing.traced('search-by-file')
 def handler(event, context):
     print("Received search-by-file request")
+    trace = tracing.current()
+    trace.phase('parse')
 
     # 步骤一：【必须先做】解析事件，确保 event_dict 存在
     try:
@@ -28,6 +53,7 @@ def handler(event, context):
         return {"statusCode": 400, "body": json.dumps({"error": f"Failed to parse event data: {e}"})}
 
     # 步骤二：【第二步】进行Token验证
+    trace.phase('auth')
     try:
         headers = event_dict.get('headers', {})
         token = headers.get('authorization') or headers.get('Authorization')
@@ -35,9 +61,9 @@ def handler(event, context):
             raise ValueError("Authorization token is missing.")
 
         creds = context.credentials
-        ots_client = OTSClient(end_point=OTS_ENDPOINT, access_key_id=creds.access_key_id,
-                               access_key_secret=creds.access_key_secret, instance_name=OTS_INSTANCE_NAME,
-                               sts_token=creds.security_token)
+        ots_client = trace.wrap_ots(OTSClient(end_point=OTS_ENDPOINT, access_key_id=creds.access_key_id,
+                                              access_key_secret=creds.access_key_secret,
+                                              instance_name=OTS_INSTANCE_NAME, sts_token=creds.security_token))
 
         session_pk = [('token', token)]
         _, row, _ = ots_client.get_row('sessions', session_pk, columns_to_get=['user_email', 'expires_at'])
@@ -57,7 +83,18 @@ def handler(event, context):
     except Exception as e:
         return {"statusCode": 401, "body": json.dumps({"error": f"Unauthorized: {e}"})}
 
+    # 限流：在读取文件和推理之前检查，被拒绝的请求不消耗任何推理资源
+    trace.phase('admission')
+    try:
+        admission.admit(token, session_info.get('user_email'), ots_client)
+    except admission.Rejected as e:
+        print(f"Request rejected: {e}")
+        return e.response()
+    finally:
+        trace.set('admission', admission.stats())
+
     # 步骤三：【Token验证通过后】才执行业务逻辑
+    trace.phase('read_file')
     try:
         # 1. 解析 multipart/form-data 请求体
         headers = event_dict.get('headers', {})
@@ -69,22 +106,55 @@ def handler(event, context):
 
         if not content_type:
             raise ValueError("'Content-Type' header is missing.")
-        body_bytes = base64.b64decode(event_dict['body'])
-        multipart_data = decoder.MultipartDecoder(body_bytes, content_type)
+        if not event_dict.get('body'):
+            return {"statusCode": 400, "body": json.dumps({"error": "Request body is empty."})}
 
         file_content = None
-        for part in multipart_data.parts:
-            if part.headers[b'Content-Disposition'].decode('utf-8').startswith('form-data; name="file"'):
-                file_content = part.content
-                break
+        if content_type.lower().startswith('application/json'):
+            # 1b. 文件已直传到 OSS：请求体只有 {"oss_key": "..."}，由函数从内网读取
+            body_raw = event_dict['body']
+            request_body = json.loads(base64.b64decode(body_raw) if event_dict.get('isBase64Encoded') else body_raw)
+            oss_key = request_body.get('oss_key') if isinstance(request_body, dict) else None
+            if not oss_key or not oss_key.startswith(SEARCH_KEY_PREFIXES) or '..' in oss_key:
+                return {"statusCode": 400, "body": json.dumps({"error": "A valid 'oss_key' is required."})}
+            auth = oss2.StsAuth(creds.access_key_id, creds.access_key_secret, creds.security_token)
+            bucket = trace.wrap_bucket(
+                oss2.Bucket(auth, f"https://oss-{context.region}-internal.aliyuncs.com", OSS_BUCKET_NAME))
+            try:
+                remote = bucket.get_object(oss_key)
+            except oss2.exceptions.NoSuchKey:
+                return {"statusCode": 404, "body": json.dumps({"error": f"Object not found: {oss_key}"})}
+            # 只读取了响应头，超过上限时不下载正文
+            if remote.content_length > MAX_UPLOAD_SIZE:
+                remote.close()
+                return {"statusCode": 413,
+                        "body": json.dumps({"error": f"Object is larger than {MAX_UPLOAD_SIZE} bytes."})}
+            file_content = remote.read()
+        else:
+            # a2b_base64 直接读取 ASCII 字符串（b64decode 会先 encode 复制一份）；
+            # 之后 file_content 只是 body_bytes 上的一个 memoryview 切片
+            body_bytes = binascii.a2b_base64(event_dict.pop('body'))
+            file_content = multipart.find_part(body_bytes, content_type, 'file')
 
         if not file_content:
             raise ValueError("Multipart form data with a 'file' part is required.")
 
         # 2. 调用AI模型分析文件，获取标签
+        trace.phase('inference')
+        trace.incr('upload_bytes', len(file_content))
         print("Analyzing uploaded file with AI model...")
-        detected_tags = bird_detector.detect_birds_in_image(file_content)
-        print(f"Detected tags from file: {detected_tags}")
+        detect_start = time.time()
+        try:
+            detected_tags, cache_source = detection_cache.detect_with_cache(file_content, ots_client)
+        except admission.Rejected as e:
+            # 本实例的推理槽位已满且排队超时
+            print(f"Request rejected: {e}")
+            return e.response()
+        except bird_detector.ImageDecodeError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": f"The uploaded file is not a readable image: {e}"})}
+        detect_ms = (time.time() - detect_start) * 1000
+        trace.set('detection_source', cache_source)
+        print(f"Detected tags from file: {detected_tags} (source: {cache_source}, {detect_ms:.1f} ms)")
 
         if not detected_tags:
             return {
@@ -94,24 +164,42 @@ def handler(event, context):
             }
 
         # 3. 使用获取到的标签去数据库中查询 (注意：ots_client在Token验证时已创建)
-        results = []
-        inclusive_start_primary_key = [('file_url', INF_MIN)]
-        exclusive_end_primary_key = [('file_url', INF_MAX)]
-        consumed, next_start_primary_key, row_list, next_token = ots_client.get_range(
-            TABLE_NAME, Direction.FORWARD, inclusive_start_primary_key, exclusive_end_primary_key, limit=100)
-
-        for row in row_list:
+        trace.phase('query')
+        # 以前只读取第一页（前 100 行）；现在按主键区间并行扫描全表，并受扫描预算约束
+        query_params = event_dict.get('queryParameters', {}) or {}
+        if query_params.get('cursor'):
+            try:
+                ranges = scan_budget.decode_cursor(query_params['cursor'], ['file_url'])
+            except ValueError as e:
+                return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+        else:
+            ranges = parallel_scan.split_ranges(ots_client, TABLE_NAME, ['file_url'])
+        budget = scan_budget.ScanBudget()
+
+        def match_row(row):
             columns = {col[0]: col[1] for col in row.attribute_columns}
             tags_json = columns.get('tags')
             if tags_json:
                 db_tags = json.loads(tags_json)
-                is_match = any(tag in db_tags for tag in detected_tags.keys())
-                if is_match:
-                    file_url = columns.get('thumbnail_url') or row.primary_key[0][1]
-                    results.append(file_url)
+                if any(tag in db_tags for tag in detected_tags.keys()):
+                    return columns.get('thumbnail_url') or row.primary_key[0][1]
+            return None
+
+        results, remaining = parallel_scan.scan(ots_client, TABLE_NAME, ranges, match_row, budget=budget,
+                                                page_limit=100)
+        exhausted = budget.exhausted() if remaining else None
 
         # 4. 返回查询结果
+        trace.incr('rows_matched', len(results))
+        trace.phase('serialize')
         response_body = {"links": results}
+        if exhausted:
+            # 预算耗尽：返回部分结果；带上 ?cursor= 重新提交同一文件即可继续（检测结果会命中缓存）
+            print(f"[WARNING] Scan budget '{exhausted}' exhausted after {budget.usage()}")
+            trace.incr(f"scan_budget_exhausted.{exhausted}")
+            trace.set('scan_budget', dict(budget.usage(), exhausted=exhausted))
+            response_body.update({"partial": True, "budget_exhausted": exhausted,
+                                  "next_cursor": scan_budget.encode_cursor(remaining)})
         return {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json", "Content-Disposition": "inline"},
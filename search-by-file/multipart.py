@@ -0,0 +1,56 @@
+# multipart.py
+# Minimal multipart/form-data parser for search-by-file.
+#
+# Unlike requests_toolbelt's MultipartDecoder, which copies every part into its own bytes
+# object, this scans the decoded body for the boundary and returns the wanted part as a
+# memoryview slice, so the file content is never copied before it reaches np.frombuffer.
+import re
+
+_BOUNDARY_RE = re.compile(r'boundary=(?:"([^"]+)"|([^;\s]+))', re.IGNORECASE)
+_NAME_RE = re.compile(rb'[\s;]name="([^"]*)"', re.IGNORECASE)
+
+
+def get_boundary(content_type):
+    """Extracts the boundary parameter from a multipart Content-Type header."""
+    match = _BOUNDARY_RE.search(content_type or '')
+    if not match or not content_type.lower().startswith('multipart/'):
+        raise ValueError("Content-Type is not multipart with a boundary.")
+    return (match.group(1) or match.group(2)).encode('latin-1')
+
+
+def find_part(body, content_type, field_name='file'):
+    """
+    Locates a form field in a multipart/form-data body without copying it.
+
+    Parameters:
+        body (bytes): The complete, decoded request body.
+        content_type (str): The request's Content-Type header, including the boundary.
+        field_name (str): The form field to return.
+
+    Returns:
+        memoryview: A zero-copy view of the field's content, or None if the field is absent.
+    """
+    delimiter = b'--' + get_boundary(content_type)
+    wanted = field_name.encode('utf-8')
+    view = memoryview(body)
+
+    pos = body.find(delimiter)
+    while pos != -1:
+        headers_start = pos + len(delimiter)
+        if body[headers_start:headers_start + 2] == b'--':  # closing delimiter
+            return None
+        headers_end = body.find(b'\r\n\r\n', headers_start)
+        if headers_end == -1:
+            return None
+        content_start = headers_end + 4
+        next_pos = body.find(b'\r\n' + delimiter, content_start)
+        if next_pos == -1:
+            return None
+
+        for line in body[headers_start:headers_end].split(b'\r\n'):
+            if line[:20].lower() == b'content-disposition:':
+                match = _NAME_RE.search(line)
+                if match and match.group(1) == wanted:
+                    return view[content_start:next_pos]
+        pos = next_pos + 2
+    return None
@@ -0,0 +1,99 @@
+# scan_budget.py
+# Per-request limits for full-table get_range scans, and the continuation cursor returned when
+# a limit is reached.
+#
+# query-files, query-by-count and search-by-file carry identical copies of this file. A scan stops
+# before the next page once it has used SCAN_MAX_PAGES pages, SCAN_MAX_ROWS rows, SCAN_MAX_READ_CU
+# read capacity units (as reported in get_range's `consumed`) or SCAN_DEADLINE_MS of wall-clock
+# time. The handler then returns the matches found so far together with a cursor listing the key
+# ranges that were not read (one per parallel_scan range still in progress); passing it back as the
+# `cursor` query parameter resumes the scan there.
+import base64
+import binascii
+import json
+import os
+import threading
+import time
+from tablestore import INF_MIN, INF_MAX
+
+SCAN_MAX_PAGES = int(os.environ.get('SCAN_MAX_PAGES', '100'))
+SCAN_MAX_ROWS = int(os.environ.get('SCAN_MAX_ROWS', '10000'))
+SCAN_MAX_READ_CU = int(os.environ.get('SCAN_MAX_READ_CU', '1000'))
+# Leaves headroom below the API Gateway backend timeout for serializing the response.
+SCAN_DEADLINE_MS = int(os.environ.get('SCAN_DEADLINE_MS', '5000'))
+
+
+class ScanBudget:
+    def __init__(self, max_pages=None, max_rows=None, max_read_cu=None, deadline_ms=None):
+        self.max_pages = SCAN_MAX_PAGES if max_pages is None else max_pages
+        self.max_rows = SCAN_MAX_ROWS if max_rows is None else max_rows
+        self.max_read_cu = SCAN_MAX_READ_CU if max_read_cu is None else max_read_cu
+        self.deadline = time.monotonic() + (SCAN_DEADLINE_MS if deadline_ms is None else deadline_ms) / 1000
+        self.pages = 0
+        self.rows = 0
+        self.read_cu = 0
+        # Shared by the parallel_scan workers of one request.
+        self._lock = threading.Lock()
+
+    def charge(self, consumed, row_count):
+        """Records one get_range page."""
+        with self._lock:
+            self.pages += 1
+            self.rows += row_count
+            if consumed is not None and getattr(consumed, 'read', None):
+                self.read_cu += consumed.read
+
+    def exhausted(self):
+        """Returns the name of the first limit reached ('pages', 'rows', 'read_cu', 'deadline'), or None."""
+        if self.pages >= self.max_pages:
+            return 'pages'
+        if self.rows >= self.max_rows:
+            return 'rows'
+        if self.read_cu >= self.max_read_cu:
+            return 'read_cu'
+        if time.monotonic() >= self.deadline:
+            return 'deadline'
+        return None
+
+    def usage(self):
+        return {'pages': self.pages, 'rows': self.rows, 'read_cu': self.read_cu}
+
+
+def _encode_value(value):
+    if value is INF_MIN:
+        return {'inf': -1}
+    if value is INF_MAX:
+        return {'inf': 1}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return INF_MIN if value.get('inf') == -1 else INF_MAX
+    return value
+
+
+def encode_cursor(ranges):
+    """Turns the unread (start_pk, end_pk) ranges of a scan into an opaque, URL-safe string."""
+    payload = [[[[name, _encode_value(value)] for name, value in pk] for pk in key_range] for key_range in ranges]
+    raw = json.dumps(payload, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, key_names):
+    """
+    Inverse of encode_cursor; returns a list of (inclusive_start_pk, exclusive_end_pk).
+
+    Raises:
+        ValueError: If the cursor is malformed or its key columns are not `key_names`.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        ranges = [tuple([(name, _decode_value(value)) for name, value in pk] for pk in key_range)
+                  for key_range in json.loads(raw)]
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    for key_range in ranges:
+        if len(key_range) != 2 or any([name for name, _ in pk] != list(key_names) for pk in key_range):
+            raise ValueError("Invalid cursor: primary key does not match this table.")
+    return ranges
@@ -0,0 +1,40 @@
+# index.py for species-suggest function
+# 物种名自动补全：GET /species/suggest?prefix=cr&limit=10
+# 前缀树由 model.names.json 和 species_synonyms.json 构建，每个热实例只构建一次，查询不访问任何存储。
+# 与 register-user 一样不需要 Token：返回的只是模型的类别名和同义词表。
+import json
+import species_names
+import tracing
+
+DEFAULT_LIMIT = 8
+
+
+def initializer(context):
+    """Function Compute initializer hook: builds the trie before the first request."""
+    species_names.vocabulary()
+
+
+@tracing.traced('species-suggest')
+def handler(event, context):
+    trace = tracing.current()
+    trace.phase('parse')
+    try:
+        event_dict = json.loads(event.decode('utf-8') if isinstance(event, (bytes, bytearray)) else event)
+        query_params = event_dict.get('queryParameters', {}) or {}
+        prefix = query_params.get('prefix') or query_params.get('q') or ''
+        limit = int(query_params.get('limit') or DEFAULT_LIMIT)
+        if not 1 <= limit <= species_names.MAX_SUGGESTIONS:
+            raise ValueError(f"'limit' must be between 1 and {species_names.MAX_SUGGESTIONS}.")
+    except (json.JSONDecodeError, ValueError, TypeError) as e:
+        return {"statusCode": 400, "body": json.dumps({"error": f"Invalid request: {e}"})}
+
+    trace.phase('lookup')
+    suggestions = species_names.suggest(prefix, limit)
+    trace.phase('serialize')
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json", "Content-Disposition": "inline",
+                    "Cache-Control": "public, max-age=3600"},
+        "body": json.dumps({"prefix": prefix, "suggestions": suggestions,
+                            "canonical": species_names.normalize(prefix) if prefix else None})
+    }
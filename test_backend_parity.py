@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+bird_detector 推理后端一致性 & 性能对比脚本
+
+Runs every image in test_images/ through the PyTorch backend and each exported backend,
+checks that the {species: count} results agree, and prints per-backend latency and throughput.
+
+运行方式：
+    python export_model.py --weights search-by-file/model.pt          # 先导出 model.onnx
+    python test_backend_parity.py                                     # pytorch vs onnx
+    python test_backend_parity.py --backends pytorch onnx openvino --repeat 5
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from detector_loader import load_detector
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def hr(title: str = "", char: str = "-"):
+    line = char * 70
+    print(f"\n{line}\n{title}\n{line}" if title else f"\n{line}")
+
+
+def run_backend(detector, backend: str, images: List[Tuple[str, bytes]], repeat: int):
+    detector.set_backend(backend)
+    detector.warm_up()
+    counts: Dict[str, dict] = {}
+    latencies_ms: List[float] = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for name, data in images:
+            t0 = time.perf_counter()
+            counts[name] = detector.detect_birds_in_image(data)
+            latencies_ms.append((time.perf_counter() - t0) * 1000)
+    wall = time.perf_counter() - started
+    return counts, latencies_ms, wall
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Compare bird_detector backends for parity and speed")
+    p.add_argument("--model-dir", default=os.path.join(ROOT, "search-by-file"), help="Directory holding model.pt / model.onnx")
+    p.add_argument("--images", default=os.path.join(ROOT, "test_images"), help="Directory of test images")
+    p.add_argument("--backends", nargs="+", default=["pytorch", "onnx"], help="First backend is the reference")
+    p.add_argument("--repeat", type=int, default=3, help="Timed passes over the image set")
+    args = p.parse_args()
+
+    detector = load_detector(args.model_dir)
+    paths = sorted(glob.glob(os.path.join(args.images, "*.jpg")) + glob.glob(os.path.join(args.images, "*.png")))
+    if not paths:
+        print(f"[错误] No images found in {args.images}")
+        sys.exit(1)
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), f.read()))
+
+    results = {}
+    for backend in args.backends:
+        hr(f"Backend: {backend}")
+        counts, latencies_ms, wall = run_backend(detector, backend, images, args.repeat)
+        results[backend] = counts
+        print(f"cold start       : {detector.timings}")
+        print(f"images/sec       : {len(latencies_ms) / wall:.2f}")
+        print(f"latency p50/p95  : {statistics.median(latencies_ms):.1f} / {percentile(latencies_ms, 95):.1f} ms")
+
+    reference = args.backends[0]
+    all_passed = True
+    for backend in args.backends[1:]:
+        hr(f"Parity: {backend} vs {reference}", "=")
+        mismatches = 0
+        for name, _ in images:
+            expected, actual = results[reference][name], results[backend][name]
+            ok = expected == actual
+            mismatches += 0 if ok else 1
+            print(f"{name:>20}: {'PASS ✅' if ok else 'FAIL ❌'}  {'' if ok else f'{reference}={expected} {backend}={actual}'}")
+        print(f"\n一致 {len(images) - mismatches}/{len(images)} 张图片")
+        all_passed = all_passed and mismatches == 0
+
+    sys.exit(0 if all_passed else 1)
+
+
+if __name__ == "__main__":
+    main()
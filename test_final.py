@@ -10,6 +10,7 @@ Aliyun API 网关接口联调脚本（最终版 - 带认证）
 4. POST /tags/manage                    —— 手动管理标签（添加/删除）
 5. POST /files/delete                   —— 删除文件（需确认）
 6. POST /search-by-file                 —— 以图搜图（multipart/form-data 文件上传）
+7. POST /upload-url                     —— 获取 OSS 预签名直传 URL，再以 oss_key 调用 /search-by-file
 
 运行方式：
     python final_demo.py
@@ -212,6 +213,44 @@ def test_search_by_file(image_path: str = IMAGE_FILE_PATH) -> Tuple[bool, str]:
         return False, str(e)
 
 
+def test_presigned_search(image_path: str = IMAGE_FILE_PATH) -> Tuple[bool, str]:
+    hr("用例 7：POST /upload-url + POST OSS + POST /search-by-file (oss_key) (受保护)")
+    api_url = f"{API_GATEWAY_DOMAIN}/upload-url"
+    headers = {"Authorization": session["token"]}  # <--- 携带Token
+    if not os.path.isfile(image_path):
+        msg = f"测试图片文件未找到: {image_path}";
+        print("[错误]", msg);
+        return False, msg
+    mime = mimetypes.guess_type(image_path)[0] or "application/octet-stream"
+    body = {"filename": os.path.basename(image_path), "content_type": mime,
+            "size": os.path.getsize(image_path), "purpose": "search"}
+    print(f"[请求] POST {api_url}\n[Body]\n{pretty(body)}")
+    try:
+        resp = requests.post(api_url, json=body, headers=headers, timeout=TIMEOUT_SECONDS, proxies=PROXIES)
+        print(f"[HTTP] {resp.status_code}");
+        assert_2xx(resp);
+        signed = resp.json();
+        print("[JSON]\n" + pretty(signed))
+
+        # PostObject 表单：policy 限制文件不超过声明的 size，file 字段必须放在最后
+        with open(image_path, "rb") as f:
+            post = requests.post(signed["post"]["url"], data=signed["post"]["fields"],
+                                 files={"file": (os.path.basename(image_path), f, mime)},
+                                 timeout=TIMEOUT_SECONDS, proxies=PROXIES)
+        print(f"[POST OSS] {post.status_code}");
+        assert_2xx(post)
+
+        search_url = f"{API_GATEWAY_DOMAIN}/search-by-file"
+        resp = requests.post(search_url, json={"oss_key": signed["key"]}, headers=headers, timeout=TIMEOUT_SECONDS, proxies=PROXIES)
+        print(f"[HTTP] {resp.status_code}");
+        assert_2xx(resp);
+        print("[JSON]\n" + pretty(resp.json()))
+        return True, "OK"
+    except Exception as e:
+        print("[错误]", e);
+        return False, str(e)
+
+
 # ========== 汇总 & CLI ==========
 def summarize(results: List[Tuple[str, bool, str]]):
     hr("测试汇总", "=")
@@ -231,6 +270,7 @@ def parse_args():
     p.add_argument("--manage", action="store_true", help="仅运行：POST /tags/manage")
     p.add_argument("--delete", action="store_true", help="运行：POST /files/delete（危险操作）")
     p.add_argument("--upload", action="store_true", help="运行：POST /search-by-file（文件上传）")
+    p.add_argument("--presign", action="store_true", help="运行：POST /upload-url 直传 OSS 后按 oss_key 以图搜图")
     p.add_argument("--force", action="store_true", help="删除时跳过交互确认")
     p.add_argument("--image", type=str, help="指定上传图片路径（覆盖默认 IMAGE_FILE_PATH）")
     p.add_argument("--skip-auth", action="store_true", help="跳过注册和登录，直接调用业务API（用于测试未保护的API）")
@@ -261,7 +301,7 @@ def main():
         sys.exit(1)
 
     # --- 业务API测试 ---
-    run_any = args.search or args.count or args.manage or args.delete or args.upload
+    run_any = args.search or args.count or args.manage or args.delete or args.upload or args.presign
 
     if not run_any or args.search:
         ok, msg = test_search_by_species();
@@ -291,6 +331,10 @@ def main():
         ok, msg = test_search_by_file();
         results.append(("POST /search-by-file", ok, msg))
 
+    if args.presign:
+        ok, msg = test_presigned_search();
+        results.append(("POST /upload-url", ok, msg))
+
     all_passed = summarize(results)
     sys.exit(0 if all_passed else 1)
 